@@ -0,0 +1,680 @@
+#!/usr/bin/env python
+
+import os, sys, io, time, shutil, subprocess, tempfile, struct, wave, random, json, zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import microservices_batch_processing as mbp
+
+# peak memory, where there's a way to ask for it
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+'''
+Benchmarks for microservices_batch_processing.py
+
+Everything runs against generated files in a temporary directory,
+so these can be run on any machine without touching the shares.
+
+    python benchmarks.py hashing
+    python benchmarks.py multi_digest
+    python benchmarks.py worker_scaling
+    python benchmarks.py enumeration
+    python benchmarks.py media_headers
+    python benchmarks.py duplicates
+    python benchmarks.py io_modes
+    python benchmarks.py share_latency
+    python benchmarks.py deep_verify
+    python benchmarks.py end_to_end
+'''
+
+
+# generate a flat directory of files filled with random bytes
+def make_test_files(test_dir, file_count, file_size):
+    test_files = []
+    for file_number in range(file_count):
+        name_with_path = os.path.join(test_dir, 'test_file_%05d.bin' % file_number)
+        with open(name_with_path, 'wb') as test_outfile:
+            test_outfile.write(os.urandom(file_size))
+        test_files.append(name_with_path)
+    return test_files
+
+# generate a nested directory tree, files_per_dir random files in each dir
+def make_test_tree(test_dir, dir_count, files_per_dir, file_size):
+    test_files = []
+    for dir_number in range(dir_count):
+        # a couple of levels deep, like the shares
+        sub_dir = os.path.join(test_dir, 'dir_%03d' % (dir_number // 10), 'sub_%03d' % dir_number)
+        os.makedirs(sub_dir, exist_ok=True)
+        test_files.extend(make_test_files(sub_dir, files_per_dir, file_size))
+    return test_files
+
+# minimal, well-formed media files with the headers mediainfo() reads.
+#   image data is random, with no 0xFF bytes so it can't be read as a marker.
+#   given an rng (a random.Random) it's the same every time
+def image_data(size, rng=None):
+    return (rng.randbytes(size) if rng is not None else os.urandom(size)).replace(b'\xff', b'\x00')
+
+def make_test_jpeg(name_with_path, width, height, rng=None):
+    with open(name_with_path, 'wb') as media_outfile:
+        media_outfile.write(b'\xff\xd8')
+        media_outfile.write(b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+        media_outfile.write(b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01')
+        media_outfile.write(b'\xff\xda' + struct.pack('>H', 12) + b'\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00')
+        media_outfile.write(image_data(width * height // 4, rng))
+        media_outfile.write(b'\xff\xd9')
+
+def jp2_box(box_type, data):
+    return struct.pack('>I', len(data) + 8) + box_type + data
+
+def make_test_jp2(name_with_path, width, height):
+    image_header = jp2_box(b'ihdr', struct.pack('>IIHBBBB', height, width, 3, 7, 7, 0, 0))
+    colour = jp2_box(b'colr', struct.pack('>BBBI', 1, 0, 0, 16))
+    image_size = struct.pack('>HHIIIIIIIIH', 47, 0, width, height, 0, 0, width, height, 0, 0, 3) + b'\x07\x01\x01' * 3
+    # reversible 5-3 transform, so lossless
+    coding_style = struct.pack('>HBBHBBBBBB', 12, 0, 0, 1, 1, 5, 4, 4, 0, 1)
+    tile_data = image_data(width * height // 4)
+    tile_part = b'\xff\x90' + struct.pack('>HHIBB', 10, 0, 14 + len(tile_data), 0, 1) + b'\xff\x93' + tile_data
+    codestream = b'\xff\x4f' + b'\xff\x51' + image_size + b'\xff\x52' + coding_style + tile_part + b'\xff\xd9'
+    with open(name_with_path, 'wb') as media_outfile:
+        media_outfile.write(jp2_box(b'jP  ', b'\r\n\x87\n'))
+        media_outfile.write(jp2_box(b'ftyp', b'jp2 \x00\x00\x00\x00jp2 '))
+        media_outfile.write(jp2_box(b'jp2h', image_header + colour))
+        media_outfile.write(jp2_box(b'jp2c', codestream))
+
+# uncompressed RGB, one strip
+def make_test_tiff(name_with_path, width, height, rng=None):
+    entry_count = 10
+    bits_offset = 8 + 2 + entry_count * 12 + 4
+    strip_offset = bits_offset + 6
+    entries = [(256, 4, 1, width), (257, 4, 1, height), (258, 3, 3, bits_offset), (259, 3, 1, 1), (262, 3, 1, 2),
+        (273, 4, 1, strip_offset), (277, 3, 1, 3), (278, 4, 1, height), (279, 4, 1, width * height * 3), (284, 3, 1, 1)]
+    with open(name_with_path, 'wb') as media_outfile:
+        media_outfile.write(b'II*\x00' + struct.pack('<I', 8) + struct.pack('<H', entry_count))
+        for tag, field_type, value_count, value in entries:
+            if field_type == 3 and value_count == 1:
+                media_outfile.write(struct.pack('<HHIHH', tag, field_type, value_count, value, 0))
+            else:
+                media_outfile.write(struct.pack('<HHII', tag, field_type, value_count, value))
+        media_outfile.write(struct.pack('<I', 0) + struct.pack('<HHH', 8, 8, 8))
+        media_outfile.write(rng.randbytes(width * height * 3) if rng is not None else os.urandom(width * height * 3))
+
+def make_test_wav(name_with_path, sampling_rate, seconds):
+    with wave.open(name_with_path, 'wb') as media_outfile:
+        media_outfile.setnchannels(2)
+        media_outfile.setsampwidth(3)
+        media_outfile.setframerate(sampling_rate)
+        media_outfile.writeframes(os.urandom(sampling_rate * seconds * 6))
+
+# a video and an audio track, with the moov atom after the media data
+def make_test_mov(name_with_path, width, height, sampling_rate):
+    def atom(atom_type, *children):
+        data = b''.join(children)
+        return struct.pack('>I', len(data) + 8) + atom_type + data
+    def track(handler_type, track_header, sample_entry, time_scale):
+        return atom(b'trak',
+            atom(b'tkhd', b'\x00\x00\x00\x0f' + b'\x00' * 72 + track_header),
+            atom(b'mdia',
+                atom(b'mdhd', struct.pack('>B3xIII', 0, 0, 0, time_scale) + b'\x00' * 8),
+                atom(b'hdlr', struct.pack('>4x4s4s', b'mhlr', handler_type) + b'\x00' * 13),
+                atom(b'minf', atom(b'stbl', atom(b'stsd', struct.pack('>4xI', 1) + sample_entry)))))
+    video_entry = atom(b'avc1', b'\x00' * 6 + struct.pack('>H', 1) + b'\x00' * 16 + struct.pack('>HHII4xH', width, height, 0x480000, 0x480000, 1) + b'\x00' * 32 + struct.pack('>Hh', 24, -1))
+    audio_entry = atom(b'lpcm', b'\x00' * 6 + struct.pack('>H', 1) + b'\x00' * 8 + struct.pack('>HHHHI', 2, 16, 0, 0, sampling_rate << 16))
+    with open(name_with_path, 'wb') as media_outfile:
+        media_outfile.write(atom(b'ftyp', b'qt  \x00\x00\x02\x00qt  '))
+        media_outfile.write(atom(b'mdat', image_data(width * height // 4)))
+        media_outfile.write(atom(b'moov',
+            atom(b'mvhd', b'\x00' * 100),
+            track(b'vide', struct.pack('>II', width << 16, height << 16), video_entry, 600),
+            track(b'soun', b'\x00' * 8, audio_entry, sampling_rate)))
+
+# file_count of each kind of media file, returns {path: expected fields}
+def make_test_media(test_dir, file_count, width=640, height=480, sampling_rate=48000):
+    test_media = {}
+    for file_number in range(file_count):
+        media_name = os.path.join(test_dir, 'test_media_%05d' % file_number)
+        make_test_jpeg(media_name + '.jpg', width, height)
+        test_media[media_name + '.jpg'] = {'Format': 'JPEG', 'Width': str(width), 'Height': str(height), 'BitDepth': '8', 'SamplingRate': ''}
+        make_test_jp2(media_name + '.jp2', width, height)
+        test_media[media_name + '.jp2'] = {'Format': 'JPEG 2000', 'Width': str(width), 'Height': str(height), 'BitDepth': '8', 'SamplingRate': '', 'Compression_Mode': 'Lossless'}
+        make_test_tiff(media_name + '.tif', width, height)
+        test_media[media_name + '.tif'] = {'Format': 'TIFF', 'Width': str(width), 'Height': str(height), 'BitDepth': '8', 'SamplingRate': ''}
+        make_test_wav(media_name + '.wav', sampling_rate, 1)
+        test_media[media_name + '.wav'] = {'Format': 'Wave', 'Width': '', 'Height': '', 'BitDepth': '24', 'SamplingRate': str(sampling_rate)}
+        make_test_mov(media_name + '.mov', width, height, sampling_rate)
+        test_media[media_name + '.mov'] = {'Format': 'QuickTime', 'Width': str(width), 'Height': str(height), 'BitDepth': '24', 'SamplingRate': str(sampling_rate)}
+    return test_media
+
+# every file under test_dir with a plain os.walk, the way it used to be found
+def os_walk_files(test_dir):
+    test_files = []
+    for root, dirs, files in os.walk(test_dir):
+        for name in files:
+            test_files.append(os.path.join(root, name))
+    return test_files
+
+# the subprocess path: one process per file, like certUtil.
+#   certUtil only exists on windows, so elsewhere openssl stands in for it
+#   (the cost being measured is the process spawn, not the hash)
+def subprocess_checksum(name_with_path, checksum_type):
+    if shutil.which('certUtil'):
+        return mbp.certutil_checksum(name_with_path, checksum_type)
+    run_checksum = subprocess.check_output(['openssl', 'dgst', '-%s' % checksum_type.lower(), '-r', name_with_path])
+    return mbp.normalize_checksum(run_checksum.decode().split()[0])
+
+# time one checksum function over all files, returns seconds and digests
+def time_checksums(checksum_function, test_files, checksum_type):
+    digests = []
+    start_time = time.perf_counter()
+    for name_with_path in test_files:
+        digests.append(checksum_function(name_with_path, checksum_type))
+    return time.perf_counter() - start_time, digests
+
+def print_result(label, seconds, file_count, total_bytes):
+    print('%-28s %8.3fs %10.1f files/s %10.1f MB/s' % (label, seconds, file_count / seconds, total_bytes / seconds / 1024 / 1024))
+
+# in-process hashing vs. the per-file subprocess
+def benchmark_hashing(file_count=200, file_size=1024 * 1024, checksum_types=('MD5', 'SHA1', 'SHA256')):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    try:
+        test_files = make_test_files(test_dir, file_count, file_size)
+        total_bytes = file_count * file_size
+        print('%s\nHASHING: %s files of %s bytes\n%s' % ('='*80, file_count, file_size, '='*80))
+        for checksum_type in checksum_types:
+            # warm the cache so both paths read from memory
+            time_checksums(mbp.hashlib_checksum, test_files, checksum_type)
+            hashlib_seconds, hashlib_digests = time_checksums(mbp.hashlib_checksum, test_files, checksum_type)
+            print_result('%s in-process' % checksum_type, hashlib_seconds, file_count, total_bytes)
+            if shutil.which('certUtil') or shutil.which('openssl'):
+                subprocess_seconds, subprocess_digests = time_checksums(subprocess_checksum, test_files, checksum_type)
+                print_result('%s subprocess' % checksum_type, subprocess_seconds, file_count, total_bytes)
+                # the in-process engine has to give the same digests
+                if hashlib_digests != subprocess_digests:
+                    print('---WARNING, DIGESTS DO NOT MATCH FOR %s' % checksum_type)
+            else:
+                print('%-28s skipped, no certUtil or openssl' % ('%s subprocess' % checksum_type))
+    finally:
+        shutil.rmtree(test_dir)
+
+# one read per checksum type vs. every checksum type from a single read
+def benchmark_multi_digest(file_count=20, file_size=32 * 1024 * 1024, checksum_types=('MD5', 'SHA1', 'SHA256')):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    try:
+        test_files = make_test_files(test_dir, file_count, file_size)
+        total_bytes = file_count * file_size
+        print('%s\nMULTI-DIGEST: %s files of %s bytes, %s\n%s' % ('='*80, file_count, file_size, ' '.join(checksum_types), '='*80))
+        start_time = time.perf_counter()
+        separate_digests = [{checksum_type: mbp.hashlib_checksum(name_with_path, checksum_type) for checksum_type in checksum_types} for name_with_path in test_files]
+        print_result('one read per type', time.perf_counter() - start_time, file_count, total_bytes)
+        start_time = time.perf_counter()
+        single_pass_digests = [mbp.hashlib_checksums(name_with_path, list(checksum_types)) for name_with_path in test_files]
+        print_result('single pass', time.perf_counter() - start_time, file_count, total_bytes)
+        if separate_digests != single_pass_digests:
+            print('---WARNING, SINGLE PASS DIGESTS DO NOT MATCH')
+    finally:
+        shutil.rmtree(test_dir)
+
+# recursive_by_file() over a local tree with an increasing number of workers
+def benchmark_worker_scaling(dir_count=40, files_per_dir=25, file_size=256 * 1024, worker_counts=(1, 2, 4, 8), pool_types=('thread', 'process')):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    inventory_dir = tempfile.mkdtemp(prefix='checksum_benchmark_inventory_')
+    try:
+        make_test_tree(test_dir, dir_count, files_per_dir, file_size)
+        file_count = dir_count * files_per_dir
+        total_bytes = file_count * file_size
+        print('%s\nWORKER SCALING: %s files of %s bytes\n%s' % ('='*80, file_count, file_size, '='*80))
+        for pool_type in pool_types:
+            for worker_count in worker_counts:
+                seconds = time_inventory(test_dir, inventory_dir, worker_count, pool_type)
+                print_result('%s pool, %s worker(s)' % (pool_type, worker_count), seconds, file_count, total_bytes)
+    finally:
+        shutil.rmtree(test_dir)
+        shutil.rmtree(inventory_dir)
+
+# one inventory run of test_dir through recursive_by_file, returns seconds
+def time_inventory(test_dir, inventory_dir, worker_count, pool_type):
+    checkpoint_inventory_name = os.path.join(inventory_dir, 'benchmark_%s_%s.csv' % (pool_type, worker_count))
+    inventory_writer = mbp.open_inventory_writer(checkpoint_inventory_name, mbp.inventory_header(['MD5']))
+    catalog = mbp.open_catalog(os.path.join(inventory_dir, 'benchmark_%s_%s.sqlite' % (pool_type, worker_count)))
+    # recursive_by_file prints every directory, keep the output to results
+    with open(os.devnull, 'w') as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        start_time = time.perf_counter()
+        try:
+            not_selected_acc = mbp.new_not_selected_acc()
+            file_items = mbp.file_name_inventory(test_dir, True, '', [], not_selected_acc, os.path.join(inventory_dir, 'File_Name_Acc.txt'))
+            mbp.recursive_by_file(test_dir, True, '', [], 'MD5', inventory_writer, True, mbp.new_previous_inventory(), file_items, not_selected_acc, inventory_dir, 'benchmark', checkpoint_inventory_name, mbp.new_duplicate_index(), catalog, worker_count, pool_type)
+        finally:
+            seconds = time.perf_counter() - start_time
+            sys.stdout = stdout
+            mbp.close_inventory_writer(inventory_writer)
+            catalog.close()
+    return seconds
+
+# os.walk vs. the scandir walk with an increasing number of workers.
+#   on a local disk listing is cheap, the workers pay off on a share
+#   where every directory listing is a round trip
+def benchmark_enumeration(dir_count=400, files_per_dir=25, enumerate_worker_counts=(1, 4, 8, 16)):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    try:
+        make_test_tree(test_dir, dir_count, files_per_dir, 0)
+        file_count = dir_count * files_per_dir
+        print('%s\nENUMERATION: %s files in %s directories\n%s' % ('='*80, file_count, dir_count, '='*80))
+        start_time = time.perf_counter()
+        walked_files = os_walk_files(test_dir)
+        seconds = time.perf_counter() - start_time
+        print('%-28s %8.3fs %10.1f files/s' % ('os.walk', seconds, file_count / seconds))
+        for enumerate_workers in enumerate_worker_counts:
+            start_time = time.perf_counter()
+            scanned_files = [name_with_path for name_with_path, file_stat in mbp.walk_files(test_dir, enumerate_workers)]
+            seconds = time.perf_counter() - start_time
+            print('%-28s %8.3fs %10.1f files/s' % ('scandir, %s worker(s)' % enumerate_workers, seconds, file_count / seconds))
+            # same files in the same order as os.walk
+            if scanned_files != walked_files:
+                print('---WARNING, SCANDIR WALK DOES NOT MATCH OS.WALK')
+    finally:
+        shutil.rmtree(test_dir)
+
+# mediainfo() reading headers natively vs. running MediaInfo for every file
+def benchmark_media_headers(file_count=200):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    try:
+        test_media = make_test_media(test_dir, file_count)
+        print('%s\nMEDIA HEADERS: %s files\n%s' % ('='*80, len(test_media), '='*80))
+        start_time = time.perf_counter()
+        for name_with_path, expected in test_media.items():
+            mediainfo_dict = mbp.read_media_header(name_with_path)
+            # the fields read have to be the ones the file was made with
+            if mediainfo_dict is None or any(mediainfo_dict[field] != value for field, value in expected.items()):
+                print('---WARNING, HEADER NOT READ AS EXPECTED:\n   %s\n   %s' % (name_with_path, mediainfo_dict))
+        seconds = time.perf_counter() - start_time
+        print('%-28s %8.3fs %10.1f files/s' % ('native headers', seconds, len(test_media) / seconds))
+        if shutil.which('MediaInfo') or shutil.which('mediainfo'):
+            start_time = time.perf_counter()
+            for name_with_path in test_media:
+                mbp.mediainfo_fields(name_with_path)
+            seconds = time.perf_counter() - start_time
+            print('%-28s %8.3fs %10.1f files/s' % ('MediaInfo subprocess', seconds, len(test_media) / seconds))
+        else:
+            print('%-28s skipped, no MediaInfo' % ('MediaInfo subprocess'))
+    finally:
+        shutil.rmtree(test_dir)
+
+# a tree where most files have a size of their own, like the collection:
+#   every duplicate_every-th file is a copy of the one before it, and as many
+#   returns (original, copy) for each copy, the duplicates that have to be found
+#   returns the copies, which are the duplicates that have to be found
+def make_duplicate_tree(test_dir, file_count, duplicate_every, min_size, max_size):
+    copies = []
+    size_step = max((max_size - min_size) // file_count, 1)
+    previous_name = None
+    for file_number in range(file_count):
+        name_with_path = os.path.join(test_dir, 'dir_%03d' % (file_number % 20), 'test_file_%05d.bin' % file_number)
+        os.makedirs(os.path.dirname(name_with_path), exist_ok=True)
+        if previous_name is not None and file_number % duplicate_every == 0:
+            shutil.copyfile(previous_name, name_with_path)
+            copies.append((previous_name, name_with_path))
+        elif previous_name is not None and file_number % duplicate_every == 1:
+            # same size as the file before, different contents
+            with open(name_with_path, 'wb') as test_outfile:
+                test_outfile.write(os.urandom(os.path.getsize(previous_name)))
+        else:
+            with open(name_with_path, 'wb') as test_outfile:
+                test_outfile.write(os.urandom(min_size + file_number * size_step))
+        previous_name = name_with_path
+    return copies
+
+# find_duplicates() vs. hashing every file, in time and bytes read
+def benchmark_duplicates(file_count=300, duplicate_every=10, min_size=256 * 1024, max_size=8 * 1024 * 1024):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    inventory_dir = tempfile.mkdtemp(prefix='checksum_benchmark_inventory_')
+    try:
+        copies = make_duplicate_tree(test_dir, file_count, duplicate_every, min_size, max_size)
+        test_files = os_walk_files(test_dir)
+        total_bytes = sum(os.path.getsize(name_with_path) for name_with_path in test_files)
+        print('%s\nDUPLICATES: %s files, %.1f MB, %s copies\n%s' % ('='*80, file_count, total_bytes / 1024 / 1024, len(copies), '='*80))
+        seconds, digests = time_checksums(mbp.hashlib_checksum, test_files, 'MD5')
+        print_result('hash every file', seconds, file_count, total_bytes)
+        start_time = time.perf_counter()
+        duplicate_groups_found, bytes_read = mbp.find_duplicates(test_dir, True, '', [], 'MD5', os.path.join(inventory_dir, 'File_Name_Acc.txt'))
+        seconds = time.perf_counter() - start_time
+        print_result('find_duplicates', seconds, file_count, total_bytes)
+        print('%-28s %8.1f%% of the data, %s group(s)' % ('read by find_duplicates', 100 * bytes_read / total_bytes, len(duplicate_groups_found)))
+        # every copy has to be in a group with its original, and nothing else can be
+        #   (groups are sorted by path, so the original isn't always first)
+        found_copies = set(frozenset(paths) for checksum, size, paths in duplicate_groups_found)
+        if found_copies != set(frozenset(copy) for copy in copies):
+            print('---WARNING, DUPLICATES FOUND DO NOT MATCH THE COPIES MADE')
+    finally:
+        shutil.rmtree(test_dir)
+        shutil.rmtree(inventory_dir)
+
+# a nested tree of files of mixed sizes, from small to large
+def make_mixed_tree(test_dir, dir_count, file_sizes):
+    test_files = []
+    for dir_number in range(dir_count):
+        dir_path = os.path.join(test_dir, 'dir_%03d' % dir_number)
+        os.makedirs(dir_path)
+        for file_number, file_size in enumerate(file_sizes):
+            name_with_path = os.path.join(dir_path, 'test_file_%05d.bin' % file_number)
+            with open(name_with_path, 'wb') as test_outfile:
+                test_outfile.write(os.urandom(file_size))
+            test_files.append(name_with_path)
+    return test_files
+
+# every hash I/O mode and buffer size over a local tree of mixed file
+#   sizes, then what tune_hash_io() picks for it
+def benchmark_io_modes(dir_count=8, file_sizes=(16 * 1024, 256 * 1024, 1024 * 1024, 8 * 1024 * 1024, 32 * 1024 * 1024), checksum_type='MD5'):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    try:
+        test_files = make_mixed_tree(test_dir, dir_count, file_sizes)
+        total_bytes = sum(file_sizes) * dir_count
+        print('%s\nHASH I/O MODES: %s files, %.1f MB\n%s' % ('='*80, len(test_files), total_bytes / 1024 / 1024, '='*80))
+        expected_digests = [mbp.hashlib_checksum(name_with_path, checksum_type) for name_with_path in test_files]
+        for io_mode in mbp.hash_io_modes:
+            for buffer_size in (mbp.hash_io_buffer_sizes[-1:] if io_mode == 'mmap' else mbp.hash_io_buffer_sizes):
+                mbp.set_hash_io({test_dir: (io_mode, buffer_size)})
+                for name_with_path in test_files:
+                    mbp.drop_cached_file(name_with_path)
+                seconds, digests = time_checksums(mbp.hashlib_checksum, test_files, checksum_type)
+                print_result('%s, %s KB' % (io_mode, buffer_size // 1024), seconds, len(test_files), total_bytes)
+                if digests != expected_digests:
+                    print('---WARNING, %s DIGESTS DO NOT MATCH' % (io_mode.upper()))
+        mbp.set_hash_io({})
+        io_mode, buffer_size, megabytes_per_second = mbp.tune_hash_io(test_dir)
+        print('%-28s %s, %s KB (%.1f MB/s)' % ('tune_hash_io picks', io_mode, buffer_size // 1024, megabytes_per_second))
+    finally:
+        mbp.set_hash_io({})
+        shutil.rmtree(test_dir)
+
+# artificially slowed filesystem, standing in for a high latency share:
+#   files opened by the script wait open_latency seconds to open and
+#   read_latency seconds for every read, like a round trip to the share
+class SlowFile(io.FileIO):
+    read_latency = 0.0
+
+    def read(self, *args):
+        time.sleep(self.read_latency)
+        return super().read(*args)
+
+    def readinto(self, *args):
+        time.sleep(self.read_latency)
+        return super().readinto(*args)
+
+def slow_filesystem(open_latency, read_latency):
+    SlowFile.read_latency = read_latency
+    def slow_open(name_with_path, mode='r', buffering=-1, *args, **kwargs):
+        time.sleep(open_latency)
+        if mode == 'rb' and buffering == 0:
+            return SlowFile(name_with_path, 'rb')
+        return io.open(name_with_path, mode, buffering, *args, **kwargs)
+    mbp.open = slow_open
+
+def fast_filesystem():
+    if 'open' in vars(mbp):
+        del mbp.open
+
+# thread workers vs. the async pool on a slowed filesystem, where opens and
+#   reads wait instead of using the CPU
+def benchmark_share_latency(dir_count=10, files_per_dir=20, file_size=64 * 1024, open_latency=0.02, read_latency=0.005, runs=(('thread', 4), ('thread', 16), ('async', 16), ('async', 64))):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    inventory_dir = tempfile.mkdtemp(prefix='checksum_benchmark_inventory_')
+    try:
+        make_test_tree(test_dir, dir_count, files_per_dir, file_size)
+        file_count = dir_count * files_per_dir
+        total_bytes = file_count * file_size
+        print('%s\nSHARE LATENCY: %s files, %.0f ms per open, %.0f ms per read\n%s' % ('='*80, file_count, open_latency * 1000, read_latency * 1000, '='*80))
+        slow_filesystem(open_latency, read_latency)
+        # the test tree is all on one share, let it have every file in flight
+        share_concurrency_default = mbp.share_concurrency_default
+        mbp.share_concurrency_default = max(worker_count for pool_type, worker_count in runs)
+        for pool_type, worker_count in runs:
+            seconds = time_inventory(test_dir, inventory_dir, worker_count, pool_type)
+            print_result('%s, %s in flight' % (pool_type, worker_count), seconds, file_count, total_bytes)
+        mbp.share_concurrency_default = share_concurrency_default
+    finally:
+        fast_filesystem()
+        shutil.rmtree(test_dir)
+        shutil.rmtree(inventory_dir)
+
+# deep verification of larger media files, in one process and in pools
+#   of more, and one file cut short of each kind that has to be caught
+def benchmark_deep_verify(file_count=10, width=2000, height=1500, seconds=10, worker_counts=(1, 2, 4)):
+    test_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+    try:
+        test_files = []
+        for file_number in range(file_count):
+            media_name = os.path.join(test_dir, 'test_media_%05d' % file_number)
+            make_test_jpeg(media_name + '.jpg', width, height)
+            make_test_tiff(media_name + '.tif', width, height)
+            make_test_wav(media_name + '.wav', 96000, seconds)
+            test_files += [media_name + '.jpg', media_name + '.tif', media_name + '.wav']
+        for name_with_path in test_files[:3]:
+            truncated_name = name_with_path.replace('test_media_', 'truncated_')
+            with open(name_with_path, 'rb') as media_infile, open(truncated_name, 'wb') as media_outfile:
+                media_outfile.write(media_infile.read(os.path.getsize(name_with_path) // 2))
+            if not mbp.deep_verify(truncated_name):
+                print('---WARNING, TRUNCATED FILE PASSED:\n   %s' % (truncated_name))
+        total_bytes = sum(os.path.getsize(name_with_path) for name_with_path in test_files)
+        print('%s\nDEEP VERIFY: %s files\n%s' % ('='*80, len(test_files), '='*80))
+        start_time = time.perf_counter()
+        for name_with_path in test_files:
+            mbp.read_media_header(name_with_path)
+        print_result('headers only', time.perf_counter() - start_time, len(test_files), total_bytes)
+        for worker_count in worker_counts:
+            start_time = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=worker_count) as deep_verify_pool:
+                deep_errors = list(deep_verify_pool.map(mbp.deep_verify, test_files))
+            if any(deep_errors):
+                print('---WARNING, GENERATED FILES FAILED:\n   %s' % ([errors for errors in deep_errors if errors]))
+            print_result('deep, %s process(es)' % (worker_count), time.perf_counter() - start_time, len(test_files), total_bytes)
+    finally:
+        shutil.rmtree(test_dir)
+
+# synthetic archive corpus
+#   a local tree shaped like the collection, the same every time for the
+#   same seed: lots of small documents and images nested up to depth
+#   directories deep, a few large WAVs (RF64 past 4 GB), copies of earlier
+#   files, and files with extensions the run excludes
+corpus_document_extensions = ('pdf', 'xml', 'txt', 'docx')
+corpus_excluded_extensions = ('tmp', 'db')
+corpus_block_size = 1024 * 1024
+
+def make_archive_corpus(corpus_dir, small_file_count, media_file_count, media_file_size, depth, duplicate_every=20, excluded_every=25, seed=1):
+    rng = random.Random(seed)
+    corpus = {'small': [], 'media': [], 'duplicates': [], 'excluded': [], 'bytes': 0}
+    dir_paths = []
+    for dir_number in range(max(small_file_count // 50, 1)):
+        dir_parts = ['level_%d_%d' % (level, rng.randrange(3)) for level in range(rng.randint(1, depth))]
+        dir_paths.append(os.path.join(corpus_dir, *dir_parts))
+    for dir_path in set(dir_paths):
+        os.makedirs(dir_path, exist_ok=True)
+    for file_number in range(small_file_count):
+        name_with_path = os.path.join(rng.choice(dir_paths), 'item_%07d' % file_number)
+        if file_number % excluded_every == excluded_every - 1:
+            name_with_path += '.' + rng.choice(corpus_excluded_extensions)
+            with open(name_with_path, 'wb') as corpus_outfile:
+                corpus_outfile.write(rng.randbytes(rng.randrange(16 * 1024)))
+            corpus['excluded'].append(name_with_path)
+            continue
+        if file_number % duplicate_every == duplicate_every - 1 and corpus['small']:
+            name_with_path += os.path.splitext(corpus['small'][-1])[1]
+            shutil.copyfile(corpus['small'][-1], name_with_path)
+            corpus['duplicates'].append(name_with_path)
+        elif file_number % 10 == 0:
+            make_test_jpeg(name_with_path + '.jpg', 128, 96, rng)
+            name_with_path += '.jpg'
+        elif file_number % 10 == 5:
+            make_test_tiff(name_with_path + '.tif', 64, 48, rng)
+            name_with_path += '.tif'
+        else:
+            name_with_path += '.' + rng.choice(corpus_document_extensions)
+            with open(name_with_path, 'wb') as corpus_outfile:
+                corpus_outfile.write(rng.randbytes(rng.randrange(32 * 1024)))
+        corpus['small'].append(name_with_path)
+    media_dir = os.path.join(corpus_dir, 'media')
+    os.makedirs(media_dir, exist_ok=True)
+    for file_number in range(media_file_count):
+        name_with_path = os.path.join(media_dir, 'recording_%03d.wav' % file_number)
+        make_large_wav(name_with_path, media_file_size, rng)
+        corpus['media'].append(name_with_path)
+    corpus['bytes'] = sum(os.path.getsize(name_with_path) for name_with_path in corpus['small'] + corpus['media'] + corpus['duplicates'])
+    return corpus
+
+# 96 kHz 24 bit stereo, written a block at a time however big it is.
+#   the data is one random block over and over, every byte still has to be read
+def make_large_wav(name_with_path, size, rng):
+    data_size = size - size % 6
+    block = rng.randbytes(corpus_block_size - corpus_block_size % 6)
+    rf64 = data_size + 36 > 0xFFFFFFFF
+    with open(name_with_path, 'wb') as media_outfile:
+        if rf64:
+            media_outfile.write(b'RF64' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE' + b'ds64' + struct.pack('<IQQQI', 28, data_size + 72, data_size, data_size // 6, 0))
+        else:
+            media_outfile.write(b'RIFF' + struct.pack('<I', data_size + 36) + b'WAVE')
+        media_outfile.write(b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 2, 96000, 96000 * 6, 6, 24))
+        media_outfile.write(b'data' + struct.pack('<I', 0xFFFFFFFF if rf64 else data_size))
+        bytes_left = data_size
+        while bytes_left > 0:
+            media_outfile.write(block[:min(len(block), bytes_left)])
+            bytes_left -= min(len(block), bytes_left)
+
+# what happens to a collection between two inventories: some files move
+#   (with one of the large media files), go missing or change, and new
+#   ones turn up. returns how many of each
+def change_archive_corpus(corpus_dir, corpus, change_every=50, seed=2):
+    rng = random.Random(seed)
+    moved_dir = os.path.join(corpus_dir, 'moved')
+    os.makedirs(moved_dir, exist_ok=True)
+    changes = {'moved': 0, 'missing': 0, 'changed': 0, 'new': 0}
+    for file_number, name_with_path in enumerate(corpus['small'] + corpus['media'][:1]):
+        change = file_number % change_every
+        if change == 1 or name_with_path in corpus['media']:
+            shutil.move(name_with_path, os.path.join(moved_dir, os.path.basename(name_with_path)))
+            changes['moved'] += 1
+        elif change == 2:
+            os.remove(name_with_path)
+            changes['missing'] += 1
+        elif change == 3:
+            file_size = os.path.getsize(name_with_path)
+            with open(name_with_path, 'r+b') as corpus_file:
+                corpus_file.seek(file_size // 2)
+                corpus_file.write(rng.randbytes(min(16, file_size - file_size // 2)))
+            # well after the catalog saw it
+            file_stat = os.stat(name_with_path)
+            os.utime(name_with_path, (file_stat.st_atime, file_stat.st_mtime + 60))
+            changes['changed'] += 1
+    for file_number in range(max(len(corpus['small']) // change_every, 1)):
+        with open(os.path.join(corpus_dir, 'new_%05d.txt' % file_number), 'wb') as corpus_outfile:
+            corpus_outfile.write(rng.randbytes(rng.randrange(32 * 1024)))
+        changes['new'] += 1
+    return changes
+
+# stand-in backends, so a run measures the tool rather than whatever
+#   hashing and MediaInfo cost on this machine: a CRC of the file the
+#   length of the real checksum (the file's still read in full),
+#   and the native header fields for anything MediaInfo would be run for
+def stand_in_checksum(name_with_path, checksum_type):
+    crc = 0
+    with open(name_with_path, 'rb') as hash_infile:
+        for chunk in iter(lambda: hash_infile.read(corpus_block_size), b''):
+            crc = zlib.crc32(chunk, crc)
+    # repeated rather than padded, the duplicate index goes by the first 8 bytes
+    checksum_length = 2 * mbp.hash_algorithms[checksum_type]().digest_size
+    return ('%08x' % (crc) * checksum_length)[:checksum_length]
+
+def stand_in_mediainfo_batch(paths):
+    fields_by_path = {}
+    for name_with_path in paths:
+        fields_by_path[name_with_path] = mbp.read_media_header(name_with_path) or {field: '' for field in ('Format', 'Format/Extensions', 'Width', 'Height', 'BitDepth', 'SamplingRate', 'ColorSpace', 'Compression_Mode', 'Codec')}
+    return fields_by_path
+
+def use_stand_in_backends(hash_backend):
+    mbp.mediainfo_batch = stand_in_mediainfo_batch
+    mbp.mediainfo_version_string = 'stand-in'
+    if hash_backend == 'stand_in':
+        mbp.checksum_engines['stand_in'] = stand_in_checksum
+        mbp.checksum_engine = 'stand_in'
+
+# one inventory in a process of its own, so its startup and peak memory are
+#   its own. run_inventory()'s output goes to devnull, the last line is the result
+def end_to_end_run(arguments):
+    corpus_dir, inventory_dir, hash_backend, worker_count, pool_type = arguments[0], arguments[1], arguments[2], int(arguments[3]), arguments[4]
+    use_stand_in_backends(hash_backend)
+    started_at = time.time()
+    with open(os.devnull, 'w') as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            inventory_run = mbp.run_inventory(corpus_dir, inventory_dir, 'MD5', False, ' '.join(corpus_excluded_extensions), {'worker_count': worker_count, 'pool_type': pool_type})
+        finally:
+            sys.stdout = stdout
+    seconds = time.time() - started_at
+    peak_rss = None
+    if resource is not None:
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # kilobytes, apart from macOS which gives bytes
+        peak_rss = peak_rss / 1024 / 1024 if sys.platform == 'darwin' else peak_rss / 1024
+    print(json.dumps({'started_at': started_at, 'seconds': seconds, 'files_processed': inventory_run['files_processed'], 'files_hashed': inventory_run['run_summary']['files_hashed'],
+        'bytes_hashed': inventory_run['run_summary']['bytes_hashed'], 'peak_rss': peak_rss, 'change_counts': dict(inventory_run['change_counts'])}))
+
+def time_end_to_end(corpus_dir, inventory_dir, hash_backend, worker_count, pool_type):
+    launched_at = time.time()
+    run_output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'end_to_end_run', corpus_dir, inventory_dir, hash_backend, str(worker_count), pool_type])
+    result = json.loads(run_output.decode('utf-8').strip().splitlines()[-1])
+    result['startup_seconds'] = result['started_at'] - launched_at
+    return result
+
+def print_end_to_end(label, result):
+    peak_rss = '%8.1f MB peak' % (result['peak_rss']) if result['peak_rss'] is not None else '     n/a peak'
+    print('%-28s %8.3fs %10.1f files/s %10.1f MB/s %s %6.3fs startup' % (label, result['seconds'], result['files_processed'] / result['seconds'], result['bytes_hashed'] / result['seconds'] / 1024 / 1024, peak_rss, result['startup_seconds']))
+
+# the whole run, start to finish, over a generated corpus: finding files,
+#   past inventories, the pipeline and writing the inventory and reports.
+#   a first inventory, then one after the corpus changed, compared with it.
+#   raise small_file_count into the millions and media_file_size into GB to
+#   match the collection
+def benchmark_end_to_end(small_file_count=5000, media_file_count=4, media_file_size=64 * 1024 * 1024, depth=8, hash_backends=('hashlib', 'stand_in'), worker_count=4, pool_type='thread', seed=1):
+    for hash_backend in hash_backends:
+        corpus_dir = tempfile.mkdtemp(prefix='checksum_benchmark_')
+        inventory_dir = tempfile.mkdtemp(prefix='checksum_benchmark_inventory_')
+        try:
+            start_time = time.perf_counter()
+            corpus = make_archive_corpus(corpus_dir, small_file_count, media_file_count, media_file_size, depth, seed=seed)
+            print('%s\nEND TO END: %s hashing, %s files (%s copies, %s excluded), %.1f MB, generated in %.1fs\n%s' % ('='*80, hash_backend, len(corpus['small']) + len(corpus['media']) + len(corpus['duplicates']), len(corpus['duplicates']), len(corpus['excluded']), corpus['bytes'] / 1024 / 1024, time.perf_counter() - start_time, '='*80))
+            print_end_to_end('first inventory', time_end_to_end(corpus_dir, inventory_dir, hash_backend, worker_count, pool_type))
+            changes = change_archive_corpus(corpus_dir, corpus)
+            # inventories are told apart by the second they were started
+            time.sleep(1)
+            result = time_end_to_end(corpus_dir, inventory_dir, hash_backend, worker_count, pool_type)
+            print_end_to_end('after changes', result)
+            print('%-28s %s' % ('changes made', ', '.join('%s %s' % (count, change) for change, count in changes.items())))
+            print('%-28s %s' % ('changes found', ', '.join('%s %s' % (count, change) for change, count in result['change_counts'].items())))
+        finally:
+            shutil.rmtree(corpus_dir)
+            shutil.rmtree(inventory_dir)
+
+
+benchmarks = {
+    'hashing': benchmark_hashing,
+    'multi_digest': benchmark_multi_digest,
+    'worker_scaling': benchmark_worker_scaling,
+    'enumeration': benchmark_enumeration,
+    'media_headers': benchmark_media_headers,
+    'duplicates': benchmark_duplicates,
+    'io_modes': benchmark_io_modes,
+    'share_latency': benchmark_share_latency,
+    'deep_verify': benchmark_deep_verify,
+    'end_to_end': benchmark_end_to_end,
+}
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['end_to_end_run']:
+        end_to_end_run(sys.argv[2:])
+        sys.exit()
+    selected = sys.argv[1:] or list(benchmarks)
+    for benchmark_name in selected:
+        benchmarks[benchmark_name]()
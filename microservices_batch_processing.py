@@ -1,6 +1,13 @@
 #!/usr/bin/env python
 
-import glob, os, subprocess, datetime, time, sys, csv, ast
+import glob, os, errno, subprocess, datetime, time, sys, csv, ast, hashlib, threading, queue, collections, array, struct, tempfile, sqlite3, re, zlib, json, mmap, heapq, asyncio, random, cProfile, pstats
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+
+# xxhash is optional, its algorithms are only offered if it's installed
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 
 # these are the directories I've been running it on locally, here for easy ref
@@ -16,11 +23,12 @@ Winnie Schwaid-Lindner - checksum and inventory script.
    and which file extensions to process (inclusionary or exclusionary basis)
 2. Create txt of all filenames that script will process. This is in case of
    error. A variable containing the same info is used for subprocess commands
-3. Calculate the checksum using certUtil (subprocess)
+3. Calculate the checksum in-process with hashlib (certUtil is still
+   available as an engine, but runs a subprocess for every file)
 4. Look into past inventories and see whether the checksum matches, 
    identify duplicate checksums, or whether the file is new to the directory.
-   All checksums are accumulated to make sure there are no duplicates across
-   several directories.
+   All checksums are saved in an sqlite catalog to make sure there are no
+   duplicates across several directories.
 5. Check mediainfo metadata against image / audio file standards
    to determine if file has unexpected or incorrect properties while still
    being valid, or determine if the file is corrupted
@@ -41,6 +49,115 @@ Winnie Schwaid-Lindner - checksum and inventory script.
     * Tell whether the file is valid according to
       mediainfo metadata matching with expected metadata
 '''
+
+# checksum algorithms that can be selected, name -> hashlib constructor
+#   MD5, SHA1 and SHA256 are the ones certUtil was used for,
+#   the others are only available in-process
+hash_algorithms = {
+    'MD5': hashlib.md5,
+    'SHA1': hashlib.sha1,
+    'SHA256': hashlib.sha256,
+    'SHA512': hashlib.sha512,
+    'BLAKE2B': hashlib.blake2b,
+    'BLAKE2S': hashlib.blake2s,
+}
+if xxhash is not None:
+    hash_algorithms['XXH64'] = xxhash.xxh64
+    hash_algorithms['XXH3_128'] = xxhash.xxh3_128
+# size of each read while hashing. large reads keep a network share busy
+#   instead of paying a round trip for every few KB
+hash_chunk_size = 4 * 1024 * 1024
+# one reusable read buffer per thread, so files aren't hashed through
+#   a freshly allocated bytes object for every chunk
+hash_buffers = threading.local()
+# how long the last file the thread hashed took to open, for run metrics
+hash_timings = threading.local()
+# the move fingerprint of the file being hashed, taken from the chunks
+#   the hash pass reads (see hash_fingerprint_start())
+hash_fingerprints = threading.local()
+# how files are read for hashing:
+#   readinto  unbuffered reads into the thread's page-aligned buffer
+#   mmap      the file is mapped and hashed straight from the page cache,
+#             without copying it (best on local disks)
+#   fadvise   readinto, telling the OS the file is read from start to end so
+#             it reads further ahead (only where there's posix_fadvise)
+#   hash_io_volumes is root -> (mode, buffer size) for the volumes that don't
+#   use hash_io_default, the longest root a path starts with wins
+#   (see set_hash_io() and tune_hash_io())
+hash_io_modes = ('readinto', 'mmap', 'fadvise')
+hash_io_default = ('readinto', hash_chunk_size)
+hash_io_volumes = {}
+# buffer sizes tune_hash_io() tries
+hash_io_buffer_sizes = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+# seconds to wait before each retry of a file that couldn't be hashed,
+#   doubling so a share that drops out for a minute is waited out.
+#   each wait is jittered so workers don't all come back at once
+hash_retry_delays = (0, 1, 2, 4, 8, 16, 32)
+# only errors that can clear up on their own are retried: I/O and network
+#   errors from a share that dropped out or is busy. a file that's gone or
+#   can't be opened (FileNotFoundError, PermissionError, a broken link) fails at once
+hash_retry_errnos = {errno.EIO, errno.ETIMEDOUT, errno.EAGAIN, errno.ESTALE, errno.EINTR, errno.EBUSY, errno.ECONNRESET, errno.ECONNABORTED, errno.ENETDOWN, errno.ENETUNREACH, errno.ENETRESET, errno.EHOSTUNREACH}
+# windows: bad network path, network busy, device gone, unexpected network
+#   error, network name deleted, semaphore timeout, network/host unreachable,
+#   connection aborted
+hash_retry_winerrors = {53, 54, 55, 59, 64, 121, 1231, 1232, 1236}
+# files hashed at once on each share in the 'async' pool (see
+#   pipeline_async_hash()), share -> limit, share_concurrency_default for others
+share_concurrency = {}
+share_concurrency_default = 16
+# directory listings the walk keeps ahead of the files being used,
+#   for each enumerate worker (see walk_files())
+walk_scan_ahead = 2
+# character ` is used for csv separation as
+#    an arbitrary char to account for , and . appearing in file names
+csv.register_dialect('backtick', delimiter='`', quotechar='"', quoting=csv.QUOTE_ALL, lineterminator='\n')
+# the inventory is written out (and fsync'd) when this much has been
+#   written or this much time has passed, whichever comes first
+inventory_flush_bytes = 4 * 1024 * 1024
+inventory_flush_seconds = 60
+# extensions that are checked with mediainfo, currently set to media files
+mediainfo_extensions = ('jpg', 'jp2', 'tif', 'tiff', 'wav', 'mov')
+# how much of a file is read to find its format. the headers read natively
+#   are almost always in here, anything past it is seeked to
+media_header_size = 64 * 1024
+# Format/Extensions, as MediaInfo gives them, for the formats read natively
+media_format_extensions = {
+    'JPEG': 'h3d jpeg jpg jpe jps mpo',
+    'JPEG 2000': 'jp2 jpx jpf j2k j2c jpc mj2',
+    'TIFF': 'tiff tif',
+    'Wave': 'wav',
+    'QuickTime': 'mov qt',
+    'MPEG-4': 'mov mp4 m4v m4a m4b m4p 3ga 3gpa 3gpp 3gp 3gpp2 3g2 k3g jpm jpx mqv ismv isma ismt f4a f4b f4v',
+}
+# TIFF tags read from the first IFD, and the names of the values
+#   of the ones that are codes
+tiff_tags = {256: 'Width', 257: 'Height', 258: 'BitDepth', 259: 'Compression', 262: 'ColorSpace'}
+tiff_compressions = {1: 'Raw', 2: 'CCITT RLE', 3: 'CCITT T.4', 4: 'CCITT T.6', 5: 'LZW', 6: 'JPEG', 7: 'JPEG', 8: 'Deflate', 32773: 'PackBits', 32946: 'Deflate', 34712: 'JPEG 2000'}
+tiff_lossy_compressions = ('JPEG', 'JPEG 2000')
+tiff_colour_spaces = {0: 'Y', 1: 'Y', 2: 'RGB', 3: 'Palette', 4: 'Mask', 5: 'CMYK', 6: 'YUV', 8: 'CIELab', 9: 'CIELab', 10: 'CIELab'}
+# colour spaces of JPEG frames by number of components, and of JPEG 2000 colr boxes
+jpeg_colour_spaces = {1: 'Y', 3: 'YUV', 4: 'CMYK'}
+jp2_colour_spaces = {12: 'CMYK', 16: 'RGB', 17: 'Y', 18: 'YUV', 20: 'RGB', 21: 'RGB', 22: 'YUV', 24: 'YUV'}
+# WAV audio format codes
+wav_codecs = {1: 'PCM', 3: 'Float', 6: 'A-Law', 7: 'U-Law', 0x55: 'MPEG Audio'}
+# the fields used from MediaInfo
+mediainfo_desired_fields = ('FileExtension', 'InternetMediaType', 'Format/Extensions', 'Compression_Mode', 'SamplingRate', 'Width', 'Height', 'BitDepth', 'ColorSpace', 'CodecID')
+# file specs checked by mediainfo(), see load_file_specs()
+file_specs_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'file_specs.json')
+default_file_specs = None
+# files given to each MediaInfo run, and the most characters of paths
+#   (windows command lines are limited to 32767)
+mediainfo_batch_size = 32
+mediainfo_batch_chars = 24000
+# MediaInfo's version, found the first time it's needed
+mediainfo_version_string = None
+# moved files are recognised by size and a fingerprint of their first and
+#   last move_fingerprint_size bytes. smaller files are just hashed
+move_fingerprint_size = 64 * 1024
+move_min_size = 2 * move_fingerprint_size
+line_break = ('{:^}'.format('-'*80))
+
+
 def take_inputs():
     # select dir of files to process
     file_dir_input = ''
@@ -63,10 +180,13 @@ def take_inputs():
 
     # select checksum algorithm
     # existing checksum options that you can pick from
-    checksum_options = ['SHA1', 'MD5', 'SHA256']
-    checksum_type = (input('\nCHECKSUM SELECTION:\nSelect your checksum type!\nOptions are [MD5], [SHA1], or [SHA256].\nNOTE: If you do not select a valid option, default is set to [MD5].\n> '))\
-        .upper().replace('[', '').replace(']', '')
-    if checksum_type not in checksum_options:
+    checksum_options = list(hash_algorithms)
+    checksum_type_input = (input('\nCHECKSUM SELECTION:\nSelect your checksum type!\nOptions are [MD5], [SHA1], or [SHA256].\nAlso available: %s.\nList several separated by a space (ex "MD5 SHA256")\nto calculate all of them from one read of each file.\nNOTE: If you do not select a valid option, default is set to [MD5].\n> ' % (', '.join('[%s]' % option for option in checksum_options[3:]))))\
+        .upper().replace('[', '').replace(']', '').replace(',', ' ')
+    # several checksum types are kept as one space separated string,
+    #   the first one listed is the one compared against past inventories
+    checksum_type = ' '.join(option for option in checksum_type_input.split() if option in checksum_options)
+    if checksum_type == '':
         # if you didn't select a valid checksum, it'll go MD5.
         print('Not a valid choice. Defaulting to MD5 checksums.')
         checksum_type = 'MD5'
@@ -95,257 +215,2508 @@ def take_inputs():
     return file_dir, inventory_dir, checksum_type, include_true_exclude_false,\
         file_types, file_type_string
 
-# determine whether there are existing inventories of the same directory
+# determine whether there are existing inventories of the same directory.
+#   the latest inventories of the dir and of the dirs above and below it
+#   are merged into one previous inventory index (see
+#   merge_previous_inventories()), an empty one if this is the first
 def check_for_inventories(file_dir, inventory_dir):
-    latest_inventory = ''
-    read_inventory = []
-    first_inventory_of_dir = False
-    set_first_dir = set()
-    set_first_dir_names = set()
-    set_matches = set()
-    dict_first_dir = {}
-    # modify path for file name to account for invalid characters
-    modified_path = (file_dir.replace('\\\\?\\', "").replace('\\', "'").replace(":", "'"))
-    # see if previous inventory exists by accessing it.
-    #   if it doesn't, don't attempt to compare inventories
-    try:
-        latest_inventory = str(max(glob.iglob(inventory_dir + '\\__Inventory_' + modified_path + '__*.csv'),key=os.path.getmtime))
-    except (OSError, ValueError): 
+    modified_path = inventory_path_name(file_dir)
+    # see if previous inventories exist by accessing them.
+    #   if they don't, don't attempt to compare inventories
+    inventory_names = related_inventory_names(inventory_dir, modified_path)
+    if not inventory_names:
         # this is the first inventory done for this dir
         first_inventory_of_dir = True
-    # if it exists, open it, turn it into a list
-    if latest_inventory != '':
-        with open(latest_inventory, 'r', encoding='utf-8') as old_inventory:
-            read_inventory = list(csv.reader(old_inventory, delimiter='`'))
+        previous_inventory = new_previous_inventory()
+    else:
         # indicate it's not the first inventory
         first_inventory_of_dir = False
-    else:
-        # this is the first inventory done for this dir
-        first_inventory_of_dir = True
-    # if not the first inventory of this dir
-    if first_inventory_of_dir == False:
-        # read row by row
-        for row in read_inventory:
-            # if there's a full line
-            #   (which would indicate that there's a file represented)
+        previous_inventory = merge_previous_inventories(inventory_names, file_dir, modified_path)
+    return modified_path, first_inventory_of_dir, previous_inventory
+
+# file_dir as it goes in inventory names: the \\?\ prefix dropped,
+#   and characters that can't be in a file name made '
+def inventory_path_name(file_dir):
+    return file_dir.replace('\\\\?\\', "").replace('\\', "'").replace('/', "'").replace(":", "'")
+
+# the path part and time stamp of a finished inventory's name, None for
+#   anything else (the temp inventory of an unfinished run, reports)
+def inventory_name_parts(inventory_name):
+    name_match = re.match(r'__Inventory_(.*)___(\d{4}-\d{2}-\d{2}_\d{2}h\d{2}m\d{2}s)\.csv$', os.path.basename(inventory_name))
+    if name_match is None:
+        return None
+    return name_match.group(1), name_match.group(2)
+
+# whether an inventory's path part is the same dir as, or a dir below,
+#   another's. they're paths with \ and : made ', so a dir above is the
+#   start of the name followed by ' (a drive already ends with one)
+def inventory_path_within(inner_path, outer_path):
+    return inner_path == outer_path or inner_path.startswith(outer_path if outer_path.endswith("'") else outer_path + "'")
+
+# finished inventories of the dir and of the dirs above and below it,
+#   oldest first, going by the time stamp in their names (no stat for every
+#   inventory on the share). with latest_only, just the latest of each dir,
+#   which already lists everything its earlier inventories did
+def related_inventory_names(inventory_dir, modified_path, latest_only=True):
+    related_inventories = {}
+    for inventory_name in glob.iglob(os.path.join(glob.escape(inventory_dir), '__Inventory_*.csv')):
+        inventory_parts = inventory_name_parts(inventory_name)
+        if inventory_parts is None:
+            continue
+        inventory_path, inventory_time_stamp = inventory_parts
+        if not (inventory_path_within(modified_path, inventory_path) or inventory_path_within(inventory_path, modified_path)):
+            continue
+        inventory_key = inventory_path if latest_only else inventory_name
+        if inventory_key not in related_inventories or related_inventories[inventory_key][0] < inventory_time_stamp:
+            related_inventories[inventory_key] = (inventory_time_stamp, inventory_name)
+    return [inventory_name for inventory_time_stamp, inventory_name in sorted(related_inventories.values())]
+
+# previous inventory index
+#   path -> (checksum, status) for every file in a previous inventory, held
+#   in a binary sidecar next to it (the inventory name plus '.idx') that's
+#   read through an mmap instead of kept in memory. the sidecar is made the
+#   first time an inventory is loaded, streaming it once, and made again if
+#   the inventory has changed since.
+#   directories are stored once in a prefix table, files as a prefix number
+#   and name. both are sorted, so a lookup is two binary searches, and the
+#   sidecars of several inventories can be merged in one pass
+previous_inventory_magic = b'INVIDX01'
+# magic, inventory size and mtime, file count, directory count,
+#   offset of the directory offsets, offset of the file offsets
+previous_inventory_header = struct.Struct('<8sQdQQQQ')
+# statuses: processed, not selected, listed as missing
+previous_inventory_statuses = ('Processed', 'Not selected', 'Missing')
+
+# matched has a bit for each record, set once the path is found in this
+#   run (see previous_inventory_match())
+def new_previous_inventory():
+    return {'inventory_names': [], 'sidecar_name': None, 'temporary': False, 'sidecar_file': None, 'sidecar': b'', 'count': 0, 'prefix_count': 0, 'prefix_table': 0, 'record_table': 0, 'matched': bytearray(), 'matched_lock': threading.Lock()}
+
+def load_previous_inventory(inventory_name):
+    sidecar_name = inventory_name + '.idx'
+    inventory_stat = os.stat(inventory_name)
+    previous_inventory = open_previous_inventory_sidecar(sidecar_name, inventory_stat.st_size, inventory_stat.st_mtime)
+    if previous_inventory is None:
+        write_previous_inventory_sidecar(sidecar_name, inventory_stat.st_size, inventory_stat.st_mtime, read_previous_inventory_rows(inventory_name))
+        previous_inventory = open_previous_inventory_sidecar(sidecar_name, inventory_stat.st_size, inventory_stat.st_mtime)
+    previous_inventory['inventory_names'] = [inventory_name]
+    return previous_inventory
+
+# one previous inventory index of everything under file_dir in several
+#   inventories (oldest first), the latest record of each path winning.
+#   it's written to a temp file that's removed when it's closed. a single
+#   inventory of the dir itself is used as it is
+def merge_previous_inventories(inventory_names, file_dir, modified_path):
+    if len(inventory_names) == 1 and inventory_name_parts(inventory_names[0])[0] == modified_path:
+        return load_previous_inventory(inventory_names[0])
+    previous_inventories = [load_previous_inventory(inventory_name) for inventory_name in inventory_names]
+    try:
+        merged_records = ((root, name, history[-1][1], history[-1][2]) for root, name, history in merged_previous_inventory_records(previous_inventories, file_dir))
+        sidecar_handle, sidecar_name = tempfile.mkstemp(prefix='__Previous_', suffix='.idx')
+        os.close(sidecar_handle)
+        write_previous_inventory_sidecar(sidecar_name, 0, 0, merged_records)
+    finally:
+        for previous_inventory in previous_inventories:
+            close_previous_inventory(previous_inventory)
+    previous_inventory = open_previous_inventory_sidecar(sidecar_name, 0, 0)
+    previous_inventory['inventory_names'] = list(inventory_names)
+    previous_inventory['temporary'] = True
+    return previous_inventory
+
+def close_previous_inventory(previous_inventory):
+    if previous_inventory['sidecar_file'] is not None:
+        previous_inventory['sidecar'].close()
+        previous_inventory['sidecar_file'].close()
+        previous_inventory['sidecar_file'] = None
+        if previous_inventory['temporary']:
+            os.remove(previous_inventory['sidecar_name'])
+
+# path -> (checksum, status) from the inventory's rows, read as a stream.
+#   rows of processed (or not selected) files have a checksum column,
+#   files listed as missing only have a path. later rows win
+def read_previous_inventory_rows(inventory_name):
+    previous_rows = {}
+    with open(inventory_name, 'r', encoding='utf-8', newline='') as old_inventory:
+        for row in csv.reader(old_inventory, delimiter='`'):
+            if len(row) < 2 or row[1] in ('FilePath', ''):
+                continue
             if len(row) > 4:
-                # add info to dict and 2 sets
-                dict_first_dir[(row[1])] = row[5]
-                set_first_dir.add((row[1], row[5]))
-                set_first_dir_names.add((row[1]))
+                status = 1 if row[4] == 'Not selected' else 0
+                previous_rows[row[1]] = (status, row[5])
             else:
-                # if there's a file that previously was listed as missing,
-                #   this will catch it
-                set_first_dir_names.add((row[1]))
-    return modified_path, first_inventory_of_dir, read_inventory, set_first_dir, dict_first_dir, set_first_dir_names, set_matches
+                previous_rows[row[1]] = (2, '')
+    return previous_rows
+
+def previous_inventory_key(name_with_path):
+    root, name = os.path.split(name_with_path)
+    return root.encode('utf-8', 'surrogateescape'), name.encode('utf-8', 'surrogateescape')
+
+def previous_inventory_path(root, name):
+    return os.path.join(root.decode('utf-8', 'surrogateescape'), name.decode('utf-8', 'surrogateescape'))
+
+# whether a record's directory is file_dir or below it
+def previous_inventory_within(root, file_dir_key):
+    return root == file_dir_key[0] or root.startswith(file_dir_key[1])
+
+# the (dir, dir plus separator) that previous_inventory_within() checks against
+def previous_inventory_dir_key(file_dir):
+    return file_dir.rstrip('\\/').encode('utf-8', 'surrogateescape'), os.path.join(file_dir, '').encode('utf-8', 'surrogateescape')
+
+# written to a temp file and renamed, like the journal.
+#   previous_records are path -> (status, checksum) from an inventory,
+#   or (dir, name, status, checksum bytes) already in order
+def write_previous_inventory_sidecar(sidecar_name, inventory_size, inventory_mtime, previous_records):
+    if isinstance(previous_records, dict):
+        previous_rows = previous_records
+        previous_records = sorted(previous_inventory_key(name_with_path) + (status, checksum_bytes(checksum)) for name_with_path, (status, checksum) in previous_rows.items())
+        previous_rows.clear()
+    temp_sidecar_name = sidecar_name + '.tmp'
+    with open(temp_sidecar_name, 'wb') as sidecar_outfile:
+        sidecar_outfile.write(b'\x00' * previous_inventory_header.size)
+        prefix_offsets = array.array('Q')
+        record_offsets = array.array('Q')
+        offset = previous_inventory_header.size
+        for root, name, status, checksum in previous_records:
+            if not prefix_offsets or root != last_root:
+                prefix_offsets.append(offset)
+                prefix_record = struct.pack('<I', len(root)) + root
+                sidecar_outfile.write(prefix_record)
+                offset += len(prefix_record)
+                last_root = root
+            record_offsets.append(offset)
+            file_record = struct.pack('<II', len(prefix_offsets) - 1, len(name)) + name + struct.pack('<BB', status, len(checksum)) + checksum
+            sidecar_outfile.write(file_record)
+            offset += len(file_record)
+        # offset tables go last, little endian like the rest
+        if sys.byteorder != 'little':
+            prefix_offsets.byteswap()
+            record_offsets.byteswap()
+        prefix_table = offset
+        prefix_offsets.tofile(sidecar_outfile)
+        record_table = prefix_table + 8 * len(prefix_offsets)
+        record_offsets.tofile(sidecar_outfile)
+        sidecar_outfile.seek(0)
+        sidecar_outfile.write(previous_inventory_header.pack(previous_inventory_magic, inventory_size, inventory_mtime, len(record_offsets), len(prefix_offsets), prefix_table, record_table))
+        sidecar_outfile.flush()
+        os.fsync(sidecar_outfile.fileno())
+    os.replace(temp_sidecar_name, sidecar_name)
+
+# checksums are kept as bytes, anything that isn't hex (a blank checksum
+#   column, an error) is kept as no checksum
+def checksum_bytes(checksum):
+    try:
+        return bytes.fromhex(normalize_checksum(checksum))
+    except ValueError:
+        return b''
+
+# the sidecar, mapped, or None if there isn't one for this version of the inventory
+def open_previous_inventory_sidecar(sidecar_name, inventory_size, inventory_mtime):
+    try:
+        sidecar_file = open(sidecar_name, 'rb')
+    except OSError:
+        return None
+    try:
+        if os.fstat(sidecar_file.fileno()).st_size <= previous_inventory_header.size:
+            raise ValueError('sidecar is too short')
+        sidecar = mmap.mmap(sidecar_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        sidecar_file.close()
+        return None
+    magic, sidecar_inventory_size, sidecar_inventory_mtime, count, prefix_count, prefix_table, record_table = previous_inventory_header.unpack_from(sidecar, 0)
+    if magic != previous_inventory_magic or sidecar_inventory_size != inventory_size or sidecar_inventory_mtime != inventory_mtime or record_table + 8 * count != len(sidecar):
+        sidecar.close()
+        sidecar_file.close()
+        return None
+    previous_inventory = new_previous_inventory()
+    previous_inventory.update({'sidecar_name': sidecar_name, 'sidecar_file': sidecar_file, 'sidecar': sidecar, 'count': count, 'prefix_count': prefix_count, 'prefix_table': prefix_table, 'record_table': record_table, 'matched': bytearray((count + 7) // 8)})
+    return previous_inventory
+
+def previous_inventory_prefix(previous_inventory, prefix_number):
+    sidecar = previous_inventory['sidecar']
+    prefix_offset = struct.unpack_from('<Q', sidecar, previous_inventory['prefix_table'] + 8 * prefix_number)[0]
+    prefix_length = struct.unpack_from('<I', sidecar, prefix_offset)[0]
+    return sidecar[prefix_offset + 4:prefix_offset + 4 + prefix_length]
+
+# (prefix number, name, status, checksum) of the file record record_number
+def previous_inventory_record(previous_inventory, record_number):
+    sidecar = previous_inventory['sidecar']
+    record_offset = struct.unpack_from('<Q', sidecar, previous_inventory['record_table'] + 8 * record_number)[0]
+    prefix_number, name_length = struct.unpack_from('<II', sidecar, record_offset)
+    name_end = record_offset + 8 + name_length
+    status, checksum_length = struct.unpack_from('<BB', sidecar, name_end)
+    return prefix_number, sidecar[record_offset + 8:name_end], status, sidecar[name_end + 2:name_end + 2 + checksum_length]
+
+# the record number of a path in the previous inventory, None if it isn't there
+def previous_inventory_find(previous_inventory, name_with_path):
+    if previous_inventory['count'] == 0:
+        return None
+    root, name = previous_inventory_key(name_with_path)
+    low, high = 0, previous_inventory['prefix_count']
+    while low < high:
+        middle = (low + high) // 2
+        if previous_inventory_prefix(previous_inventory, middle) < root:
+            low = middle + 1
+        else:
+            high = middle
+    if low == previous_inventory['prefix_count'] or previous_inventory_prefix(previous_inventory, low) != root:
+        return None
+    prefix_number = low
+    low, high = 0, previous_inventory['count']
+    while low < high:
+        middle = (low + high) // 2
+        record_prefix, record_name = previous_inventory_record(previous_inventory, middle)[:2]
+        if (record_prefix, record_name) < (prefix_number, name):
+            low = middle + 1
+        else:
+            high = middle
+    if low == previous_inventory['count'] or previous_inventory_record(previous_inventory, low)[:2] != (prefix_number, name):
+        return None
+    return low
+
+# (checksum, status) of a path in the previous inventory, None if it isn't there
+def previous_inventory_lookup(previous_inventory, name_with_path):
+    record_number = previous_inventory_find(previous_inventory, name_with_path)
+    if record_number is None:
+        return None
+    status, checksum = previous_inventory_record(previous_inventory, record_number)[2:]
+    return checksum.hex(), status
+
+# mark a path of the previous inventory as found in this run. one bit
+#   for each record, instead of a set of every path found, so the
+#   paths left unmarked at the end are the missing ones
+def previous_inventory_match(previous_inventory, name_with_path):
+    record_number = previous_inventory_find(previous_inventory, name_with_path)
+    if record_number is not None:
+        with previous_inventory['matched_lock']:
+            previous_inventory['matched'][record_number >> 3] |= 1 << (record_number & 7)
+
+# every path in the previous inventory not found in this run, in order
+def previous_inventory_unmatched_paths(previous_inventory):
+    matched = previous_inventory['matched']
+    for record_number, (root, name, status, checksum) in enumerate(previous_inventory_records(previous_inventory)):
+        if not matched[record_number >> 3] & (1 << (record_number & 7)):
+            yield previous_inventory_path(root, name)
+
+# every record in the previous inventory, in order, as (dir, name, status, checksum)
+def previous_inventory_records(previous_inventory):
+    root = None
+    last_prefix = None
+    for record_number in range(previous_inventory['count']):
+        prefix_number, name, status, checksum = previous_inventory_record(previous_inventory, record_number)
+        if prefix_number != last_prefix:
+            root = previous_inventory_prefix(previous_inventory, prefix_number)
+            last_prefix = prefix_number
+        yield root, name, status, checksum
+
+# every path in the previous inventory, in order
+def previous_inventory_paths(previous_inventory):
+    for root, name, status, checksum in previous_inventory_records(previous_inventory):
+        yield previous_inventory_path(root, name)
+
+# the records of several previous inventories, path by path, as
+#   (dir, name, [(inventory number, status, checksum), ...]) in the order
+#   the inventories were given. their sidecars are all sorted by path, so
+#   this is a k-way merge reading each of them once. with file_dir, only
+#   paths under it
+def merged_previous_inventory_records(previous_inventories, file_dir=None):
+    file_dir_key = previous_inventory_dir_key(file_dir) if file_dir is not None else None
+    record_streams = [numbered_previous_inventory_records(previous_inventory, inventory_number) for inventory_number, previous_inventory in enumerate(previous_inventories)]
+    merged_key = None
+    history = []
+    for root, name, inventory_number, status, checksum in heapq.merge(*record_streams):
+        if (root, name) != merged_key:
+            if history:
+                yield merged_key[0], merged_key[1], history
+            merged_key = (root, name)
+            history = []
+        if file_dir_key is None or previous_inventory_within(root, file_dir_key):
+            history.append((inventory_number, status, checksum))
+    if history:
+        yield merged_key[0], merged_key[1], history
+
+def numbered_previous_inventory_records(previous_inventory, inventory_number):
+    for root, name, status, checksum in previous_inventory_records(previous_inventory):
+        yield root, name, inventory_number, status, checksum
+
+# history of every file under file_dir across inventories (oldest first),
+#   one row for each inventory it's in, path by path
+def inventory_history_report(inventory_names, file_dir, history_report_name):
+    previous_inventories = [load_previous_inventory(inventory_name) for inventory_name in inventory_names]
+    inventory_time_stamps = [inventory_name_parts(inventory_name)[1] if inventory_name_parts(inventory_name) else inventory_name for inventory_name in inventory_names]
+    path_count = 0
+    try:
+        with open(history_report_name, 'w', encoding='utf-8', newline='') as history_report:
+            history_writer = csv.writer(history_report, dialect='backtick')
+            history_writer.writerow(['FilePath', 'Inventory', 'Status', 'Checksum'])
+            for root, name, history in merged_previous_inventory_records(previous_inventories, file_dir):
+                name_with_path = previous_inventory_path(root, name)
+                for inventory_number, status, checksum in history:
+                    history_writer.writerow([name_with_path, inventory_time_stamps[inventory_number], previous_inventory_statuses[status], checksum.hex()])
+                path_count += 1
+    finally:
+        for previous_inventory in previous_inventories:
+            close_previous_inventory(previous_inventory)
+    return path_count
+
+# differences between what earlier inventories and later ones found under
+#   file_dir (each oldest first, the latest record of a path winning):
+#    * New: only in the later inventories
+#    * Missing: only in the earlier ones, or listed as missing since
+#    * Changed: same path, different checksum
+#    * Moved: a missing file's checksum at a new path
+#    * Revalidated: same path and checksum
+#   the inventories are merged in one pass, so this takes time linear in
+#   their rows. only new and missing files are held until the end, to be
+#   paired up as moves
+def inventory_differences_report(earlier_inventory_names, later_inventory_names, file_dir, differences_report_name):
+    previous_inventories = [load_previous_inventory(inventory_name) for inventory_name in list(earlier_inventory_names) + list(later_inventory_names)]
+    earlier_inventory_count = len(earlier_inventory_names)
+    change_counts = collections.Counter()
+    new_files = collections.defaultdict(list)
+    missing_files = collections.defaultdict(list)
+    try:
+        with open(differences_report_name, 'w', encoding='utf-8', newline='') as differences_report:
+            differences_writer = csv.writer(differences_report, dialect='backtick')
+            differences_writer.writerow(['Change', 'FilePath', 'PreviousFilePath', 'Checksum', 'PreviousChecksum'])
+            for root, name, history in merged_previous_inventory_records(previous_inventories, file_dir):
+                earlier_records = [record for record in history if record[0] < earlier_inventory_count]
+                later_records = [record for record in history if record[0] >= earlier_inventory_count]
+                # files listed as missing count as not there
+                earlier_record = earlier_records[-1] if earlier_records and earlier_records[-1][1] != 2 else None
+                later_record = later_records[-1] if later_records and later_records[-1][1] != 2 else None
+                name_with_path = previous_inventory_path(root, name)
+                if earlier_record is None and later_record is None:
+                    continue
+                elif earlier_record is None:
+                    new_files[later_record[2]].append(name_with_path)
+                elif later_record is None:
+                    missing_files[earlier_record[2]].append(name_with_path)
+                elif earlier_record[2] and later_record[2]:
+                    change = 'Revalidated' if earlier_record[2] == later_record[2] else 'Changed'
+                    differences_writer.writerow([change, name_with_path, '', later_record[2].hex(), earlier_record[2].hex()])
+                    change_counts[change] += 1
+            for checksum, new_paths in new_files.items():
+                # a file without a checksum (not selected) can't be matched
+                moved_from = missing_files.pop(checksum, []) if checksum else []
+                for new_path_number, name_with_path in enumerate(new_paths):
+                    if new_path_number < len(moved_from):
+                        differences_writer.writerow(['Moved', name_with_path, moved_from[new_path_number], checksum.hex(), checksum.hex()])
+                        change_counts['Moved'] += 1
+                    else:
+                        differences_writer.writerow(['New', name_with_path, '', checksum.hex(), ''])
+                        change_counts['New'] += 1
+                for name_with_path in moved_from[len(new_paths):]:
+                    differences_writer.writerow(['Missing', '', name_with_path, '', checksum.hex()])
+                    change_counts['Missing'] += 1
+            for checksum, missing_paths in missing_files.items():
+                for name_with_path in missing_paths:
+                    differences_writer.writerow(['Missing', '', name_with_path, '', checksum.hex()])
+                    change_counts['Missing'] += 1
+    finally:
+        for previous_inventory in previous_inventories:
+            close_previous_inventory(previous_inventory)
+    return change_counts
 
 
 # determine which files to process based on previous inputs
 #   create outfile with these files
-def file_name_inventory(file_dir, include_true_exclude_false, file_type_string, file_types):
+#   the walk and the hashing overlap: this is a generator, yielding
+#   (FileNumber, path, stat) for each file to process as soon as it's found.
+#   files that aren't selected are added to not_selected_acc (see
+#   new_not_selected_acc()), which is complete once the generator is used up.
+#   the file names are written to file_name_acc_name, which callers put
+#   in their inventory dir (File_Name_Acc.txt)
+def file_name_inventory(file_dir, include_true_exclude_false, file_type_string, file_types, not_selected_acc, file_name_acc_name, enumerate_workers=8):
     time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
-    file_name_acc = {}
     file_count_acc = 0
-    file_name_acc_as_string = ''
-    not_selected_acc = set()
-    not_selected_as_string = ''
+    # the extensions to select, worked out once instead of for every file
+    file_extensions = extension_suffixes(file_types)
+    # create file with file names, written as they're found.
+    #   this is used as a record, backup, and checkpoint source
+    file_name_acc_file = open(file_name_acc_name, 'w', encoding='utf-8')
     # for each folder and file within that directory
     print('%s\nDETERMINING FILES TO PROCESS IN\n%s\nSTARTED AT: %s\n%s' % (('{:^}'.format('='*80)), file_dir, time_stamp, ('{:^}'.format('='*80))))
-    for root, dirs, files in os.walk(file_dir):
-        for folder in dirs:
-            dir_name = folder
-        for name in files:
-            name_with_path = (os.path.join(root, name))
+    try:
+        for name_with_path, file_stat in walk_files(file_dir, enumerate_workers):
             try:
                 # select & acc file types to process based on previous input
-                if name.lower().endswith(tuple(file_types)) == include_true_exclude_false or file_type_string == '' and '._' not in name:
-                    file_count_acc +=1
-                    file_name_acc[file_count_acc] = (name_with_path)
-                    file_name_acc_as_string += ('%s: %s\n' % (file_count_acc, name_with_path))
-                # if not selected, acc to separate variable
-                else:
-                    not_selected_acc.add((name_with_path))
-                    not_selected_as_string += ('%s\n' % name_with_path)
+                selected = file_is_selected(os.path.basename(name_with_path), file_extensions, include_true_exclude_false, file_type_string)
             except:
                 print('---WARNING, ERROR DETERMINING FILES TO PROCESS:\n   %s' % (name_with_path))
-                not_selected_acc.add((name_with_path))
-                not_selected_as_string += ('%s\n' % name_with_path)
-                pass
-    total_to_do = len(file_name_acc)
-    total_not_selected = len(not_selected_acc)
-    # create file with file names.
-    #   this is used as a record, backup, and checkpoint source
-    with open('S:\\Departments\\Digital Services\\Internal\\DigiPres\\Checksum_Inventory_Generation\\Inventories\\File_Name_Acc.txt', 'w', encoding='utf-8') as file_name_acc_file:
-        # fills in accumulator
-        file_name_acc_file.writelines('%s\n\n%s\n\n%s' % (file_name_acc_as_string, ('='*80), not_selected_as_string))
-        
-    # all done!
-    file_name_acc_file.close()
-    print('%s\nFINISHED DETERMINING FILES AT: %s\n%s' % (('{:^}'.format('='*80)), time_stamp, ('{:^}'.format('='*80))))
-    return file_name_acc, not_selected_acc, total_to_do, total_not_selected
+                selected = False
+            # if not selected, acc to separate variable
+            if not selected:
+                not_selected_add(not_selected_acc, name_with_path)
+                continue
+            file_count_acc +=1
+            file_name_acc_file.write('%s: %s\n' % (file_count_acc, name_with_path))
+            yield file_count_acc, name_with_path, file_stat
+        # files not selected go after the ones that are
+        file_name_acc_file.write('\n\n%s\n\n' % ('='*80))
+        for name_with_path in not_selected_paths(not_selected_acc):
+            file_name_acc_file.write('%s\n' % name_with_path)
+    finally:
+        # all done!
+        file_name_acc_file.close()
+    print('%s\nFINISHED DETERMINING FILES AT: %s\n%s files to process, %s not selected\n%s' % (('{:^}'.format('='*80)), time.strftime("%Y-%m-%d_%Hh%Mm%Ss"), file_count_acc, not_selected_acc['count'], ('{:^}'.format('='*80))))
+
+# files that aren't selected, kept in a temp file rather than in memory,
+#   so a tree that's mostly left out doesn't need a set of all its paths.
+#   with a previous_inventory, they're marked in it as they're found,
+#   so they aren't reported missing
+def new_not_selected_acc(previous_inventory=None):
+    return {'spool': tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogateescape', newline=''), 'count': 0, 'previous_inventory': previous_inventory}
+
+def not_selected_add(not_selected_acc, name_with_path):
+    not_selected_acc['spool'].write(name_with_path + '\0')
+    not_selected_acc['count'] += 1
+    if not_selected_acc['previous_inventory'] is not None:
+        previous_inventory_match(not_selected_acc['previous_inventory'], name_with_path)
+
+# the paths of not_selected_acc in the order they were found, read back
+#   1 MB at a time
+def not_selected_paths(not_selected_acc):
+    spool = not_selected_acc['spool']
+    spool.seek(0)
+    partial = ''
+    while True:
+        block = spool.read(1024 * 1024)
+        if block == '':
+            break
+        names = (partial + block).split('\0')
+        partial = names.pop()
+        yield from names
+    spool.seek(0, os.SEEK_END)
+
+def close_not_selected_acc(not_selected_acc):
+    not_selected_acc['spool'].close()
+
+# the selected file types as case-folded name endings, worked out once.
+#   matched with endswith like they always were, so types with more
+#   than one dot (tar.gz) work
+def extension_suffixes(file_types):
+    return tuple(file_type.casefold() for file_type in file_types)
+
+# whether a file is processed, going by its extension.
+#   with no file types given, everything but '._' files is included
+def file_is_selected(name, file_extensions, include_true_exclude_false, file_type_string):
+    return name.casefold().endswith(file_extensions) == include_true_exclude_false or file_type_string == '' and '._' not in name
+
+# list one directory: (path, stat) for each file, and the subdirectories.
+#   stat comes from the directory listing, which on windows costs nothing
+#   extra. like os.walk, links to directories aren't followed
+def scan_dir(dir_path):
+    dir_files = []
+    sub_dirs = []
+    try:
+        with os.scandir(dir_path) as dir_entries:
+            for dir_entry in dir_entries:
+                try:
+                    if dir_entry.is_dir():
+                        if not dir_entry.is_symlink():
+                            sub_dirs.append(dir_entry.path)
+                        continue
+                    dir_files.append((dir_entry.path, dir_entry.stat()))
+                except OSError:
+                    # it'll be stat'd again when it's processed
+                    dir_files.append((dir_entry.path, None))
+    except OSError:
+        print('---WARNING, ERROR LISTING DIRECTORY:\n   %s' % (dir_path))
+    return dir_files, sub_dirs
+
+# walk file_dir, yielding (path, stat) for every file in the same top-down
+#   order as os.walk. enumerate_workers directories are listed at once, so
+#   the round trips to the share overlap, and the walk keeps going ahead
+#   of whatever is using the files, but only by walk_scan_ahead directories
+#   per worker: a new listing is only started as one is used up, so however
+#   big the tree, only that many listings are held while the files wait
+def walk_files(file_dir, enumerate_workers=8):
+    pool = ThreadPoolExecutor(max_workers=enumerate_workers)
+    scan_limit = walk_scan_ahead * enumerate_workers
+    try:
+        # directories still to walk, last in, first out, so the first
+        #   subdirectory is next. each is [path, listing], the listing None
+        #   until it is started and then the future of its scan_dir()
+        pending_dirs = [[file_dir, None]]
+        scans_started = 0
+        while pending_dirs:
+            # start listing the directories that come next
+            for pending_dir in reversed(pending_dirs):
+                if scans_started >= scan_limit:
+                    break
+                if pending_dir[1] is None:
+                    pending_dir[1] = pool.submit(scan_dir, pending_dir[0])
+                    scans_started += 1
+            dir_path, dir_scan = pending_dirs.pop()
+            dir_files, sub_dirs = dir_scan.result()
+            scans_started -= 1
+            for file_item in dir_files:
+                yield file_item
+            pending_dirs.extend([sub_dir, None] for sub_dir in reversed(sub_dirs))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 # this is the meat of the recursive file processing
-def recursive_by_file(file_dir, include_true_exclude_false, file_type_string, file_types, checksum_type, inventory_acc, first_inventory_of_dir, read_inventory, set_first_dir, dict_first_dir, set_first_dir_names, set_matches, file_name_acc, not_selected_acc, total_to_do, total_not_selected, inventory_dir, modified_path, checkpoint_inventory_name, previous_checksums):
+#   files go through a pipeline of stages (see new_pipeline()): worker_count
+#   threads hash (through a process pool if pool_type is 'process'),
+#   validate_workers run mediainfo and check file_specs,
+#   and one thread compares checksums.
+#   with pool_type 'async', worker_count files are hashed at once from one
+#   event loop instead, at most share_concurrency of them on each share.
+#   everything that touches the inventory happens here, in FileNumber order.
+#   if incremental, files that haven't changed since the catalog saw them
+#   aren't hashed again, except for the share of them that's due to be
+#   re-verified so that everything is re-hashed every reverify_days.
+#   resume_journal is the journal of an interrupted run of the same
+#   directory, the files it finished are skipped.
+#   file_items is file_name_inventory(), files are processed as it finds them.
+#   if detect_moves, new files that match a file missing from where the
+#   catalog last saw it are recorded as moved from there (see move_candidates()),
+#   and if incremental as well, aren't hashed again.
+#   run_metrics is from new_run_metrics(), None to collect nothing.
+#   with deep_verify_workers, new and changed media files are also
+#   verified in full (see deep_verify()). embed_checksums renames files to
+#   carry their checksum, name_audit checks the ones that already do
+#   (see checksum_file_name())
+def recursive_by_file(file_dir, include_true_exclude_false, file_type_string, file_types, checksum_type, inventory_writer, first_inventory_of_dir, previous_inventory, file_items, not_selected_acc, inventory_dir, modified_path, checkpoint_inventory_name, duplicate_index, catalog, worker_count=1, pool_type='thread', incremental=False, reverify_days=90, resume_journal=None, validate_workers=2, queue_size=256, file_specs=None, detect_moves=False, run_metrics=None, deep_verify_workers=0, embed_checksums=False, name_audit=False):
     checkpoint = 0
     old_root = ''
-    # while there are still files left unprocessed
-    while checkpoint < total_to_do:
-        # when checkpoint accumulator reaches a multiple of 10000, update outfile
-        if (checkpoint % 10000 == 0) or (checkpoint == 0):
-            checkpoint_save(checkpoint, checkpoint_inventory_name, inventory_acc)
-            inventory_acc = ''
-        checkpoint += 1
-        # os.walk order is consistent: checkpoint == file_name_acc
-        name_with_path = file_name_acc[checkpoint]
-        set_matches.add((name_with_path))
-        time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
-        processing_progress = ''
-        processing_error = ' '
-        try:
-            # reset file-specific variables for every file
-            new_file = ''
-            checksum_consistent = ''
-            file_error = []
-            file_error_count = 0
-            
-            # processing_progress to indicate point of failure if script fails
-            processing_progress = 'IDENTIFYING FILE NAME AND DIRECTORY'
+    # all checksum types are calculated, the first is the main one
+    checksum_types = checksum_type.split()
+    # checksums waiting to be saved to the catalog at the next checkpoint,
+    #   and the old paths of moved files, to be taken out of it
+    catalog_batch = []
+    catalog_moved = []
+    if incremental == False:
+        reverify_days = 0
+    if file_specs is None:
+        file_specs = load_default_file_specs()
+    # files finished before an interrupted run stopped
+    done_paths = set()
+    if resume_journal is not None:
+        done_paths = resume_done_files(resume_journal)
+    # renames a run stopped part way through are finished first
+    rename_journal_name = checkpoint_inventory_name + rename_journal_suffix
+    replay_renames(rename_journal_name)
+    # files renamed with their checksum would otherwise be renamed again
+    if embed_checksums:
+        name_audit = True
+    # processes sidestep the GIL for CPU-bound hashing, threads are
+    #   lighter and enough when the share is the bottleneck
+    hash_pool = ProcessPoolExecutor(max_workers=worker_count, initializer=set_hash_io, initargs=(dict(hash_io_volumes),)) if pool_type == 'process' else None
+    # decoding is CPU-bound, so always processes
+    deep_verify_pool = ProcessPoolExecutor(max_workers=deep_verify_workers) if deep_verify_workers > 0 else None
+    pipeline = new_pipeline({'hash': worker_count, 'validate': validate_workers, 'compare': 1, 'write': 1}, queue_size, run_metrics)
+    start_pipeline(pipeline, file_items, done_paths, catalog, reverify_days, hash_pool, checksum_types, previous_inventory, duplicate_index, file_specs, detect_moves, pool_type == 'async', deep_verify_pool, embed_checksums, name_audit)
+    last_report = time.monotonic()
+    write_profiler = metrics_profiler(run_metrics)
+    try:
+        # the compare stage hands files over in FileNumber order,
+        #   checkpoint is the FileNumber. files being renamed are
+        #   held back until their batch of renames is done
+        for file_item in renamed_file_items(pipeline_items(pipeline, 'write'), rename_journal_name):
+            start_time = time.perf_counter()
+            checkpoint = file_item['file_number']
+            name_with_path = file_item['name_with_path']
+            previous_inventory_match(previous_inventory, name_with_path)
+            # already in the inventory from before the interruption
+            if file_item['done']:
+                continue
+            time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
+            processing_error = ' '
             # split the portions of the file name to separate the extension
             root, name = os.path.split(name_with_path)
             # indicate dir being processed
             if str(root) != str(old_root):
                 print('\n%s\nCURRENTLY PROCESSING:\n%s' % (line_break, root))
             old_root = str(root)
-
-            file_ext = os.path.splitext(name)[-1]
-            checksum = ' '
-            processing_progress = 'CALCULATING CHECKSUM'
-            new_file, checksum, checksum_consistent, file_error, file_error_count, inventory_acc, set_matches = checksums(name, name_with_path, checksum_type, inventory_acc, first_inventory_of_dir, read_inventory, new_file, checksum_consistent, file_error, file_error_count, file_ext, set_first_dir, dict_first_dir, set_first_dir_names, set_matches, previous_checksums)
-
-            # find errors in mediainfo for images and audio
-            # included extensions currently set to media files
-            mediainfo_extensions = ('jpg', 'jp2', 'tif', 'tiff', 'wav', 'mov')
-            if name.lower().endswith(mediainfo_extensions):
-                processing_progress = 'RUNNING MEDIAINFO'
-                file_error_count, file_error = mediainfo(name, name_with_path, file_error_count, file_error)
-            processing_progress = 'ADDING TO INVENTORY'
-        
-        # indicate (human readable) point of error
-        except:
-            processing_error = ('Error in processing while %s' % (processing_progress.lower()))
-            print('---WARNING, ERROR IN PROCESSING WHILE %s:\n   %s' % (processing_progress, name_with_path))
-            # if error, save current work
-            checkpoint_save(checkpoint, checkpoint_inventory_name, inventory_acc)
-        # accumulate file information for csv
-        inventory_acc = accumulation(inventory_acc, time_stamp, name_with_path, root, name, processing_error, checksum, checksum_type, new_file, checksum_consistent, file_error, file_error_count, checkpoint)
-        # delete file out of dict
-        del file_name_acc[checkpoint]
+            if file_item['renamed_from'] != '':
+                name = '%s (renamed from %s)' % (name, os.path.basename(file_item['renamed_from']))
+                previous_inventory_match(previous_inventory, file_item['renamed_from'])
+                catalog_moved.append(file_item['renamed_from'])
+            elif file_item['rename_failed']:
+                processing_error = 'Error in processing while renaming'
+                print('---WARNING, ERROR IN PROCESSING WHILE RENAMING:\n   %s' % (name_with_path))
+            # indicate (human readable) point of error
+            if file_item['failed_while'] != '':
+                processing_error = ('Error in processing while %s' % (file_item['failed_while'].lower()))
+                print('---WARNING, ERROR IN PROCESSING WHILE %s:\n   %s' % (file_item['failed_while'], name_with_path))
+            else:
+                # the checksums are still good, so the file is still compared and cataloged
+                if file_item['validate_failed_while'] != '':
+                    processing_error = ('Error in processing while %s' % (file_item['validate_failed_while'].lower()))
+                    print('---WARNING, ERROR IN PROCESSING WHILE %s:\n   %s' % (file_item['validate_failed_while'], name_with_path))
+                # carried forward checksums keep the time they were last verified
+                last_verified = time.time() if file_item['hash_status'] == 'Hashed' else None
+                if file_item['moved_from'] != '':
+                    print('---FILE WAS MOVED FROM:\n   %s\n   TO:\n   %s' % (file_item['moved_from'], name_with_path))
+                    catalog_moved.append(file_item['moved_from'])
+                    previous_inventory_match(previous_inventory, file_item['moved_from'])
+                    if last_verified is None:
+                        last_verified = file_item['move_candidates'][file_item['moved_from']][2]
+                catalog_add(catalog_batch, name_with_path, file_item['file_stat'], file_item['checksum_dict'], last_verified, file_item['fingerprint'])
+                # started by the compare stage, the pool works ahead of this
+                if file_item['deep_verify'] is not None:
+                    for deep_error in file_item['deep_verify'].result():
+                        file_item['file_error_count'] += 1
+                        file_item['file_error'].append(deep_error)
+                        print('---WARNING, DEEP VERIFICATION FAILED, %s\n   %s' % (deep_error, name_with_path))
+            # write file information to the csv, and when the inventory
+            #   writer's size or time budget is used up, update outfile
+            if accumulation(inventory_writer, time_stamp, name_with_path, root, name, processing_error, file_item['checksum'], checksum_types, file_item['checksum_dict'], file_item['new_file'], file_item['checksum_consistent'], file_item['file_error'], file_item['file_error_count'], checkpoint, file_item['hash_status']):
+                with pipeline['catalog_lock']:
+                    catalog_forget(catalog, catalog_moved)
+                    checkpoint_save(checkpoint, inventory_writer, catalog, catalog_batch)
+            pipeline_count(pipeline, 'write', time.perf_counter() - start_time)
+            if time.monotonic() - last_report >= pipeline_report_seconds:
+                print('PIPELINE: %s' % (pipeline_report(pipeline)))
+                last_report = time.monotonic()
+            if run_metrics is not None and time.monotonic() - run_metrics['last_progress'] >= metrics_progress_seconds:
+                print('PROGRESS: %s' % (metrics_progress(run_metrics, checkpoint, pipeline['found'], pipeline['enumerated'])))
+                run_metrics['last_progress'] = time.monotonic()
+    finally:
+        metrics_profiler_stop(run_metrics, write_profiler)
+        stop_pipeline(pipeline, hash_pool)
+        if deep_verify_pool is not None:
+            deep_verify_pool.shutdown(cancel_futures=True)
+    # a stage that broke stops the whole pipeline
+    if pipeline['error'] is not None:
+        raise pipeline['error']
     # after all files have been processed, save.
-    checkpoint_save(checkpoint, checkpoint_inventory_name, inventory_acc)
+    catalog_forget(catalog, catalog_moved)
+    checkpoint_save(checkpoint, inventory_writer, catalog, catalog_batch)
+    print('%s\nPIPELINE FINISHED:\n%s\n%s' % (line_break, pipeline_report(pipeline).replace(' | ', '\n'), line_break))
 
     # determine which files were in previous inventory but not dir
-    leftover_files = set_first_dir_names - (set_matches|not_selected_acc)
+    #   (files that moved are recorded where they are now). they're
+    #   read from the previous inventory as they're written
+    leftover_files = previous_inventory_unmatched_paths(previous_inventory)
+
+    return leftover_files, checkpoint
+
+# processing pipeline
+#   enumerate -> hash -> validate -> compare -> write. each stage has its own
+#   worker threads and takes files from a queue of at most queue_size, so a
+#   stage that gets ahead waits for the next one instead of piling up files
+#   in memory, and a run takes as long as its slowest stage rather than
+#   all of them added up. files are passed along as dicts (see
+#   pipeline_enumerate()), and one that fails a stage goes straight through
+#   the rest with failed_while set. one that fails validation has
+#   validate_failed_while set instead, and is still compared and cataloged
+#   like it was before the pipeline, when the checksum came first
+pipeline_stage_names = ('hash', 'validate', 'compare', 'write')
+pipeline_stage_failures = {'hash': 'CALCULATING CHECKSUM', 'validate': 'RUNNING MEDIAINFO', 'compare': 'COMPARING CHECKSUMS'}
+# how often queue depths and throughput are printed
+pipeline_report_seconds = 30
+
+def new_pipeline(stage_workers, queue_size, run_metrics=None):
+    pipeline = {'stop': threading.Event(), 'error': None, 'threads': [], 'start_time': time.monotonic(), 'found': 0, 'enumerated': False,
+        'metrics': run_metrics,
+        # the catalog connection is shared by the stages, one at a time
+        'catalog_lock': threading.Lock(),
+        # old paths of moved files, each claimed by the first file found there
+        'moved_paths': set(),
+        # files between enumeration and the compare stage. compare takes them
+        #   in FileNumber order, so one file held up (ex. waiting to retry)
+        #   would otherwise let everything behind it pile up waiting for it
+        'window': threading.Semaphore(queue_size * len(pipeline_stage_names)),
+        'stages': {}}
+    for stage_name in pipeline_stage_names:
+        pipeline['stages'][stage_name] = {'queue': queue.Queue(maxsize=queue_size), 'workers': stage_workers[stage_name], 'running': stage_workers[stage_name], 'done': 0, 'busy_seconds': 0.0, 'lock': threading.Lock()}
+    return pipeline
+
+def start_pipeline(pipeline, file_items, done_paths, catalog, reverify_days, hash_pool, checksum_types, previous_inventory, duplicate_index, file_specs, detect_moves=False, async_hash=False, deep_verify_pool=None, embed_checksums=False, name_audit=False):
+    stage_threads = [(pipeline_enumerate, (pipeline, file_items, done_paths, catalog, reverify_days, detect_moves, checksum_types, name_audit))]
+    if async_hash:
+        stage_threads += [(pipeline_async_hash, (pipeline, checksum_types, reverify_days, catalog))]
+    else:
+        stage_threads += [(pipeline_worker, (pipeline, 'hash', 'validate', pipeline_hash, (pipeline, checksum_types, reverify_days, hash_pool, catalog)))] * pipeline['stages']['hash']['workers']
+    # files waiting for validation are taken a batch at a time,
+    #   so MediaInfo can be run for several at once
+    stage_threads += [(pipeline_worker, (pipeline, 'validate', 'compare', pipeline_validate, (pipeline, checksum_types, catalog, file_specs), False, mediainfo_batch_size))] * pipeline['stages']['validate']['workers']
+    # the duplicate index isn't shared, and duplicates are found in FileNumber order
+    stage_threads += [(pipeline_worker, (pipeline, 'compare', 'write', pipeline_compare, (pipeline, checksum_types, previous_inventory, duplicate_index, catalog, deep_verify_pool, embed_checksums, detect_moves), True))]
+    for stage_function, stage_args in stage_threads:
+        stage_thread = threading.Thread(target=pipeline_thread, args=(pipeline, stage_function, stage_args), daemon=True)
+        stage_thread.start()
+        pipeline['threads'].append(stage_thread)
+
+# a stage thread, profiled if the run is being profiled
+def pipeline_thread(pipeline, stage_function, stage_args):
+    stage_profiler = metrics_profiler(pipeline['metrics'])
+    try:
+        stage_function(*stage_args)
+    finally:
+        metrics_profiler_stop(pipeline['metrics'], stage_profiler)
+
+def stop_pipeline(pipeline, hash_pool):
+    pipeline['stop'].set()
+    for stage_thread in pipeline['threads']:
+        stage_thread.join()
+    if hash_pool is not None:
+        hash_pool.shutdown()
+
+def pipeline_fail(pipeline, error):
+    if pipeline['error'] is None:
+        pipeline['error'] = error
+    pipeline['stop'].set()
+
+# put a file on a stage's queue, waiting while it's full.
+#   False if the pipeline was stopped
+def pipeline_put(pipeline, stage_name, file_item):
+    stage_queue = pipeline['stages'][stage_name]['queue']
+    while not pipeline['stop'].is_set():
+        try:
+            stage_queue.put(file_item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+# the next file on a stage's queue, None when there are no more
+#   or the pipeline was stopped
+def pipeline_get(pipeline, stage_name):
+    stage_queue = pipeline['stages'][stage_name]['queue']
+    while not pipeline['stop'].is_set():
+        try:
+            return stage_queue.get(timeout=0.5)
+        except queue.Empty:
+            pass
+    return None
+
+# wait for room in the pipeline's window for another file,
+#   False if the pipeline was stopped
+def pipeline_window_acquire(pipeline):
+    while not pipeline['stop'].is_set():
+        if pipeline['window'].acquire(timeout=0.5):
+            return True
+    return False
+
+# the files for one worker of a stage. in_order holds files back until
+#   all of the ones before them have arrived (only for a single worker),
+#   and makes room in the window for each file it lets through
+def pipeline_items(pipeline, stage_name, in_order=False):
+    waiting = {}
+    next_file_number = 1
+    while True:
+        file_item = pipeline_get(pipeline, stage_name)
+        if file_item is None:
+            return
+        if not in_order:
+            yield file_item
+            continue
+        waiting[file_item['file_number']] = file_item
+        while next_file_number in waiting:
+            pipeline['window'].release()
+            yield waiting.pop(next_file_number)
+            next_file_number += 1
+
+# the files for one worker of a stage, in lists of up to batch_size:
+#   whatever is waiting on the queue, without waiting for more
+def pipeline_batches(pipeline, stage_name, batch_size):
+    stage_queue = pipeline['stages'][stage_name]['queue']
+    while True:
+        file_item = pipeline_get(pipeline, stage_name)
+        if file_item is None:
+            return
+        file_batch = [file_item]
+        while len(file_batch) < batch_size:
+            try:
+                file_item = stage_queue.get_nowait()
+            except queue.Empty:
+                break
+            if file_item is None:
+                yield file_batch
+                return
+            file_batch.append(file_item)
+        yield file_batch
+
+# when the last worker of a stage is done, tell every worker of the next one
+def pipeline_end_stage(pipeline, stage_name):
+    for worker in range(pipeline['stages'][stage_name]['workers']):
+        pipeline_put(pipeline, stage_name, None)
+
+def pipeline_count(pipeline, stage_name, busy_seconds):
+    stage = pipeline['stages'][stage_name]
+    with stage['lock']:
+        stage['done'] += 1
+        stage['busy_seconds'] += busy_seconds
+    # hashing is timed as opening and hashing by hash_file_result()
+    if stage_name != 'hash':
+        metrics_time(pipeline['metrics'], pipeline_metric_names[stage_name], busy_seconds)
+
+# files found, and for each stage: files done, files per second,
+#   files waiting on its queue and how busy its workers were
+def pipeline_report(pipeline):
+    seconds = max(time.monotonic() - pipeline['start_time'], 0.001)
+    stage_reports = ['found %s (%.1f files/s)' % (pipeline['found'], pipeline['found'] / seconds)]
+    for stage_name in pipeline_stage_names:
+        stage = pipeline['stages'][stage_name]
+        stage_reports.append('%s %s (%.1f files/s, %s queued, %s worker(s) %.0f%% busy)' % (stage_name, stage['done'], stage['done'] / seconds, stage['queue'].qsize(), stage['workers'], 100 * stage['busy_seconds'] / seconds / stage['workers']))
+    return ' | '.join(stage_reports)
+
+# enumerate stage: turn the files from the directory walk into file items.
+#   catalog records are looked up here. if detect_moves, files the catalog
+#   doesn't have are marked if it has a file of the same size, and only
+#   those are fingerprinted ahead of hashing (see pipeline_move_candidates())
+# with name_audit, files whose names carry a checksum are expected to
+#   hash to it. in incremental mode, if the catalog shows they haven't
+#   changed and aren't due to be re-verified, its checksums are checked
+#   against the name instead of the file being read again
+def pipeline_enumerate(pipeline, file_items, done_paths, catalog, reverify_days, detect_moves=False, checksum_types=None, name_audit=False):
+    try:
+        # time waiting for the walk, and looking files up in the catalog
+        enumerate_start = time.perf_counter()
+        for file_number, name_with_path, file_stat in file_items:
+            file_item = {'file_number': file_number, 'name_with_path': name_with_path, 'file_stat': file_stat, 'previous_record': None,
+                'move_candidates': None, 'move_size_match': False, 'moved_from': '', 'fingerprint': None,
+                'name_checksum': checksum_from_file_name(os.path.basename(name_with_path)) if name_audit else None, 'renamed_from': '', 'rename_failed': False,
+                'done': name_with_path in done_paths, 'failed_while': '', 'validate_failed_while': '', 'checksum_dict': {}, 'hash_status': '',
+                'file_error_count': 0, 'file_error': [], 'new_file': '', 'checksum': ' ', 'checksum_consistent': '', 'deep_verify': None}
+            if (reverify_days or detect_moves) and not file_item['done']:
+                with pipeline['catalog_lock']:
+                    file_item['previous_record'] = catalog_lookup_path(catalog, name_with_path)
+                    if detect_moves:
+                        file_item['move_candidates'] = {}
+                        # without incremental every file is read in full, moved or not
+                        file_item['move_size_match'] = reverify_days > 0 and not file_item['previous_record'] and move_size_match(catalog, file_stat)
+                if file_item['name_checksum'] is not None:
+                    checksum_dict = carry_forward_checksums(name_with_path, file_stat, file_item['previous_record'], checksum_types, reverify_days)
+                    if checksum_dict is not None:
+                        file_item.update({'checksum_dict': checksum_dict, 'hash_status': 'Carried forward'})
+            pipeline['found'] += 1
+            metrics_time(pipeline['metrics'], 'enumerate', time.perf_counter() - enumerate_start)
+            if not pipeline_window_acquire(pipeline) or not pipeline_put(pipeline, 'hash', file_item):
+                return
+            enumerate_start = time.perf_counter()
+        pipeline['enumerated'] = True
+    except BaseException as error:
+        pipeline_fail(pipeline, error)
+    finally:
+        pipeline_end_stage(pipeline, 'hash')
+
+# one worker of a stage: run stage_function on each file
+#   and pass it on to the next stage. with a batch_size, stage_function
+#   is given lists of files instead
+def pipeline_worker(pipeline, stage_name, next_stage_name, stage_function, stage_args, in_order=False, batch_size=None):
+    stage = pipeline['stages'][stage_name]
+    try:
+        if batch_size is None:
+            file_batches = ([file_item] for file_item in pipeline_items(pipeline, stage_name, in_order))
+        else:
+            file_batches = pipeline_batches(pipeline, stage_name, batch_size)
+        for file_batch in file_batches:
+            start_time = time.perf_counter()
+            to_do = [file_item for file_item in file_batch if not file_item['done'] and file_item['failed_while'] == '']
+            if to_do:
+                try:
+                    stage_function(to_do if batch_size is not None else to_do[0], *stage_args)
+                except Exception:
+                    for file_item in to_do:
+                        pipeline_item_failed(file_item, stage_name)
+            busy_seconds = (time.perf_counter() - start_time) / len(file_batch)
+            for file_item in file_batch:
+                pipeline_count(pipeline, stage_name, busy_seconds)
+                if not pipeline_put(pipeline, next_stage_name, file_item):
+                    return
+    except BaseException as error:
+        pipeline_fail(pipeline, error)
+    finally:
+        with stage['lock']:
+            stage['running'] -= 1
+            last_worker = stage['running'] == 0
+        if last_worker:
+            pipeline_end_stage(pipeline, next_stage_name)
+
+# a file that fails validation was still hashed, so only its
+#   inventory row says so
+def pipeline_item_failed(file_item, stage_name):
+    if stage_name == 'validate':
+        file_item['validate_failed_while'] = pipeline_stage_failures[stage_name]
+    else:
+        file_item['failed_while'] = pipeline_stage_failures[stage_name]
+
+# hash stage: checksums, or the ones carried forward from the catalog.
+#   a file that can't be read because of a share error is retried after
+#   each of hash_retry_delays, then recorded as failed, so a share dropping
+#   out doesn't stop the run. other failures are recorded straight away
+def pipeline_hash(file_item, pipeline, checksum_types, reverify_days, hash_pool, catalog):
+    # already checked against the name
+    if file_item['hash_status'] != '':
+        return
+    pipeline_move_candidates(file_item, pipeline, catalog)
+    hash_args = hash_file_args(file_item, checksum_types, reverify_days)
+    for delay in (None,) + hash_retry_delays:
+        if delay is not None:
+            retry_wait = hash_retry_wait(file_item, delay)
+            if pipeline['stop'].wait(retry_wait):
+                break
+        hash_result = run_hash_file(hash_pool, hash_args)
+        if hash_result[2] == '' or not hash_result[8]:
+            break
+    hash_file_result(pipeline, file_item, hash_result)
+
+def run_hash_file(hash_pool, hash_args):
+    if hash_pool is None:
+        return hash_file(*hash_args)
+    return hash_pool.submit(hash_file, *hash_args).result()
+
+def hash_file_args(file_item, checksum_types, reverify_days):
+    return (file_item['name_with_path'], checksum_types, checksum_engine, file_item['previous_record'], reverify_days, file_item['file_stat'], file_item['move_candidates'], file_item['fingerprint'])
+
+def hash_file_result(pipeline, file_item, hash_result):
+    file_stat, checksum_dict, failed_while, hash_status, fingerprint, moved_from, open_seconds, hash_seconds, can_retry = hash_result
+    file_item.update({'file_stat': file_stat, 'checksum_dict': checksum_dict, 'failed_while': failed_while, 'hash_status': hash_status, 'fingerprint': fingerprint, 'moved_from': moved_from})
+    if pipeline['metrics'] is not None and hash_status == 'Hashed':
+        metrics_time(pipeline['metrics'], 'open', open_seconds)
+        metrics_time(pipeline['metrics'], 'hash', hash_seconds)
+        metrics_file(pipeline['metrics'], file_item['name_with_path'], open_seconds + hash_seconds, file_stat.st_size)
+
+# seconds before the next try, jittered, and say so
+def hash_retry_wait(file_item, delay):
+    retry_wait = delay * random.uniform(0.5, 1.5)
+    print('---WARNING, FILE CANNOT BE READ, TRYING AGAIN IN %.0f SECONDS:\n   %s' % (retry_wait, file_item['name_with_path']))
+    return retry_wait
+
+# whether an error hashing a file might clear up if it's tried again
+def hash_error_can_retry(error):
+    if isinstance(error, (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)) or not isinstance(error, OSError):
+        return False
+    return error.errno in hash_retry_errnos or getattr(error, 'winerror', None) in hash_retry_winerrors
+
+# asyncio hash stage
+#   for shares where every open, stat and read waits on the network, so
+#   what matters is how many are in flight. one thread runs an event loop
+#   that takes files off the hash queue and keeps up to the stage's worker
+#   count of them hashing in a thread pool (hashlib releases the GIL), at
+#   most share_concurrency of them on any one share. retries wait
+#   asynchronously, holding their share's slot, so a share that has dropped
+#   out slows down instead of being hammered
+def pipeline_async_hash(pipeline, checksum_types, reverify_days, catalog):
+    try:
+        asyncio.run(async_hash_files(pipeline, checksum_types, reverify_days, catalog))
+    except BaseException as error:
+        pipeline_fail(pipeline, error)
+    finally:
+        pipeline_end_stage(pipeline, 'validate')
+
+async def async_hash_files(pipeline, checksum_types, reverify_days, catalog):
+    loop = asyncio.get_running_loop()
+    worker_count = pipeline['stages']['hash']['workers']
+    in_flight = asyncio.Semaphore(worker_count)
+    share_limits = {}
+    hash_tasks = set()
+    with ThreadPoolExecutor(max_workers=worker_count) as hash_executor:
+        while True:
+            await in_flight.acquire()
+            # queue waits happen in the loop's own executor, not the hashing one
+            file_item = await loop.run_in_executor(None, pipeline_get, pipeline, 'hash')
+            if file_item is None:
+                in_flight.release()
+                break
+            hash_task = asyncio.create_task(async_hash_file(file_item, pipeline, checksum_types, reverify_days, catalog, hash_executor, share_limits, in_flight))
+            hash_tasks.add(hash_task)
+            hash_task.add_done_callback(hash_tasks.discard)
+        if hash_tasks:
+            await asyncio.gather(*hash_tasks)
+
+async def async_hash_file(file_item, pipeline, checksum_types, reverify_days, catalog, hash_executor, share_limits, in_flight):
+    loop = asyncio.get_running_loop()
+    try:
+        start_time = time.perf_counter()
+        if not file_item['done'] and file_item['failed_while'] == '' and file_item['hash_status'] == '':
+            share = share_name(file_item['name_with_path'])
+            if share not in share_limits:
+                share_limits[share] = asyncio.Semaphore(share_concurrency_for(share))
+            async with share_limits[share]:
+                await loop.run_in_executor(hash_executor, pipeline_move_candidates, file_item, pipeline, catalog)
+                hash_args = hash_file_args(file_item, checksum_types, reverify_days)
+                for delay in (None,) + hash_retry_delays:
+                    if delay is not None:
+                        await asyncio.sleep(hash_retry_wait(file_item, delay))
+                        if pipeline['stop'].is_set():
+                            break
+                    hash_result = await loop.run_in_executor(hash_executor, hash_file, *hash_args)
+                    if hash_result[2] == '' or not hash_result[8]:
+                        break
+            hash_file_result(pipeline, file_item, hash_result)
+        pipeline_count(pipeline, 'hash', time.perf_counter() - start_time)
+        await loop.run_in_executor(None, pipeline_put, pipeline, 'validate', file_item)
+    except Exception as error:
+        pipeline_fail(pipeline, error)
+    finally:
+        in_flight.release()
+
+# the share (drive or \\server\share) a file is on
+def share_name(name_with_path):
+    return os.path.splitdrive(hash_io_key(name_with_path))[0]
+
+def share_concurrency_for(share):
+    for configured_share, limit in share_concurrency.items():
+        if os.path.normcase(configured_share.rstrip('\\/')) == share:
+            return limit
+    return share_concurrency_default
+
+# validate stage: find errors in mediainfo for images and audio.
+#   headers that can't be read natively come from the MediaInfo cache
+#   or, for the ones it doesn't have, one MediaInfo run for the batch.
+#   files whose headers were read natively never fail with the batch
+def pipeline_validate(file_items, pipeline, checksum_types, catalog, file_specs):
+    mediainfo_items = []
+    for file_item in file_items:
+        name_with_path = file_item['name_with_path']
+        if not name_with_path.lower().endswith(mediainfo_extensions):
+            continue
+        try:
+            mediainfo_dict = read_media_header(name_with_path)
+        except Exception:
+            pipeline_item_failed(file_item, 'validate')
+            continue
+        if mediainfo_dict is None:
+            mediainfo_items.append(file_item)
+        else:
+            file_item['file_error_count'], file_item['file_error'] = mediainfo_checks(name_with_path, mediainfo_dict, file_item['file_error_count'], file_item['file_error'], file_specs)
+    if not mediainfo_items:
+        return
+    name_checksums = [(file_item['name_with_path'], file_item['checksum_dict'].get(checksum_types[0], '')) for file_item in mediainfo_items]
+    try:
+        fields_by_path = mediainfo_cached_fields(name_checksums, checksum_types[0], catalog, pipeline['catalog_lock'])
+    except Exception:
+        # one file MediaInfo can't handle fails the whole batch,
+        #   so each is run again on its own and only the ones that fail are
+        fields_by_path = {}
+        for name_checksum in name_checksums:
+            try:
+                fields_by_path.update(mediainfo_cached_fields([name_checksum], checksum_types[0], catalog, pipeline['catalog_lock']))
+            except Exception:
+                pass
+    for file_item in mediainfo_items:
+        name_with_path = file_item['name_with_path']
+        if name_with_path not in fields_by_path:
+            pipeline_item_failed(file_item, 'validate')
+            continue
+        file_item['file_error_count'], file_item['file_error'] = mediainfo_checks(name_with_path, fields_by_path[name_with_path], file_item['file_error_count'], file_item['file_error'], file_specs)
+
+# compare stage: against past inventories, and for duplicates.
+#   files are compared in FileNumber order, so when several new files
+#   match the same moved one, the first is the one that moved.
+#   if detect_moves, a new file that wasn't found to have moved by its
+#   fingerprint is looked for in the catalog by its checksums, which is how
+#   files too small to fingerprint are found (see checksum_moved_from()).
+#   new files and ones whose checksum changed are sent for deep verification.
+#   with embed_checksums, files without a checksum in their name are given
+#   their new name here, and renamed by the write stage
+def pipeline_compare(file_item, pipeline, checksum_types, previous_inventory, duplicate_index, catalog, deep_verify_pool=None, embed_checksums=False, detect_moves=False):
+    if detect_moves and file_item['moved_from'] == '' and file_item['hash_status'] == 'Hashed' and not file_item['previous_record']:
+        with pipeline['catalog_lock']:
+            file_item['moved_from'] = checksum_moved_from(catalog, checksum_types, file_item['checksum_dict'], file_item['file_stat'], pipeline['moved_paths'])
+    if file_item['moved_from'] in pipeline['moved_paths']:
+        file_item['moved_from'] = ''
+    elif file_item['moved_from'] != '':
+        pipeline['moved_paths'].add(file_item['moved_from'])
+    if embed_checksums and file_item['name_checksum'] is None and file_item['checksum_dict'].get(checksum_types[0]):
+        root, name = os.path.split(file_item['name_with_path'])
+        file_item['renamed_from'] = file_item['name_with_path']
+        file_item['name_with_path'] = os.path.join(root, checksum_file_name(name, checksum_types[0], file_item['checksum_dict'][checksum_types[0]]))
+    with pipeline['catalog_lock']:
+        file_item['new_file'], file_item['checksum'], file_item['checksum_consistent'] = checksums(file_item['name_with_path'], checksum_types, file_item['checksum_dict'], previous_inventory, duplicate_index, catalog, file_item['moved_from'], file_item['name_checksum'], file_item['renamed_from'])
+    if deep_verify_pool is not None and file_item['name_with_path'].lower().endswith(deep_verify_extensions):
+        if file_item['new_file'] == 'First inventory of this file' or 'Inconsistent checksum.' in file_item['checksum_consistent'] or 'Checksum does not match file name.' in file_item['checksum_consistent']:
+            # a file that's getting its checksum name still has its old one
+            #   until its rename batch, which waits for this (rename_files())
+            file_item['deep_verify'] = deep_verify_pool.submit(deep_verify, file_item['renamed_from'] or file_item['name_with_path'])
+
+# the hashing part of processing a file. can run in a process pool,
+#   so it can't print prompts or touch shared state, it only returns what
+#   it found along with 'CALCULATING CHECKSUM' if it failed ('' if not)
+#   and whether the checksums were 'Hashed' or 'Carried forward'
+#   from previous_record, or from the file it was moved from.
+#   file_stat is the stat from the directory walk, if there is one.
+#   move_candidates is None unless moves are being looked for, then the
+#   file's fingerprint (taken from the hash pass if it wasn't given) and
+#   the path it was moved from ('' if it wasn't) are returned as well.
+#   checksums are only carried forward from a move when incremental
+#   (reverify_days > 0), otherwise the file is hashed like any other.
+#   then the seconds it took to open the file and to hash it, for run
+#   metrics, and last whether a failure is worth retrying
+#   (see hash_error_can_retry())
+def hash_file(name_with_path, checksum_types, engine, previous_record=None, reverify_days=0, file_stat=None, move_candidates=None, fingerprint=None):
+    checksum_dict = {}
+    hash_status = ''
+    moved_from = ''
+    move_matches = []
+    open_seconds = 0.0
+    hash_seconds = 0.0
+    try:
+        # size and modified time go in the catalog with the checksums
+        if file_stat is None:
+            file_stat = os.stat(name_with_path)
+        checksum_dict = carry_forward_checksums(name_with_path, file_stat, previous_record, checksum_types, reverify_days)
+        if checksum_dict is None and move_candidates and reverify_days > 0:
+            move_matches = matching_move_candidates(file_stat, fingerprint, move_candidates, checksum_types)
+            moved_from, checksum_dict = carry_forward_move(file_stat, move_matches, checksum_types)
+        if checksum_dict is None:
+            fingerprint_wanted = move_candidates is not None and fingerprint is None and file_stat.st_size >= move_min_size
+            hash_timings.open_seconds = 0.0
+            hash_fingerprint_start(file_stat.st_size if fingerprint_wanted else None)
+            start_time = time.perf_counter()
+            try:
+                checksum_dict = calculate_checksums(name_with_path, checksum_types, engine)
+            finally:
+                collected_fingerprint = hash_fingerprint_finish()
+            open_seconds = hash_timings.open_seconds
+            hash_seconds = time.perf_counter() - start_time - open_seconds
+            hash_status = 'Hashed'
+            if fingerprint_wanted:
+                # engines that don't read the file here, like certUtil, give nothing
+                fingerprint = collected_fingerprint or file_fingerprint(name_with_path, file_stat.st_size)
+            # a file that only partly matched is a move if the checksums agree
+            for candidate_path, candidate_mtime, candidate_fingerprint, candidate_checksums in move_matches:
+                if all(candidate_checksums[checksum_type] == normalize_checksum(checksum_dict[checksum_type]) for checksum_type in checksum_types):
+                    moved_from = candidate_path
+                    break
+        else:
+            hash_status = 'Carried forward'
+    except Exception as error:
+        return file_stat, {}, 'CALCULATING CHECKSUM', '', None, '', open_seconds, hash_seconds, hash_error_can_retry(error)
+    return file_stat, checksum_dict, '', hash_status, fingerprint, moved_from, open_seconds, hash_seconds, False
+
+# the checksums from the catalog if the file looks unchanged since they
+#   were calculated (same size, modified time and file ID), and it isn't due
+#   to be re-verified. None if it needs to be hashed
+def carry_forward_checksums(name_with_path, file_stat, previous_record, checksum_types, reverify_days):
+    if reverify_days <= 0:
+        return None
+    checksum_dict = unchanged_checksums(file_stat, previous_record, checksum_types)
+    if checksum_dict is None:
+        return None
+    for checksum_type in checksum_types:
+        last_verified = previous_record[checksum_type][4]
+        # never verified, or not verified in the last reverify_days
+        if last_verified is None or time.time() - last_verified > reverify_days * 86400:
+            return None
+    # a rolling 1/reverify_days of the collection is re-hashed every day,
+    #   so re-verification is spread out instead of all coming due at once
+    if zlib.crc32(name_with_path.encode('utf-8', 'surrogateescape')) % reverify_days == int(time.time() // 86400) % reverify_days:
+        return None
+    return checksum_dict
+
+# the catalog's checksums if the file has the same size, modified time and
+#   file ID it had when they were calculated, None if not
+def unchanged_checksums(file_stat, previous_record, checksum_types):
+    if not previous_record:
+        return None
+    checksum_dict = {}
+    for checksum_type in checksum_types:
+        if checksum_type not in previous_record:
+            return None
+        checksum, size, mtime, file_id, last_verified = previous_record[checksum_type]
+        if size != file_stat.st_size or mtime != file_stat.st_mtime:
+            return None
+        # some shares don't give file IDs, then only size and mtime count
+        if file_id and file_stat.st_ino and file_id != file_stat.st_ino:
+            return None
+        checksum_dict[checksum_type] = checksum
+    return checksum_dict
+
+# checksums in file names
+#   files can carry their checksum in their name, the way they used to:
+#   name___MD5_<checksum>.ext. with embed_checksums files are renamed to it
+#   once hashed. renames are done a batch at a time, and each batch is saved
+#   to a journal next to the temp inventory before any file is renamed, so
+#   if the run stops part way through, the next one finishes the batch
+#   (replay_renames()). their rows are written once they've been renamed,
+#   with the files after them held back so the inventory stays in order
+checksum_name_separator = '___'
+checksum_name_pattern = re.compile(r'^(?P<name>.*)___(?P<type>[A-Z0-9_]+)_(?P<checksum>[0-9a-fA-F]+)(?P<extension>\.[^.]*)?$')
+rename_journal_suffix = '.renames'
+rename_batch_size = 64
+# files held back behind a batch, at most
+rename_hold_limit = 4096
+
+def checksum_file_name(name, checksum_type, checksum):
+    stem, dot, extension = name.rpartition('.')
+    if dot == '':
+        stem, extension = name, ''
+    return '%s%s%s_%s%s%s' % (stem, checksum_name_separator, checksum_type.upper(), normalize_checksum(checksum), dot, extension)
+
+# (checksum type, checksum) from a name made by checksum_file_name(),
+#   None if it doesn't carry one
+def checksum_from_file_name(name):
+    name_match = checksum_name_pattern.match(name)
+    if name_match is None:
+        return None
+    checksum_type = name_match.group('type').upper()
+    # a checksum of the right length for an algorithm we know
+    if checksum_type not in hash_algorithms or len(name_match.group('checksum')) != 2 * hash_algorithms[checksum_type]().digest_size:
+        return None
+    return checksum_type, name_match.group('checksum').lower()
+
+# files from the write queue, in order, with the ones that are to be renamed
+#   held (and everything after them) until rename_batch_size of them are
+#   ready or the queue runs out, then renamed together
+def renamed_file_items(file_items, rename_journal_name):
+    held_items = []
+    rename_count = 0
+    for file_item in file_items:
+        if file_item['renamed_from'] == '' and not held_items:
+            yield file_item
+            continue
+        held_items.append(file_item)
+        if file_item['renamed_from'] != '':
+            rename_count += 1
+        if rename_count >= rename_batch_size or len(held_items) >= rename_hold_limit:
+            rename_files(rename_journal_name, held_items)
+            yield from held_items
+            held_items = []
+            rename_count = 0
+    rename_files(rename_journal_name, held_items)
+    yield from held_items
+
+# rename a batch: journal, rename, then drop the journal. a file that can't be
+#   renamed (or whose new name is taken) keeps its name and rename_failed is set.
+#   deep verification of the batch, started on the old names, is finished
+#   first, so no file is renamed while it's being read
+def rename_files(rename_journal_name, file_items):
+    renamed_items = [file_item for file_item in file_items if file_item['renamed_from'] != '']
+    if not renamed_items:
+        return
+    wait([file_item['deep_verify'] for file_item in renamed_items if file_item.get('deep_verify') is not None])
+    write_journal(rename_journal_name, {'renames': [(file_item['renamed_from'], file_item['name_with_path']) for file_item in renamed_items]})
+    for file_item in renamed_items:
+        try:
+            if os.path.exists(file_item['name_with_path']):
+                raise FileExistsError(file_item['name_with_path'])
+            os.rename(file_item['renamed_from'], file_item['name_with_path'])
+        except OSError:
+            file_item.update({'name_with_path': file_item['renamed_from'], 'renamed_from': '', 'rename_failed': True})
+    os.remove(rename_journal_name)
+
+# finish the renames of a batch a stopped run was part way through.
+#   renames that were done are skipped, so it can be run again
+def replay_renames(rename_journal_name):
+    try:
+        with open(rename_journal_name, 'r', encoding='utf-8') as journal_infile:
+            renames = json.load(journal_infile)['renames']
+    except (OSError, ValueError):
+        return
+    replayed = 0
+    for old_name_with_path, name_with_path in renames:
+        if os.path.exists(old_name_with_path) and not os.path.exists(name_with_path):
+            os.rename(old_name_with_path, name_with_path)
+            replayed += 1
+    os.remove(rename_journal_name)
+    print('\n%s\nRENAMES FINISHED:\n%s of %s file(s) from the last run renamed\n%s' % (line_break, replayed, len(renames), line_break))
+
+# run metrics
+#   what a run spent its time on: seconds and files for each step
+#   (run_metric_stages), bytes hashed, and histograms of how long files took
+#   to open and hash by extension and by directory. stage threads add to it
+#   as they go, under its lock; with metrics off it's None and every call
+#   returns straight away. written out with write_run_summary()
+run_metric_stages = ('enumerate', 'open', 'hash', 'mediainfo', 'compare', 'write')
+pipeline_metric_names = {'validate': 'mediainfo', 'compare': 'compare', 'write': 'write'}
+# how often the progress line is printed
+metrics_progress_seconds = 10
+# directories get their own histogram up to this many, the rest are '(other)'
+metrics_directory_limit = 1000
+
+# expected_files (from the previous inventory) stands in for the total for
+#   the ETA until every file has been found. with profile, every stage
+#   thread is run under cProfile
+def new_run_metrics(expected_files=0, profile=False):
+    return {'lock': threading.Lock(), 'start_time': time.monotonic(), 'started_at': time.strftime("%Y-%m-%d_%Hh%Mm%Ss"),
+        'expected_files': expected_files, 'last_progress': time.monotonic(),
+        'stages': {stage_name: {'files': 0, 'seconds': 0.0} for stage_name in run_metric_stages},
+        'files_hashed': 0, 'bytes_hashed': 0, 'by_extension': {}, 'by_directory': {},
+        'profilers': [] if profile else None}
+
+def metrics_time(run_metrics, stage_name, seconds, file_count=1):
+    if run_metrics is None:
+        return
+    with run_metrics['lock']:
+        stage = run_metrics['stages'][stage_name]
+        stage['files'] += file_count
+        stage['seconds'] += seconds
+
+# a hashed file's time (opening and hashing) in the histograms
+def metrics_file(run_metrics, name_with_path, seconds, size):
+    if run_metrics is None:
+        return
+    root, name = os.path.split(name_with_path)
+    extension = os.path.splitext(name)[1].lower().lstrip('.') or '(none)'
+    bucket = metrics_bucket(seconds)
+    with run_metrics['lock']:
+        run_metrics['files_hashed'] += 1
+        run_metrics['bytes_hashed'] += size
+        if root not in run_metrics['by_directory'] and len(run_metrics['by_directory']) >= metrics_directory_limit:
+            root = '(other)'
+        for histograms, key in ((run_metrics['by_extension'], extension), (run_metrics['by_directory'], root)):
+            histogram = histograms.setdefault(key, {'files': 0, 'bytes': 0, 'seconds': 0.0, 'buckets': {}})
+            histogram['files'] += 1
+            histogram['bytes'] += size
+            histogram['seconds'] += seconds
+            histogram['buckets'][bucket] = histogram['buckets'].get(bucket, 0) + 1
+
+# histogram buckets double: under 1 ms, 1-2 ms, 2-4 ms and so on
+def metrics_bucket(seconds):
+    milliseconds = seconds * 1000
+    if milliseconds < 1:
+        return '<1 ms'
+    low = 1
+    while milliseconds >= low * 2:
+        low *= 2
+    return '%s-%s ms' % (low, low * 2)
+
+# files done of (about, until they've all been found) how many,
+#   files and MB per second, and the time left at that rate
+def metrics_progress(run_metrics, files_done, files_found, enumerated):
+    seconds = max(time.monotonic() - run_metrics['start_time'], 0.001)
+    total_files = files_found if enumerated else max(files_found, run_metrics['expected_files'])
+    files_per_second = files_done / seconds
+    if files_per_second > 0:
+        eta = time.strftime('%H:%M:%S', time.gmtime(max(total_files - files_done, 0) / files_per_second))
+    else:
+        eta = 'unknown'
+    return '%s of %s%s files (%.1f%%), %.1f files/s, %.1f MB/s, ETA %s' % (files_done, '' if enumerated else '~', total_files, 100 * files_done / max(total_files, 1), files_per_second, run_metrics['bytes_hashed'] / seconds / 1024 / 1024, eta)
+
+# the run summary: what the run was started with, totals and rates,
+#   time in each stage and the histograms, as JSON. with profiling, the
+#   profiles of every stage thread are saved to profile_name
+def write_run_summary(run_metrics, summary_name, run_info, profile_name=None):
+    seconds = max(time.monotonic() - run_metrics['start_time'], 0.001)
+    with run_metrics['lock']:
+        run_summary = {
+            'run_info': run_info,
+            'started_at': run_metrics['started_at'],
+            'finished_at': time.strftime("%Y-%m-%d_%Hh%Mm%Ss"),
+            'seconds': seconds,
+            'files_hashed': run_metrics['files_hashed'],
+            'bytes_hashed': run_metrics['bytes_hashed'],
+            'files_per_second': run_metrics['files_hashed'] / seconds,
+            'megabytes_per_second': run_metrics['bytes_hashed'] / seconds / 1024 / 1024,
+            'stages': {stage_name: dict(stage, milliseconds_per_file=1000 * stage['seconds'] / stage['files'] if stage['files'] else 0.0) for stage_name, stage in run_metrics['stages'].items()},
+            'by_extension': run_metrics['by_extension'],
+            'by_directory': run_metrics['by_directory'],
+        }
+    with open(summary_name, 'w', encoding='utf-8') as summary_outfile:
+        json.dump(run_summary, summary_outfile, indent=1)
+    if profile_name is not None and run_metrics['profilers']:
+        pstats.Stats(*run_metrics['profilers']).dump_stats(profile_name)
+    return run_summary
+
+# a started profiler for the current thread if the run is being profiled
+def metrics_profiler(run_metrics):
+    if run_metrics is None or run_metrics['profilers'] is None:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def metrics_profiler_stop(run_metrics, profiler):
+    if profiler is None:
+        return
+    profiler.disable()
+    with run_metrics['lock']:
+        run_metrics['profilers'].append(profiler)
+
+# move detection
+#   a file the catalog doesn't have may be one that's been moved, so if the
+#   catalog has a file of the same size, before it's hashed it's compared
+#   with the catalog's files of that size and fingerprint whose paths no
+#   longer exist. the fingerprint is of the first and last
+#   move_fingerprint_size bytes, which costs two small reads.
+#   if every match has the same checksums and one has the same modified
+#   time, the file moved and those checksums are carried forward without
+#   reading the rest of it. otherwise it's hashed, and it's a move if its
+#   checksums are the same as a match's. every other file that's hashed
+#   gets its fingerprint from the hash pass, for the catalog
+
+# whether the catalog has a file of this size that could have moved here
+def move_size_match(catalog, file_stat):
+    if file_stat is None or file_stat.st_size < move_min_size:
+        return False
+    return catalog.execute('SELECT 1 FROM checksums WHERE size = ? LIMIT 1', (file_stat.st_size,)).fetchone() is not None
+
+# path -> (fingerprint, modified time, last verified, checksum type -> checksum)
+#   for files in the catalog the same size as file_stat with the same
+#   fingerprint, or with none and the same modified time
+def move_candidates(catalog, file_stat, fingerprint):
+    candidates = {}
+    for path, checksum_type, checksum, mtime, last_verified, candidate_fingerprint in catalog.execute('SELECT path, checksum_type, checksum, mtime, last_verified, fingerprint FROM checksums WHERE size = ? AND (fingerprint = ? OR fingerprint IS NULL AND mtime = ?)', (file_stat.st_size, fingerprint, file_stat.st_mtime)):
+        if path not in candidates:
+            candidates[path] = (candidate_fingerprint, mtime, last_verified, {})
+        candidates[path][3][checksum_type] = checksum.hex()
+    return candidates
+
+# fingerprint a file that might have moved and find what it might have
+#   moved from, before it's hashed. a file that can't be read is just hashed,
+#   which retries it or records it as failed
+def pipeline_move_candidates(file_item, pipeline, catalog):
+    if not file_item['move_size_match'] or file_item['fingerprint'] is not None:
+        return
+    try:
+        file_item['fingerprint'] = file_fingerprint(file_item['name_with_path'], file_item['file_stat'].st_size)
+    except OSError:
+        return
+    with pipeline['catalog_lock']:
+        file_item['move_candidates'] = move_candidates(catalog, file_item['file_stat'], file_item['fingerprint'])
+
+# hash of the first and last move_fingerprint_size bytes of a file
+def file_fingerprint(name_with_path, size):
+    fingerprint = hashlib.blake2b(digest_size=16)
+    with open(name_with_path, 'rb', buffering=0) as fingerprint_infile:
+        fingerprint.update(fingerprint_infile.read(move_fingerprint_size))
+        if size > move_fingerprint_size:
+            fingerprint_infile.seek(max(size - move_fingerprint_size, move_fingerprint_size))
+            fingerprint.update(fingerprint_infile.read(move_fingerprint_size))
+    return fingerprint.digest()
+
+# collect the same fingerprint from the hash pass's chunks, for a file
+#   of size bytes, at least move_min_size (None to collect nothing). the engines call
+#   hash_fingerprint_feed() with each chunk and where it starts
+def hash_fingerprint_start(size):
+    hash_fingerprints.size = size
+    if size is not None:
+        tail_start = max(size - move_fingerprint_size, move_fingerprint_size)
+        hash_fingerprints.ranges = ((0, min(move_fingerprint_size, size)), (tail_start, min(tail_start + move_fingerprint_size, size)))
+        hash_fingerprints.parts = [bytearray(), bytearray()]
+
+def hash_fingerprint_feed(offset, chunk):
+    if getattr(hash_fingerprints, 'size', None) is None:
+        return
+    for (range_start, range_end), part in zip(hash_fingerprints.ranges, hash_fingerprints.parts):
+        start = max(range_start, offset)
+        end = min(range_end, offset + len(chunk))
+        if start < end:
+            part += chunk[start - offset:end - offset]
+
+# the fingerprint, or None if the whole of both ends wasn't read
+#   (an engine that doesn't feed it, or a file that changed size)
+def hash_fingerprint_finish():
+    size = getattr(hash_fingerprints, 'size', None)
+    hash_fingerprints.size = None
+    if size is None:
+        return None
+    fingerprint = hashlib.blake2b(digest_size=16)
+    for (range_start, range_end), part in zip(hash_fingerprints.ranges, hash_fingerprints.parts):
+        if len(part) != range_end - range_start:
+            return None
+        fingerprint.update(part)
+    return fingerprint.digest()
 
-    return inventory_acc, leftover_files, checkpoint
+# [(path, modified time, fingerprint, checksum type -> checksum)] of the candidates that could be the
+#   file before it moved: their path is gone and they have every checksum
+#   type. ones with a fingerprint have to match it, ones from before
+#   fingerprints were recorded have to have the same modified time
+def matching_move_candidates(file_stat, fingerprint, move_candidates, checksum_types):
+    move_matches = []
+    for candidate_path, (candidate_fingerprint, candidate_mtime, last_verified, candidate_checksums) in move_candidates.items():
+        if any(checksum_type not in candidate_checksums for checksum_type in checksum_types):
+            continue
+        if candidate_fingerprint is not None and bytes(candidate_fingerprint) != fingerprint:
+            continue
+        if candidate_fingerprint is None and candidate_mtime != file_stat.st_mtime:
+            continue
+        if os.path.lexists(candidate_path):
+            continue
+        move_matches.append((candidate_path, candidate_mtime, candidate_fingerprint, candidate_checksums))
+    return move_matches
+
+# the path a new file moved from going by its checksums: a path in the
+#   catalog with all the same checksums that no longer exists, and that
+#   no other file has claimed. '' if there isn't one. empty files all have
+#   the same checksums, so they could have come from anywhere
+def checksum_moved_from(catalog, checksum_types, checksum_dict, file_stat, moved_paths):
+    if file_stat is None or file_stat.st_size == 0 or checksum_types[0] not in checksum_dict:
+        return ''
+    for previous_path in catalog_lookup_checksum(catalog, checksum_types[0], checksum_dict[checksum_types[0]]):
+        if previous_path in moved_paths or os.path.lexists(previous_path):
+            continue
+        previous_record = catalog_lookup_path(catalog, previous_path)
+        if all(checksum_type in previous_record and previous_record[checksum_type][0] == normalize_checksum(checksum_dict[checksum_type]) for checksum_type in checksum_types):
+            return previous_path
+    return ''
+
+# (path it moved from, checksums) if the matches are sure enough to carry
+#   the checksums forward: they all have the same checksums, and one of them
+#   matched the fingerprint and has the same modified time.
+#   ('', None) if the file has to be hashed
+def carry_forward_move(file_stat, move_matches, checksum_types):
+    if not move_matches or any(candidate_checksums[checksum_type] != move_matches[0][3][checksum_type] for candidate_path, candidate_mtime, candidate_fingerprint, candidate_checksums in move_matches for checksum_type in checksum_types):
+        return '', None
+    for candidate_path, candidate_mtime, candidate_fingerprint, candidate_checksums in move_matches:
+        if candidate_fingerprint is not None and candidate_mtime == file_stat.st_mtime:
+            return candidate_path, {checksum_type: candidate_checksums[checksum_type] for checksum_type in checksum_types}
+    return '', None
 
 # saves information to outfile
-def checkpoint_save(checkpoint, checkpoint_inventory_name, inventory_acc):
-    # creates/appends+ file for temp inventory
-    with open(checkpoint_inventory_name, 'a+', encoding='utf-8') as temp_outfile:
-        # fills in accumulator
-        temp_outfile.writelines(inventory_acc)
-        # [[maybe put not selected files here too, copy to sep variable, reset to set(). this way i can still add everything together to compare difference in files from previous inventory in case of failure]]
-        temp_outfile.writelines(not_selected_inventory_acc)
-    # reset inventory_acc and not_selected_inventory_acc
-    inventory_acc = ''
-    not_selected_inventory_acc = ''
-    # creates/appends+ file for all previous checksums,
+#   then, if save_journal, records it in the journal. the journal is what
+#   a resumed run trusts, so it's only written once everything it describes
+#   is on disk
+def checkpoint_save(checkpoint, inventory_writer, catalog, catalog_batch, save_journal=True):
+    # make everything written to the temp inventory so far durable
+    inventory_writer_flush(inventory_writer)
+    # save checksums to the catalog in one transaction,
     #   allowing to compare against checksums in all dirs
-    with open("\\\\?\\C:\\Users\\wschlin\\Desktop\\previous-checksums.txt", 'a+', encoding='utf-8') as previous_checksums_file:
-        previous_checksums_file.writelines(str(new_checksums))
-    previous_checksums.update(new_checksums)
-    new_checksums = {}
+    catalog_save(catalog, catalog_batch)
+    if save_journal and inventory_writer['journal_name'] is not None:
+        journal = dict(inventory_writer['run_info'])
+        journal.update({
+            'inventory_name': inventory_writer['name'],
+            'inventory_size': os.fstat(inventory_writer['file'].fileno()).st_size,
+            'file_number': inventory_writer['file_number'],
+            'name_with_path': inventory_writer['name_with_path'],
+            'saved_at': time.strftime("%Y-%m-%d_%Hh%Mm%Ss"),
+        })
+        write_journal(inventory_writer['journal_name'], journal)
 
     
-    print('\n%s\nCHECKPOINT REACHED:\nInventory saved after %s files as\n%s\n%s' % (('{:^}'.format('='*80)), checkpoint, checkpoint_inventory_name, ('{:^}'.format('='*80))))
+    print('\n%s\nCHECKPOINT REACHED:\nInventory saved after %s files as\n%s\n%s' % (('{:^}'.format('='*80)), checkpoint, inventory_writer['name'], ('{:^}'.format('='*80))))
 
 # run mediainfo on designated files
-def mediainfo(name, name_with_path, file_error_count, file_error):
-    info_dict = {}
-    mediainfo_dict = {}
-    desired_fields = ['FileExtension', 'InternetMediaType', 'Format/Extensions', 'Compression_Mode', 'SamplingRate']
-    # look at mediainfo technical metadata of image files
-    mediainfo_output_full = (subprocess.check_output(('MediaInfo -f --Language=raw "' + name_with_path +'"'), shell=True))
-    # format output
-    mediainfo_full_format = (str(mediainfo_output_full).replace('  ', '').replace('\\r\\n', '\n').replace("['", "").replace("']", "").split('\n'))
-    # format each line into a field and value
-    #   (unfortunately yes, this is the most efficent way to do this)
-    for output_line in mediainfo_full_format:
-        try:
-            field, value = (output_line.split(': ')).strip()
-        except:
-            field = (output_line.split(': ')[0]).strip()
-            value = (output_line.split(': ')[-1]).strip()
-        info_dict[field] = value
-    # add previously specified desired fields and associated values to dict
-    for desired in desired_fields:
-        try:
-            mediainfo_dict[desired] = (info_dict[desired])
-        except:
-            mediainfo_dict[desired] = ''
-            pass 
-
-    # validate mediainfo data based on expected values
-    # validate file extension
-    if (mediainfo_dict['FileExtension']).lower() not in mediainfo_dict['Format/Extensions']:
-        file_error_count += 1
-        file_error.append('File extension not expected value.')
-        print('---WARNING, IMAGE FILE EXTENSION NOT EXPECTED:\n   %s' % (name_with_path))
-    '''
-    # validate lossless compression [[not currently in use]]
-    if mediainfo_dict['Compression_Mode'] is not ('lossless' or 'Lossless' or ''):
+# file_specs is from compile_file_specs(), the ones in file_specs.json if None
+def mediainfo(name, name_with_path, file_error_count, file_error, file_specs=None):
+    # the formats that can be read natively only need the first few KB,
+    #   MediaInfo is only run for the rest
+    mediainfo_dict = read_media_header(name_with_path)
+    if mediainfo_dict is None:
+        mediainfo_dict = mediainfo_fields(name_with_path)
+    return mediainfo_checks(name_with_path, mediainfo_dict, file_error_count, file_error, file_specs)
+
+# validate mediainfo data against the file specs for its extension
+def mediainfo_checks(name_with_path, mediainfo_dict, file_error_count, file_error, file_specs=None):
+    if file_specs is None:
+        file_specs = load_default_file_specs()
+    for spec_error in file_spec_errors(file_specs, mediainfo_dict):
         file_error_count += 1
-        file_error.append('Compression is not lossless.')
-        print('---WARNING, FILE IS NOT LOSSLESS:\n   %s' % (name_with_path))
-    '''
-    # validate audio sampling rate
-    if mediainfo_dict['SamplingRate'] is not '':
-        if (int(mediainfo_dict['SamplingRate']) <= int('44100')):
-            file_error_count += 1
-            file_error.append('Sampling rate is incorrect.')
-            print('---WARNING, AUDIO SAMPLING RATE INCORRECT:\n   %s' % (name_with_path))
-    
+        file_error.append(spec_error)
+        print('---WARNING, FILE DOES NOT MATCH SPEC, %s\n   %s' % (spec_error, name_with_path))
     return file_error_count, file_error
 
-# run checksums
-def checksums(name, name_with_path, checksum_type, inventory_acc, first_inventory_of_dir, read_inventory, new_file, checksum_consistent, file_error, file_error_count, file_ext, set_first_dir, dict_first_dir, set_first_dir_names, set_matches, previous_checksums):
-    file_found_error = ''
-    checksum = ''
+# file specs
+#   a JSON file of rules for each format, checked against the fields
+#   mediainfo() found. formats list the extensions they apply to, '*' applies
+#   to every file. each rule names a field and one test:
+#     allowed        the value is one of a list (case doesn't matter)
+#     min, max       the value is a number at least/at most this
+#     above, below   the value is a number more/less than this
+#     in_field       the value is one of the words in another field
+#   and the error written to FileCorrupt? if the file fails it. a rule is
+#   skipped if the field wasn't found, unless it's "required", and
+#   ignored altogether if it's "disabled"
+def load_file_specs(specs_name):
+    with open(specs_name, 'r', encoding='utf-8') as specs_infile:
+        return compile_file_specs(json.load(specs_infile))
+
+def load_default_file_specs():
+    global default_file_specs
+    if default_file_specs is None:
+        default_file_specs = load_file_specs(file_specs_name)
+    return default_file_specs
+
+# turn the rules into a table of extension -> (field, test, required, error),
+#   so checking a file is a lookup and a handful of calls
+def compile_file_specs(file_specs):
+    every_file_rules = []
+    rules_by_extension = {}
+    for format_name, format_spec in file_specs['formats'].items():
+        compiled_rules = [compile_file_spec_rule(format_name, rule) for rule in format_spec.get('rules', []) if not rule.get('disabled', False)]
+        extensions = format_spec.get('extensions', ['*'])
+        for extension in extensions:
+            if extension == '*':
+                every_file_rules.extend(compiled_rules)
+            else:
+                rules_by_extension.setdefault(extension.casefold().lstrip('.'), []).extend(compiled_rules)
+    compiled_specs = {extension: tuple(every_file_rules + rules) for extension, rules in rules_by_extension.items()}
+    compiled_specs['*'] = tuple(every_file_rules)
+    return compiled_specs
+
+def compile_file_spec_rule(format_name, rule):
+    field = rule['field']
+    error = rule.get('error', '%s %s does not match spec.' % (format_name, field))
+    if 'allowed' in rule:
+        allowed = frozenset(str(value).casefold() for value in rule['allowed'])
+        test = lambda value, mediainfo_dict: value.casefold() in allowed
+    elif 'in_field' in rule:
+        other_field = rule['in_field']
+        test = lambda value, mediainfo_dict: value.casefold() in mediainfo_dict.get(other_field, '').casefold().split()
+    else:
+        limits = [(float(rule[limit]), limit) for limit in ('min', 'max', 'above', 'below') if limit in rule]
+        if not limits:
+            raise ValueError('%s rule for %s has no test' % (format_name, field))
+        test = lambda value, mediainfo_dict: all(number_within(value, limit_value, limit) for limit_value, limit in limits)
+    return field, test, rule.get('required', False), error
+
+def number_within(value, limit_value, limit):
     try:
-        run_checksum = subprocess.check_output(('certUtil -hashfile "' + name_with_path + '" ' + checksum_type), shell=True)
-    # if error, save and wait for human input (rudimentary "pause", basically)
-    except:
-        checkpoint_save(checkpoint, checkpoint_inventory_name, inventory_acc)
-        file_found_error = input("You have lost network connectivity. Press enter to continue processing")
-        pass
+        number = float(value.split()[0])
+    except (ValueError, IndexError):
+        return False
+    if limit == 'min':
+        return number >= limit_value
+    if limit == 'max':
+        return number <= limit_value
+    if limit == 'above':
+        return number > limit_value
+    return number < limit_value
+
+# the errors for every rule a file fails, going by its extension
+def file_spec_errors(file_specs, mediainfo_dict):
+    spec_errors = []
+    extension = mediainfo_dict.get('FileExtension', '').casefold()
+    for field, test, required, error in file_specs.get(extension, file_specs['*']):
+        value = str(mediainfo_dict.get(field, ''))
+        if value == '':
+            if required:
+                spec_errors.append(error)
+            continue
+        if not test(value, mediainfo_dict):
+            spec_errors.append(error)
+    return spec_errors
+
+# the fields used from MediaInfo for one file
+def mediainfo_fields(name_with_path):
+    fields_by_path = mediainfo_batch([name_with_path])
+    if name_with_path not in fields_by_path:
+        raise ValueError('no MediaInfo output for %s' % (name_with_path))
+    return fields_by_path[name_with_path]
+
+# path -> fields used from MediaInfo, running it for up to
+#   mediainfo_batch_size files at a time with JSON output.
+#   paths MediaInfo gives nothing for are left out
+def mediainfo_batch(paths):
+    fields_by_path = {}
+    for batch in mediainfo_command_batches(paths):
+        mediainfo_output = subprocess.check_output(['MediaInfo', '--Output=JSON', '-f'] + batch)
+        media_list = mediainfo_json_media(json.loads(mediainfo_output.decode('utf-8', 'replace')))
+        # files are reported in the order they're given,
+        #   going by that if the paths reported don't match
+        media_refs = [media.get('@ref', '') for media in media_list]
+        if not set(batch) <= set(media_refs) and len(media_list) == len(batch):
+            media_refs = batch
+        for media_ref, media in zip(media_refs, media_list):
+            if media_ref in batch:
+                fields_by_path[media_ref] = mediainfo_json_fields(media)
+                # the extension is the file's, not the content's
+                name = os.path.basename(media_ref)
+                fields_by_path[media_ref]['FileExtension'] = name.rpartition('.')[2] if '.' in name else ''
+    return fields_by_path
+
+def mediainfo_command_batches(paths):
+    batch = []
+    batch_chars = 0
+    for name_with_path in paths:
+        if batch and (len(batch) == mediainfo_batch_size or batch_chars + len(name_with_path) > mediainfo_batch_chars):
+            yield batch
+            batch = []
+            batch_chars = 0
+        batch.append(name_with_path)
+        # plus quotes and a space
+        batch_chars += len(name_with_path) + 3
+    if batch:
+        yield batch
+
+# the media reports in MediaInfo's JSON. one file gives a single report,
+#   several give a list of them
+def mediainfo_json_media(mediainfo_json):
+    if isinstance(mediainfo_json, dict):
+        mediainfo_json = [mediainfo_json]
+    media_list = []
+    for mediainfo_report in mediainfo_json:
+        media = mediainfo_report.get('media')
+        if isinstance(media, list):
+            media_list.extend(media)
+        elif media:
+            media_list.append(media)
+    return media_list
+
+# desired fields from every track of a media report, '' for any it doesn't
+#   give. like the text output, a field in a later track wins.
+#   JSON names have '_' where the text output has '/'
+def mediainfo_json_fields(media):
+    mediainfo_dict = {desired: '' for desired in mediainfo_desired_fields}
+    for track in media.get('track', []):
+        for desired in mediainfo_desired_fields:
+            value = track.get(desired.replace('/', '_'))
+            if value is not None:
+                mediainfo_dict[desired] = str(value)
+    # named like the fields read natively
+    mediainfo_dict['Codec'] = mediainfo_dict.pop('CodecID')
+    return mediainfo_dict
+
+def mediainfo_version():
+    global mediainfo_version_string
+    if mediainfo_version_string is None:
+        version_output = subprocess.check_output(['MediaInfo', '--Version']).decode('utf-8', 'replace')
+        mediainfo_version_string = version_output.strip().splitlines()[-1].strip()
+    return mediainfo_version_string
+
+# path -> MediaInfo fields for each (path, checksum) in name_checksums.
+#   MediaInfo only looks at content, so its results are cached in the
+#   catalog by checksum and MediaInfo version: files it has seen before,
+#   and duplicates, only cost a lookup. each checksum that isn't cached
+#   is run once, however many paths have it
+def mediainfo_cached_fields(name_checksums, checksum_type, catalog, catalog_lock):
+    version = mediainfo_version()
+    fields_by_path = {}
+    to_run = {}
+    with catalog_lock:
+        for name_with_path, checksum in name_checksums:
+            cached_fields = mediainfo_cache_lookup(catalog, checksum_type, checksum, version)
+            if cached_fields is not None:
+                fields_by_path[name_with_path] = cached_fields
+            else:
+                # without a checksum a file can only be run on its own
+                to_run.setdefault(checksum or name_with_path, []).append(name_with_path)
+    run_fields = mediainfo_batch([paths[0] for paths in to_run.values()])
+    cache_rows = []
+    for checksum, paths in to_run.items():
+        if paths[0] not in run_fields:
+            continue
+        for name_with_path in paths:
+            fields_by_path[name_with_path] = dict(run_fields[paths[0]])
+        if checksum != paths[0]:
+            cache_rows.append((checksum, run_fields[paths[0]]))
+    with catalog_lock:
+        mediainfo_cache_save(catalog, checksum_type, version, cache_rows)
+    # the extension is the file's, not the content's
+    for name_with_path, mediainfo_dict in fields_by_path.items():
+        name = os.path.basename(name_with_path)
+        mediainfo_dict['FileExtension'] = name.rpartition('.')[2] if '.' in name else ''
+    return fields_by_path
+
+# native media headers
+#   the same fields MediaInfo would give (Format, Width, Height, BitDepth,
+#   SamplingRate, ColorSpace, Compression_Mode, plus Compression and Codec
+#   where the format has them) read straight from the headers of JPEG, JPEG 2000, TIFF, WAV
+#   and QuickTime/MPEG-4 files. None if the file isn't one of those,
+#   or doesn't read as the format it looks like, so MediaInfo can decide
+def read_media_header(name_with_path):
+    with open(name_with_path, 'rb') as media_file:
+        header = media_file.read(media_header_size)
+        media_format = media_header_format(header)
+        if media_format is None:
+            return None
+        mediainfo_dict = {'Format': media_format, 'Format/Extensions': media_format_extensions[media_format], 'Width': '', 'Height': '', 'BitDepth': '', 'SamplingRate': '', 'ColorSpace': '', 'Compression_Mode': '', 'Compression': '', 'Codec': ''}
+        try:
+            media_header_readers[media_format](media_file, header, mediainfo_dict)
+        except (struct.error, ValueError):
+            return None
+    name = os.path.basename(name_with_path)
+    mediainfo_dict['FileExtension'] = name.rpartition('.')[2] if '.' in name else ''
+    return mediainfo_dict
+
+# the format, going by the signature at the start of the file
+def media_header_format(header):
+    if header[:3] == b'\xff\xd8\xff':
+        return 'JPEG'
+    if header[:12] == b'\x00\x00\x00\x0cjP  \r\n\x87\n' or header[:4] == b'\xff\x4f\xff\x51':
+        return 'JPEG 2000'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'TIFF'
+    if header[:4] in (b'RIFF', b'RF64') and header[8:12] == b'WAVE':
+        return 'Wave'
+    if header[4:8] == b'ftyp':
+        return 'QuickTime' if header[8:12] == b'qt  ' else 'MPEG-4'
+    # older QuickTime files start straight away with other atoms
+    if header[4:8] in (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'):
+        return 'QuickTime'
+    return None
+
+# size bytes at offset, from the header if it's there, otherwise seeked to
+def read_at(media_file, header, offset, size):
+    if offset + size <= len(header):
+        data = header[offset:offset + size]
+    else:
+        media_file.seek(offset)
+        data = media_file.read(size)
+    if len(data) < size:
+        raise ValueError('%s bytes at %s are past the end of the file' % (size, offset))
+    return data
+
+def media_file_size(media_file):
+    return os.fstat(media_file.fileno()).st_size
+
+# (type, data start, data end) of each box between start and end.
+#   JPEG 2000 boxes and QuickTime atoms are laid out the same way
+def media_boxes(media_file, header, start, end):
+    offset = start
+    while offset + 8 <= end:
+        box_size, box_type = struct.unpack('>I4s', read_at(media_file, header, offset, 8))
+        data_start = offset + 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', read_at(media_file, header, offset + 8, 8))[0]
+            data_start += 8
+        elif box_size == 0:
+            # runs to the end
+            box_size = end - offset
+        if box_size < data_start - offset:
+            raise ValueError('box size %s at %s' % (box_size, offset))
+        yield box_type, data_start, min(offset + box_size, end)
+        offset += box_size
+
+# (data start, data end) of the first box along box_path, None if there isn't one
+def media_box(media_file, header, start, end, box_path):
+    for box_type, data_start, data_end in media_boxes(media_file, header, start, end):
+        if box_type == box_path[0]:
+            if len(box_path) == 1:
+                return data_start, data_end
+            return media_box(media_file, header, data_start, data_end, box_path[1:])
+    return None
+
+# JPEG: the frame header (SOF) after the SOI marker
+def read_jpeg_header(media_file, header, mediainfo_dict):
+    offset = 2
+    while True:
+        marker_bytes = read_at(media_file, header, offset, 4)
+        if marker_bytes[0] != 0xFF:
+            raise ValueError('no JPEG marker at %s' % (offset))
+        marker = marker_bytes[1]
+        # fill bytes before a marker
+        if marker == 0xFF:
+            offset += 1
+            continue
+        # markers without a segment
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        # EOI or start of scan, there's no frame header
+        if marker in (0xD9, 0xDA):
+            return
+        # SOF0-SOF15, apart from DHT, JPG and DAC which share the range
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            precision, height, width, components = struct.unpack('>BHHB', read_at(media_file, header, offset + 4, 6))
+            mediainfo_dict.update({'Width': str(width), 'Height': str(height), 'BitDepth': str(precision), 'ColorSpace': jpeg_colour_spaces.get(components, ''),
+                # SOF3, 7, 11 and 15 are lossless
+                'Compression_Mode': 'Lossless' if marker in (0xC3, 0xC7, 0xCB, 0xCF) else 'Lossy'})
+            return
+        offset += 2 + struct.unpack('>H', marker_bytes[2:4])[0]
+
+# JPEG 2000: the image header (ihdr) and colour (colr) in the JP2 header
+#   box, or the SIZ marker of a bare codestream. the wavelet transform in
+#   the codestream's COD marker says whether it's lossless
+def read_jp2_header(media_file, header, mediainfo_dict):
+    if header[:4] == b'\xff\x4f\xff\x51':
+        width, height, x_offset, y_offset = struct.unpack('>IIII', read_at(media_file, header, 8, 16))
+        bit_depth = read_at(media_file, header, 42, 1)[0]
+        mediainfo_dict.update({'Width': str(width - x_offset), 'Height': str(height - y_offset), 'BitDepth': str((bit_depth & 0x7F) + 1)})
+        read_jp2_coding_style(media_file, header, 0, mediainfo_dict)
+        return
+    file_size = media_file_size(media_file)
+    image_header = media_box(media_file, header, 0, file_size, (b'jp2h', b'ihdr'))
+    if image_header is None:
+        raise ValueError('no JP2 image header')
+    height, width, components, bit_depth = struct.unpack('>IIHB', read_at(media_file, header, image_header[0], 11))
+    mediainfo_dict.update({'Width': str(width), 'Height': str(height), 'BitDepth': str((bit_depth & 0x7F) + 1)})
+    colour = media_box(media_file, header, 0, file_size, (b'jp2h', b'colr'))
+    if colour is not None:
+        method, precedence, approximation = struct.unpack('>BBB', read_at(media_file, header, colour[0], 3))
+        # enumerated colour spaces only, ICC profiles aren't read
+        if method == 1:
+            mediainfo_dict['ColorSpace'] = jp2_colour_spaces.get(struct.unpack('>I', read_at(media_file, header, colour[0] + 3, 4))[0], '')
+    codestream = media_box(media_file, header, 0, file_size, (b'jp2c',))
+    if codestream is not None:
+        read_jp2_coding_style(media_file, header, codestream[0], mediainfo_dict)
+
+# the marker segments after SOC, up to the COD marker
+def read_jp2_coding_style(media_file, header, codestream_start, mediainfo_dict):
+    offset = codestream_start + 2
+    while True:
+        marker, segment_length = struct.unpack('>HH', read_at(media_file, header, offset, 4))
+        # start of the first tile (or of the data), the main header is over
+        if marker in (0xFF90, 0xFF93):
+            return
+        if marker == 0xFF52:
+            # 0 is the 9-7 irreversible transform, 1 the 5-3 reversible one
+            transform = read_at(media_file, header, offset + 13, 1)[0]
+            mediainfo_dict['Compression_Mode'] = 'Lossless' if transform == 1 else 'Lossy'
+            return
+        offset += 2 + segment_length
+
+# TIFF: width, height and bits per sample from the first IFD
+def read_tiff_header(media_file, header, mediainfo_dict):
+    byte_order = '<' if header[:2] == b'II' else '>'
+    ifd_offset = struct.unpack(byte_order + 'I', header[4:8])[0]
+    entry_count = struct.unpack(byte_order + 'H', read_at(media_file, header, ifd_offset, 2))[0]
+    entries = read_at(media_file, header, ifd_offset + 2, entry_count * 12)
+    for entry_offset in range(0, entry_count * 12, 12):
+        tag, field_type, value_count = struct.unpack(byte_order + 'HHI', entries[entry_offset:entry_offset + 8])
+        if tag not in tiff_tags:
+            continue
+        value_bytes = entries[entry_offset + 8:entry_offset + 12]
+        # SHORT or LONG, only the first value is used. values that don't
+        #   fit in the entry are stored at the offset it holds instead
+        if field_type == 3:
+            if value_count > 2:
+                value_bytes = read_at(media_file, header, struct.unpack(byte_order + 'I', value_bytes)[0], 2)
+            value = struct.unpack(byte_order + 'H', value_bytes[:2])[0]
+        elif field_type == 4:
+            if value_count > 1:
+                value_bytes = read_at(media_file, header, struct.unpack(byte_order + 'I', value_bytes)[0], 4)
+            value = struct.unpack(byte_order + 'I', value_bytes)[0]
+        else:
+            continue
+        mediainfo_dict[tiff_tags[tag]] = str(value)
+    # codes to names
+    if mediainfo_dict['Compression'] != '':
+        compression = tiff_compressions.get(int(mediainfo_dict['Compression']), '')
+        mediainfo_dict['Compression'] = compression
+        if compression != '':
+            mediainfo_dict['Compression_Mode'] = 'Lossy' if compression in tiff_lossy_compressions else 'Lossless'
+    if mediainfo_dict['ColorSpace'] != '':
+        mediainfo_dict['ColorSpace'] = tiff_colour_spaces.get(int(mediainfo_dict['ColorSpace']), '')
+
+# WAV: sampling rate, bits per sample and codec from the fmt chunk
+def read_wav_header(media_file, header, mediainfo_dict):
+    file_size = media_file_size(media_file)
+    offset = 12
+    while offset + 8 <= file_size:
+        chunk_id, chunk_size = struct.unpack('<4sI', read_at(media_file, header, offset, 8))
+        if chunk_id == b'fmt ':
+            audio_format, channels, sampling_rate, byte_rate, block_align, bit_depth = struct.unpack('<HHIIHH', read_at(media_file, header, offset + 8, 16))
+            # WAVE_FORMAT_EXTENSIBLE, the real format code starts the sub format
+            if audio_format == 0xFFFE:
+                audio_format = struct.unpack('<H', read_at(media_file, header, offset + 8 + 24, 2))[0]
+            codec = wav_codecs.get(audio_format, '0x%04X' % (audio_format))
+            mediainfo_dict.update({'SamplingRate': str(sampling_rate), 'BitDepth': str(bit_depth), 'Codec': codec})
+            if codec in ('PCM', 'Float'):
+                mediainfo_dict['Compression_Mode'] = 'Lossless'
+            return
+        # chunks are padded to an even size
+        offset += 8 + chunk_size + (chunk_size & 1)
+    raise ValueError('no fmt chunk')
+
+# QuickTime/MPEG-4: the tracks in the moov atom, which can be at the end
+def read_quicktime_header(media_file, header, mediainfo_dict):
+    movie = media_box(media_file, header, 0, media_file_size(media_file), (b'moov',))
+    if movie is None:
+        raise ValueError('no moov atom')
+    for atom_type, data_start, data_end in media_boxes(media_file, header, movie[0], movie[1]):
+        if atom_type == b'trak':
+            read_quicktime_track(media_file, header, data_start, data_end, mediainfo_dict)
+
+# the first video track gives width, height, bit depth and codec,
+#   and like MediaInfo, the last audio track gives the sampling rate
+def read_quicktime_track(media_file, header, trak_start, trak_end, mediainfo_dict):
+    handler = media_box(media_file, header, trak_start, trak_end, (b'mdia', b'hdlr'))
+    if handler is None:
+        return
+    handler_type = read_at(media_file, header, handler[0] + 8, 4)
+    sample_description = media_box(media_file, header, trak_start, trak_end, (b'mdia', b'minf', b'stbl', b'stsd'))
+    if handler_type == b'vide' and mediainfo_dict['Width'] == '':
+        track_header = media_box(media_file, header, trak_start, trak_end, (b'tkhd',))
+        if track_header is not None:
+            # 16.16 fixed point, the last 8 bytes of the track header
+            width, height = struct.unpack('>II', read_at(media_file, header, track_header[1] - 8, 8))
+            mediainfo_dict.update({'Width': str(width >> 16), 'Height': str(height >> 16)})
+        if sample_description is not None:
+            mediainfo_dict['BitDepth'] = str(struct.unpack('>H', read_at(media_file, header, sample_description[0] + 90, 2))[0])
+            # the first sample description's format, ex 'avc1' or 'apch'
+            mediainfo_dict['Codec'] = read_at(media_file, header, sample_description[0] + 12, 4).decode('latin-1').strip()
+    elif handler_type == b'soun':
+        sampling_rate = 0
+        if sample_description is not None:
+            # 16.16 fixed point
+            sampling_rate = struct.unpack('>I', read_at(media_file, header, sample_description[0] + 40, 4))[0] >> 16
+        if sampling_rate == 0:
+            # too high for 16.16, the media time scale is the sampling rate
+            media_header = media_box(media_file, header, trak_start, trak_end, (b'mdia', b'mdhd'))
+            if media_header is not None:
+                version = read_at(media_file, header, media_header[0], 1)[0]
+                sampling_rate = struct.unpack('>I', read_at(media_file, header, media_header[0] + (20 if version == 1 else 12), 4))[0]
+        mediainfo_dict['SamplingRate'] = str(sampling_rate)
+
+media_header_readers = {
+    'JPEG': read_jpeg_header,
+    'JPEG 2000': read_jp2_header,
+    'TIFF': read_tiff_header,
+    'Wave': read_wav_header,
+    'QuickTime': read_quicktime_header,
+    'MPEG-4': read_quicktime_header,
+}
+
+# deep verification
+#   the header checks stop after the first few KB, so a file that was cut
+#   short or damaged further in still passes them. deep verification reads
+#   the rest of the structure: every frame in a PCM WAV's data chunk, a JPEG's
+#   entropy-coded data through to the EOI marker, and the extent of every TIFF
+#   strip or tile against the length of the file. it reads
+#   deep_verify_block_size at a time, so a file of any size takes the same
+#   memory, and runs in its own process pool (deep_verify_workers in
+#   recursive_by_file()). only new files and files whose checksum changed are
+#   verified, the rest haven't changed since they were
+deep_verify_extensions = ('jpg', 'jpeg', 'tif', 'tiff', 'wav')
+deep_verify_block_size = 1024 * 1024
+# in entropy-coded JPEG data an 0xFF is followed by a stuffed 0x00, a restart
+#   marker or more 0xFF fill. anything else is a marker, and ends the scan
+jpeg_scan_marker = re.compile(rb'\xff[^\x00\xd0-\xd7\xff]')
+# TIFF StripOffsets and StripByteCounts, TileOffsets and TileByteCounts
+tiff_extent_tags = ((273, 279), (324, 325))
+tiff_ifd_limit = 1024
+
+# the errors found (empty if there were none), for FileCorrupt?
+def deep_verify(name_with_path):
+    try:
+        with open(name_with_path, 'rb') as media_file:
+            header = media_file.read(media_header_size)
+            media_format = media_header_format(header)
+            if media_format not in deep_verifiers:
+                return []
+            return deep_verifiers[media_format](media_file, header)
+    except (struct.error, ValueError) as error:
+        return ['Deep verification failed, %s.' % (error)]
+    except OSError:
+        return ['File could not be read for deep verification.']
+
+# WAV: the data chunk has to fit in the file and hold whole frames, which
+#   are all read. silence all the way through is flagged too, like a
+#   decoder's loudness of -inf would be
+def deep_verify_wav(media_file, header):
+    file_size = media_file_size(media_file)
+    block_align = None
+    audio_format = None
+    data_size = None
+    offset = 12
+    while offset + 8 <= file_size:
+        chunk_id, chunk_size = struct.unpack('<4sI', read_at(media_file, header, offset, 8))
+        # RF64 keeps the sizes that don't fit in 32 bits in the ds64 chunk
+        if chunk_id == b'ds64':
+            data_size = struct.unpack('<Q', read_at(media_file, header, offset + 16, 8))[0]
+        elif chunk_id == b'fmt ':
+            audio_format, channels, sampling_rate, byte_rate, block_align = struct.unpack('<HHIIH', read_at(media_file, header, offset + 8, 14))
+            if audio_format == 0xFFFE:
+                audio_format = struct.unpack('<H', read_at(media_file, header, offset + 8 + 24, 2))[0]
+        elif chunk_id == b'data':
+            if chunk_size != 0xFFFFFFFF or data_size is None:
+                data_size = chunk_size
+            break
+        offset += 8 + chunk_size + (chunk_size & 1)
+    else:
+        return ['WAV has no data chunk.']
+    if block_align is None:
+        return ['WAV has no fmt chunk before its data.']
+    errors = []
+    data_start = offset + 8
+    if data_start + data_size > file_size:
+        errors.append('WAV data chunk is %s bytes short.' % (data_start + data_size - file_size))
+        data_size = file_size - data_start
+    # only PCM and float have frames of block_align bytes
+    if wav_codecs.get(audio_format) in ('PCM', 'Float') and block_align > 0 and data_size % block_align != 0:
+        errors.append('WAV data ends part way through a frame.')
+    block = bytearray(deep_verify_block_size - deep_verify_block_size % max(block_align, 1))
+    silent = True
+    media_file.seek(data_start)
+    bytes_left = data_size
+    while bytes_left > 0:
+        read_size = media_file.readinto(memoryview(block)[:min(len(block), bytes_left)])
+        if not read_size:
+            errors.append('WAV data could not be read to the end.')
+            break
+        if silent and block.count(0, 0, read_size) != read_size:
+            silent = False
+        bytes_left -= read_size
+    if silent and data_size > 0 and wav_codecs.get(audio_format) in ('PCM', 'Float'):
+        errors.append('WAV data is silent.')
+    return errors
+
+# JPEG: the marker segments are walked from SOI and the entropy-coded data
+#   after each SOS scanned for the marker that ends it, until EOI.
+#   progressive JPEGs have several scans, with tables between them
+def deep_verify_jpeg(media_file, header):
+    file_size = media_file_size(media_file)
+    block = bytearray(deep_verify_block_size)
+    frame_found = False
+    offset = 2
+    while True:
+        if offset + 2 > file_size:
+            return ['JPEG ends before its EOI marker.']
+        marker_bytes = read_at(media_file, header, offset, 2)
+        if marker_bytes[0] != 0xFF:
+            return ['JPEG marker segments are damaged at byte %s.' % (offset)]
+        marker = marker_bytes[1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0xD9:
+            return [] if frame_found else ['JPEG has no frame header.']
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        if offset + 4 > file_size:
+            return ['JPEG ends before its EOI marker.']
+        segment_length = struct.unpack('>H', read_at(media_file, header, offset + 2, 2))[0]
+        if segment_length < 2 or offset + 2 + segment_length > file_size:
+            return ['JPEG marker segment at byte %s runs past the end of the file.' % (offset)]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            frame_found = True
+        offset += 2 + segment_length
+        if marker == 0xDA:
+            if not frame_found:
+                return ['JPEG scan comes before its frame header.']
+            offset = jpeg_scan_end(media_file, offset, block)
+            if offset is None:
+                return ['JPEG ends before its EOI marker.']
+
+# the offset of the marker that ends the entropy-coded data from
+#   scan_start, None if the file ends first
+def jpeg_scan_end(media_file, scan_start, block):
+    offset = scan_start
+    while True:
+        media_file.seek(offset)
+        read_size = media_file.readinto(block)
+        if read_size < 2:
+            return None
+        found = jpeg_scan_marker.search(block, 0, read_size)
+        if found is not None:
+            return offset + found.start()
+        # an 0xFF at the end of the block is looked at with the next one
+        offset += read_size - 1 if block[read_size - 1] == 0xFF else read_size
+
+# TIFF: every IFD's strips or tiles have to be inside the file. the
+#   offsets and byte counts are read a block at a time, there can be
+#   hundreds of thousands of them
+def deep_verify_tiff(media_file, header):
+    file_size = media_file_size(media_file)
+    byte_order = '<' if header[:2] == b'II' else '>'
+    ifd_offset = struct.unpack(byte_order + 'I', header[4:8])[0]
+    errors = []
+    seen_offsets = set()
+    ifd_number = 0
+    while ifd_offset != 0:
+        if ifd_offset in seen_offsets or len(seen_offsets) >= tiff_ifd_limit:
+            errors.append('TIFF IFDs loop back on themselves.')
+            break
+        seen_offsets.add(ifd_offset)
+        if ifd_offset + 2 > file_size:
+            errors.append('TIFF IFD %s is past the end of the file.' % (ifd_number))
+            break
+        entry_count = struct.unpack(byte_order + 'H', read_at(media_file, header, ifd_offset, 2))[0]
+        if ifd_offset + 2 + entry_count * 12 + 4 > file_size:
+            errors.append('TIFF IFD %s runs past the end of the file.' % (ifd_number))
+            break
+        entries = read_at(media_file, header, ifd_offset + 2, entry_count * 12)
+        fields = {}
+        for entry_offset in range(0, entry_count * 12, 12):
+            tag, field_type, value_count = struct.unpack(byte_order + 'HHI', entries[entry_offset:entry_offset + 8])
+            fields[tag] = (field_type, value_count, entries[entry_offset + 8:entry_offset + 12])
+        extent_tags = [tags for tags in tiff_extent_tags if tags[0] in fields and tags[1] in fields]
+        if not extent_tags:
+            errors.append('TIFF IFD %s has no strips or tiles.' % (ifd_number))
+        for offsets_tag, counts_tag in extent_tags:
+            if fields[offsets_tag][1] != fields[counts_tag][1]:
+                errors.append('TIFF IFD %s has %s strip or tile offsets but %s byte counts.' % (ifd_number, fields[offsets_tag][1], fields[counts_tag][1]))
+                continue
+            for extent_number, (extent_offset, extent_size) in enumerate(zip(tiff_values(media_file, header, byte_order, fields[offsets_tag]), tiff_values(media_file, header, byte_order, fields[counts_tag]))):
+                if extent_offset + extent_size > file_size:
+                    errors.append('TIFF IFD %s strip or tile %s runs past the end of the file.' % (ifd_number, extent_number))
+                    break
+        ifd_offset = struct.unpack(byte_order + 'I', read_at(media_file, header, ifd_offset + 2 + entry_count * 12, 4))[0]
+        ifd_number += 1
+    return errors
+
+# the SHORT or LONG values of an IFD entry, read a block at a time
+def tiff_values(media_file, header, byte_order, field):
+    field_type, value_count, value_bytes = field
+    if field_type not in (3, 4):
+        raise ValueError('TIFF offsets of type %s' % (field_type))
+    value_size = 2 if field_type == 3 else 4
+    value_format = byte_order + ('H' if field_type == 3 else 'I')
+    # values that fit in the entry are stored there
+    if value_count * value_size <= 4:
+        for value_number in range(value_count):
+            yield struct.unpack_from(value_format, value_bytes, value_number * value_size)[0]
+        return
+    values_offset = struct.unpack(byte_order + 'I', value_bytes)[0]
+    values_per_block = deep_verify_block_size // value_size
+    for first_value in range(0, value_count, values_per_block):
+        block_count = min(values_per_block, value_count - first_value)
+        values = read_at(media_file, header, values_offset + first_value * value_size, block_count * value_size)
+        yield from struct.unpack(byte_order + (value_format[1] * block_count), values)
+
+deep_verifiers = {
+    'JPEG': deep_verify_jpeg,
+    'TIFF': deep_verify_tiff,
+    'Wave': deep_verify_wav,
+}
+
+# reusable read buffer for the current thread. anonymous maps are page
+#   aligned, which lets unbuffered reads go straight into them
+def hash_buffer(buffer_size=hash_chunk_size):
+    buffer = getattr(hash_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != buffer_size:
+        if buffer is not None:
+            buffer.close()
+        buffer = mmap.mmap(-1, buffer_size)
+        hash_buffers.buffer = buffer
+    return buffer
+
+# hash I/O settings for volumes, root -> (mode, buffer size).
+#   also the process pool's initializer, so its workers read files the same way
+def set_hash_io(volume_settings):
+    hash_io_volumes.clear()
+    for root, (io_mode, buffer_size) in volume_settings.items():
+        if io_mode not in hash_io_modes:
+            raise ValueError('unknown hash I/O mode %s' % (io_mode))
+        hash_io_volumes[hash_io_key(root)] = (io_mode, buffer_size)
+
+# paths are matched without the long path prefix and, on windows, case
+def hash_io_key(name_with_path):
+    if name_with_path.startswith('\\\\?\\'):
+        name_with_path = name_with_path[4:]
+    return os.path.normcase(name_with_path)
+
+# (mode, buffer size) for the volume a file is on
+def hash_io_for(name_with_path):
+    if not hash_io_volumes:
+        return hash_io_default
+    path_key = hash_io_key(name_with_path)
+    matching_roots = [root for root in hash_io_volumes if path_key.startswith(root)]
+    if not matching_roots:
+        return hash_io_default
+    return hash_io_volumes[max(matching_roots, key=len)]
+
+# the file, mapped, or None if it can't be (empty files can't)
+def hash_map(hash_infile):
+    try:
+        return mmap.mmap(hash_infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+# hint that the file will be read from start to end.
+#   windows has no equivalent for files opened with open(), so it's skipped
+def hash_read_ahead(hash_infile):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(hash_infile.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+# calculate checksum in-process, reading the file in large fixed-size chunks
+#   or, in mmap mode, hashing the whole mapping in one go
+def hashlib_checksum(name_with_path, checksum_type):
+    hasher = hash_algorithms[checksum_type]()
+    io_mode, buffer_size = hash_io_for(name_with_path)
+    open_start = time.perf_counter()
+    # unbuffered, readinto fills our buffer directly
+    with open(name_with_path, 'rb', buffering=0) as hash_infile:
+        hash_timings.open_seconds = time.perf_counter() - open_start
+        hash_mapping = hash_map(hash_infile) if io_mode == 'mmap' else None
+        if hash_mapping is not None:
+            with hash_mapping:
+                hasher.update(hash_mapping)
+                hash_fingerprint_feed(0, hash_mapping)
+            return hasher.hexdigest()
+        if io_mode == 'fadvise':
+            hash_read_ahead(hash_infile)
+        buffer = hash_buffer(buffer_size)
+        buffer_view = memoryview(buffer)
+        offset = 0
+        try:
+            while True:
+                read_size = hash_infile.readinto(buffer)
+                if not read_size:
+                    break
+                hasher.update(buffer_view[:read_size])
+                hash_fingerprint_feed(offset, buffer_view[:read_size])
+                offset += read_size
+        finally:
+            buffer_view.release()
+    return hasher.hexdigest()
+
+# calculate checksum using certUtil (windows only, one process per file)
+def certutil_checksum(name_with_path, checksum_type):
+    run_checksum = subprocess.check_output(('certUtil -hashfile "' + name_with_path + '" ' + checksum_type), shell=True)
     # split the returned checksum string by line
-    checksum_split = str(run_checksum).split('\\r\\n')
-    # take only the second line (which is the checksum)
-    checksum = checksum_split[1]
+    #   and take only the second line (which is the checksum)
+    checksum = run_checksum.decode().split('\r\n')[1]
+    return normalize_checksum(checksum)
+
+# older versions of certUtil separate every byte with a space
+#   and some print uppercase, hashlib gives lowercase hex with no spaces
+def normalize_checksum(checksum):
+    return checksum.replace(' ', '').strip().lower()
+
+# engines that can calculate checksums, selected by checksum_engine
+checksum_engines = {
+    'hashlib': hashlib_checksum,
+    'certutil': certutil_checksum,
+}
+checksum_engine = 'hashlib'
+
+def calculate_checksum(name_with_path, checksum_type, engine=None):
+    return checksum_engines[engine or checksum_engine](name_with_path, checksum_type)
+
+# hashing thread for multi-digest mode, updates one hasher per chunk
+#   until it's handed None. hashlib releases the GIL for large updates,
+#   so the hashers run alongside each other and alongside the reads
+def hasher_worker(hasher, chunk_queue):
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is None:
+            break
+        hasher.update(chunk)
+
+# calculate several checksums in-process from one read of the file
+#   the calling thread is the feeder, fanning each chunk out to the hashers
+def hashlib_checksums(name_with_path, checksum_types):
+    if len(checksum_types) == 1:
+        return {checksum_types[0]: hashlib_checksum(name_with_path, checksum_types[0])}
+    hashers = {checksum_type: hash_algorithms[checksum_type]() for checksum_type in checksum_types}
+    io_mode, buffer_size = hash_io_for(name_with_path)
+    open_start = time.perf_counter()
+    with open(name_with_path, 'rb', buffering=0) as hash_infile:
+        hash_timings.open_seconds = time.perf_counter() - open_start
+        hash_mapping = hash_map(hash_infile) if io_mode == 'mmap' else None
+        if hash_mapping is not None:
+            # every hasher gets the whole mapping, there's nothing to share out
+            with hash_mapping:
+                hasher_threads = [threading.Thread(target=hasher.update, args=(hash_mapping,), daemon=True) for hasher in hashers.values()]
+                for hasher_thread in hasher_threads:
+                    hasher_thread.start()
+                for hasher_thread in hasher_threads:
+                    hasher_thread.join()
+                hash_fingerprint_feed(0, hash_mapping)
+            return {checksum_type: hasher.hexdigest() for checksum_type, hasher in hashers.items()}
+        if io_mode == 'fadvise':
+            hash_read_ahead(hash_infile)
+        chunk = hash_infile.read(buffer_size)
+        offset = 0
+        # a file that fits in one chunk isn't worth starting threads for
+        if len(chunk) < buffer_size:
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            hash_fingerprint_feed(offset, chunk)
+        else:
+            # chunks are immutable bytes, so every hasher can share them.
+            #   the queues are bounded so a slow hasher holds back the reads
+            #   instead of the file piling up in memory
+            chunk_queues = []
+            hasher_threads = []
+            for hasher in hashers.values():
+                chunk_queue = queue.Queue(maxsize=4)
+                hasher_thread = threading.Thread(target=hasher_worker, args=(hasher, chunk_queue), daemon=True)
+                hasher_thread.start()
+                chunk_queues.append(chunk_queue)
+                hasher_threads.append(hasher_thread)
+            try:
+                while chunk:
+                    for chunk_queue in chunk_queues:
+                        chunk_queue.put(chunk)
+                    hash_fingerprint_feed(offset, chunk)
+                    offset += len(chunk)
+                    chunk = hash_infile.read(buffer_size)
+            finally:
+                # stop the hashers even if a read fails
+                for chunk_queue in chunk_queues:
+                    chunk_queue.put(None)
+                for hasher_thread in hasher_threads:
+                    hasher_thread.join()
+    return {checksum_type: hasher.hexdigest() for checksum_type, hasher in hashers.items()}
+
+# hash I/O auto-tuner
+#   hashes a sample of the files under root with every mode and buffer size
+#   and returns the fastest as (mode, buffer size, MB/s). the sample is the
+#   first files found, up to sample_bytes. where the OS allows it, the
+#   sample is dropped from the page cache before each try so a later try
+#   isn't measuring memory (a share's client cache can still flatter them)
+def tune_hash_io(root, sample_bytes=256 * 1024 * 1024, sample_count=64, io_modes=hash_io_modes, buffer_sizes=hash_io_buffer_sizes):
+    sample_paths = []
+    sample_total = 0
+    for name_with_path, file_stat in walk_files(root):
+        size = file_stat.st_size if file_stat is not None else os.path.getsize(name_with_path)
+        if size == 0:
+            continue
+        sample_paths.append(name_with_path)
+        sample_total += size
+        if sample_total >= sample_bytes or len(sample_paths) >= sample_count:
+            break
+    if not sample_paths:
+        return hash_io_default + (0.0,)
+    saved_volumes = dict(hash_io_volumes)
+    tune_results = []
+    try:
+        for io_mode in io_modes:
+            # mmap reads the whole file, the buffer size means nothing to it
+            for buffer_size in (buffer_sizes[-1:] if io_mode == 'mmap' else buffer_sizes):
+                set_hash_io({root: (io_mode, buffer_size)})
+                for name_with_path in sample_paths:
+                    drop_cached_file(name_with_path)
+                start_time = time.perf_counter()
+                for name_with_path in sample_paths:
+                    hashlib_checksum(name_with_path, 'MD5')
+                seconds = max(time.perf_counter() - start_time, 1e-9)
+                tune_results.append((sample_total / seconds / 1024 / 1024, io_mode, buffer_size))
+                print('HASH I/O: %-9s %6s KB buffer %10.1f MB/s' % (io_mode, buffer_size // 1024, tune_results[-1][0]))
+    finally:
+        hash_io_volumes.clear()
+        hash_io_volumes.update(saved_volumes)
+    megabytes_per_second, io_mode, buffer_size = max(tune_results)
+    return io_mode, buffer_size, megabytes_per_second
+
+def drop_cached_file(name_with_path):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        with open(name_with_path, 'rb', buffering=0) as cached_file:
+            os.posix_fadvise(cached_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+
+# calculate every selected checksum type for a file
+#   certUtil can only do one algorithm per run, so it reads once per type
+def calculate_checksums(name_with_path, checksum_types, engine=None):
+    if (engine or checksum_engine) == 'hashlib':
+        return hashlib_checksums(name_with_path, checksum_types)
+    return {checksum_type: calculate_checksum(name_with_path, checksum_type, engine) for checksum_type in checksum_types}
+
+# compare checksums with this run and past inventories
+#   a file moved_from somewhere else is compared with what was there
+# name_checksum is the (checksum type, checksum) in the file's name, which
+#   the checksum is compared with instead of past inventories. whether the
+#   file is new or moved still goes by past inventories. a file renamed with
+#   its checksum is looked for in them by its old name, renamed_from
+def checksums(name_with_path, checksum_types, checksum_dict, previous_inventory, duplicate_index, catalog, moved_from='', name_checksum=None, renamed_from=''):
+    checksum_consistent = ''
+    # the first checksum type is the one compared against past inventories
+    checksum = checksum_dict.get(checksum_types[0], '')
 
     new_file = ' '
-    if ((inventory_acc.count('"%s"' % (checksum)) > 0) and checksum is not '') or checksum in previous_checksums or checksum in new_checksums:
+    # if the same checksum has been seen on another path in this run
+    duplicate_checksum = duplicate_index_add(duplicate_index, checksum_types[0], checksum, name_with_path)
+    # or in the catalog of checksums from previous runs
+    if duplicate_checksum == False:
+        for previous_path in catalog_lookup_checksum(catalog, checksum_types[0], checksum):
+            # the file itself, before it moved or was renamed
+            if previous_path in (moved_from, renamed_from):
+                continue
+            # adding the previous path groups them in the duplicates report
+            if duplicate_index_add(duplicate_index, checksum_types[0], checksum, previous_path):
+                duplicate_checksum = True
+    if duplicate_checksum:
         # if checksum appears more than once
         checksum_consistent += 'Duplicate checksum.'
         # print error in shell
         print('---WARNING, CHECKSUM APPEARS MORE THAN ONCE:\n   %s' % (name_with_path))
-    else:
-        new_checksums[checksum] = name_with_path
     # if the file has been processed previously
-    if name_with_path in set_first_dir_names:
-        new_file = ' '
-        # if the checksums match
-        if dict_first_dir[name_with_path] in checksum:
+    previous_file = previous_inventory_lookup(previous_inventory, renamed_from or name_with_path)
+    if previous_file is None and moved_from != '':
+        previous_file = previous_inventory_lookup(previous_inventory, moved_from)
+        new_file = 'Moved from %s' % (moved_from)
+    if previous_file is not None:
+        if moved_from == '':
+            new_file = ' '
+    elif moved_from == '':
+        new_file = 'First inventory of this file'
+    # the name says what it should be, so it's checked against
+    #   that instead of past inventories
+    if name_checksum is not None and name_checksum[0] in checksum_dict:
+        if normalize_checksum(checksum_dict[name_checksum[0]]) == name_checksum[1]:
+            checksum_consistent += ' '
+        else:
+            checksum_consistent += 'Checksum does not match file name.'
+            print('---WARNING, CHECKSUM DOES NOT MATCH FILE NAME:\n   %s' % (name_with_path))
+    # if the checksums match
+    #   (files previously listed as missing have no checksum to match)
+    elif previous_file is not None:
+        if previous_file[0] in checksum:
             # they are consistent
             checksum_consistent += ' '
         else:
@@ -354,31 +2725,514 @@ def checksums(name, name_with_path, checksum_type, inventory_acc, first_inventor
             # print error in shell
             print('---WARNING, CHECKSUM DOES NOT MATCH:\n   %s' % (name_with_path))
     else:
-        new_file = 'First inventory of this file'
         checksum_consistent += ' '
-    return new_file, checksum, checksum_consistent, file_error, file_error_count, inventory_acc, set_matches
+    return new_file, checksum, checksum_consistent
+
+# duplicate checksum index
+#   every checksum is kept as an 8 byte prefix plus the offset of its full
+#   record (checksum and path) in a temporary file, in an open addressing
+#   table per checksum type. that's around 23 bytes of memory per file
+#   whatever the checksum type or path length, so tens of millions of files
+#   fit. the file is only read when prefixes match, and only checksums found
+#   on more than one path are kept in memory with all of their paths
+def new_duplicate_index():
+    # new records are collected in pending_records and written out in blocks
+    return {'records_file': tempfile.TemporaryFile(), 'records_size': 0, 'pending_records': bytearray(), 'tables': {}, 'duplicates': {}}
+
+def new_duplicate_table(capacity):
+    # offsets are stored +1, so 0 marks an empty slot
+    return {'prefixes': array.array('Q', [0]) * capacity, 'offsets': array.array('Q', [0]) * capacity, 'count': 0}
+
+# place a prefix/offset in the first free slot, no record reads needed
+def duplicate_table_place(duplicate_table, prefix, stored_offset):
+    prefixes = duplicate_table['prefixes']
+    offsets = duplicate_table['offsets']
+    mask = len(offsets) - 1
+    slot = prefix & mask
+    while offsets[slot]:
+        slot = (slot + 1) & mask
+    prefixes[slot] = prefix
+    offsets[slot] = stored_offset
+    duplicate_table['count'] += 1
+
+def duplicate_table_grow(duplicate_table):
+    new_table = new_duplicate_table(len(duplicate_table['offsets']) * 2)
+    for prefix, stored_offset in zip(duplicate_table['prefixes'], duplicate_table['offsets']):
+        if stored_offset:
+            duplicate_table_place(new_table, prefix, stored_offset)
+    return new_table
+
+def duplicate_record_write(duplicate_index, digest, name_with_path):
+    path_bytes = name_with_path.encode('utf-8', 'surrogateescape')
+    pending_records = duplicate_index['pending_records']
+    offset = duplicate_index['records_size']
+    pending_records += struct.pack('<BI', len(digest), len(path_bytes)) + digest + path_bytes
+    duplicate_index['records_size'] += 5 + len(digest) + len(path_bytes)
+    if len(pending_records) >= 1024 * 1024:
+        records_file = duplicate_index['records_file']
+        records_file.seek(0, os.SEEK_END)
+        records_file.write(pending_records)
+        pending_records.clear()
+    return offset
+
+def duplicate_record_read(duplicate_index, offset):
+    pending_records = duplicate_index['pending_records']
+    pending_offset = duplicate_index['records_size'] - len(pending_records)
+    if offset >= pending_offset:
+        record = memoryview(pending_records)[offset - pending_offset:]
+    else:
+        records_file = duplicate_index['records_file']
+        records_file.seek(offset)
+        digest_size, path_size = struct.unpack('<BI', records_file.read(5))
+        record = memoryview(b'\0' * 5 + records_file.read(digest_size + path_size))
+    digest_size, path_size = struct.unpack('<BI', record[:5])
+    digest = bytes(record[5:5 + digest_size])
+    return digest, bytes(record[5 + digest_size:5 + digest_size + path_size]).decode('utf-8', 'surrogateescape')
+
+# add a checksum to the index. returns True if the same checksum
+#   is already in the index for a different path
+def duplicate_index_add(duplicate_index, checksum_type, checksum, name_with_path):
+    try:
+        digest = bytes.fromhex(normalize_checksum(checksum))
+    except ValueError:
+        digest = b''
+    # no usable checksum, nothing to compare
+    if digest == b'':
+        return False
+    duplicate_table = duplicate_index['tables'].get(checksum_type)
+    if duplicate_table is None:
+        duplicate_table = new_duplicate_table(1024)
+    # keep the table at most 70% full so probes stay short
+    elif (duplicate_table['count'] + 1) * 10 > len(duplicate_table['offsets']) * 7:
+        duplicate_table = duplicate_table_grow(duplicate_table)
+    duplicate_index['tables'][checksum_type] = duplicate_table
+    prefixes = duplicate_table['prefixes']
+    offsets = duplicate_table['offsets']
+    prefix = int.from_bytes(digest[:8], 'little')
+    mask = len(offsets) - 1
+    slot = prefix & mask
+    while offsets[slot]:
+        if prefixes[slot] == prefix:
+            stored_digest, stored_path = duplicate_record_read(duplicate_index, offsets[slot] - 1)
+            if stored_digest == digest:
+                # the same file seen again (ex. in a previous run) isn't a duplicate.
+                #   paths are dict keys, in the order they were seen, so
+                #   checking for one costs the same however big the group
+                paths = duplicate_index['duplicates'].get((checksum_type, digest), {stored_path: None})
+                paths[name_with_path] = None
+                if len(paths) > 1:
+                    duplicate_index['duplicates'][(checksum_type, digest)] = paths
+                    return True
+                return False
+        slot = (slot + 1) & mask
+    prefixes[slot] = prefix
+    offsets[slot] = duplicate_record_write(duplicate_index, digest, name_with_path) + 1
+    duplicate_table['count'] += 1
+    return False
+
+# checksum type, checksum and every path for each duplicated checksum
+def duplicate_groups(duplicate_index):
+    for (checksum_type, digest), paths in duplicate_index['duplicates'].items():
+        yield checksum_type, digest.hex(), list(paths)
+
+# csv of all duplicate groups found, returns the number of groups
+def duplicate_report(duplicate_index, report_name):
+    group_count = 0
+    with open(report_name, 'w', encoding='utf-8') as report_outfile:
+        report_outfile.write('sep=`\nChecksumType`Checksum`DuplicateGroup`FilePath\n')
+        for checksum_type, checksum, paths in duplicate_groups(duplicate_index):
+            group_count += 1
+            for name_with_path in paths:
+                report_outfile.write('"%s"`"%s"`"%s"`"%s"\n' % (checksum_type, checksum, group_count, name_with_path))
+    return group_count
+
+# duplicate finder
+#   every set of identical files under file_dir, without hashing everything:
+#   files are grouped by size, and a file with a size of its own can't have a
+#   duplicate. files sharing a size are compared by a fingerprint of their
+#   first and last move_fingerprint_size bytes (file_fingerprint()), and only
+#   the ones whose fingerprints still collide are hashed in full. files no
+#   bigger than the fingerprint would read are hashed straight away.
+#   every file of a round goes to the pool at once, so all worker_count
+#   workers are kept busy however small the groups are.
+#   empty files are left out, they're all the same and take up no space.
+#   returns the groups, largest reclaimable space first, as
+#   (checksum, size, paths), and how many bytes were read to find them
+def find_duplicates(file_dir, include_true_exclude_false, file_type_string, file_types, checksum_type, file_name_acc_name, enumerate_workers=8, worker_count=4):
+    not_selected_acc = new_not_selected_acc()
+    # size -> path, or a list of paths once a second file has that size
+    files_by_size = {}
+    file_count = 0
+    for file_number, name_with_path, file_stat in file_name_inventory(file_dir, include_true_exclude_false, file_type_string, file_types, not_selected_acc, file_name_acc_name, enumerate_workers):
+        file_count += 1
+        if file_stat is None:
+            file_stat = os.stat(name_with_path)
+        if file_stat.st_size == 0:
+            continue
+        same_size = files_by_size.get(file_stat.st_size)
+        if same_size is None:
+            files_by_size[file_stat.st_size] = name_with_path
+        elif isinstance(same_size, list):
+            same_size.append(name_with_path)
+        else:
+            files_by_size[file_stat.st_size] = [same_size, name_with_path]
+    close_not_selected_acc(not_selected_acc)
+    size_groups = [(size, paths) for size, paths in files_by_size.items() if isinstance(paths, list)]
+    files_by_size.clear()
+    print('%s\nDUPLICATE CANDIDATES:\n%s files, %s sizes shared by more than one\n%s' % (line_break, file_count, len(size_groups), line_break))
+    bytes_read = 0
+    duplicate_groups_found = []
+    with ThreadPoolExecutor(max_workers=worker_count) as duplicate_pool:
+        # partial hashes of every file that shares its size,
+        #   or full ones of the small files
+        duplicate_jobs = {}
+        for size, paths in size_groups:
+            for name_with_path in paths:
+                if size <= move_min_size:
+                    duplicate_jobs[duplicate_pool.submit(duplicate_checksum, name_with_path, checksum_type)] = (size, name_with_path, True)
+                else:
+                    duplicate_jobs[duplicate_pool.submit(duplicate_fingerprint, name_with_path, size)] = (size, name_with_path, False)
+                bytes_read += min(size, 2 * move_fingerprint_size)
+        # (size, hashed in full, fingerprint or checksum) -> paths
+        files_by_key = duplicate_results(duplicate_jobs)
+        # full hashes of the ones whose fingerprints still collide
+        duplicate_jobs = {}
+        for (size, hashed, key), paths in files_by_key.items():
+            if hashed or len(paths) < 2:
+                continue
+            for name_with_path in paths:
+                duplicate_jobs[duplicate_pool.submit(duplicate_checksum, name_with_path, checksum_type)] = (size, name_with_path, True)
+                bytes_read += size
+        files_by_key.update(duplicate_results(duplicate_jobs))
+        duplicate_groups_found.extend((key, size, sorted(paths)) for (size, hashed, key), paths in files_by_key.items() if hashed and len(paths) > 1)
+    duplicate_groups_found.sort(key=lambda duplicate_group: (-duplicate_group[1] * (len(duplicate_group[2]) - 1), duplicate_group[2][0]))
+    return duplicate_groups_found, bytes_read
+
+# the files of a round of find_duplicates() as they finish, grouped by
+#   (size, hashed in full, fingerprint or checksum). files that can't be read are left out
+def duplicate_results(duplicate_jobs):
+    files_by_key = collections.defaultdict(list)
+    for duplicate_job in as_completed(duplicate_jobs):
+        size, name_with_path, hashed = duplicate_jobs[duplicate_job]
+        key = duplicate_job.result()
+        if key is not None:
+            files_by_key[(size, hashed, key)].append(name_with_path)
+    return files_by_key
+
+# fingerprint or checksum of a file for find_duplicates(), None if it can't
+#   be read (it's reported, and left out rather than stopping the search)
+def duplicate_fingerprint(name_with_path, size):
+    try:
+        return file_fingerprint(name_with_path, size)
+    except OSError:
+        print('---WARNING, FILE CANNOT BE ACCESSED:\n   %s' % (name_with_path))
+        return None
+
+def duplicate_checksum(name_with_path, checksum_type):
+    try:
+        return calculate_checksums(name_with_path, [checksum_type])[checksum_type]
+    except Exception:
+        print('---WARNING, FILE CANNOT BE ACCESSED:\n   %s' % (name_with_path))
+        return None
+
+# groups from find_duplicates(), with the space that removing all but one
+#   file of each would free. returns the group count and reclaimable bytes
+def duplicate_groups_report(duplicate_groups_found, checksum_type, report_name):
+    reclaimable_total = 0
+    with open(report_name, 'w', encoding='utf-8') as report_outfile:
+        report_outfile.write('sep=`\nChecksumType`Checksum`DuplicateGroup`FileSize`ReclaimableBytes`FilePath\n')
+        for group_count, (checksum, size, paths) in enumerate(duplicate_groups_found, 1):
+            reclaimable_bytes = size * (len(paths) - 1)
+            reclaimable_total += reclaimable_bytes
+            for name_with_path in paths:
+                report_outfile.write('"%s"`"%s"`"%s"`"%s"`"%s"`"%s"\n' % (checksum_type, checksum, group_count, size, reclaimable_bytes, name_with_path))
+    return len(duplicate_groups_found), reclaimable_total
+
+# checksum catalog
+#   an sqlite file of every checksum calculated, one row per path and
+#   checksum type. indexed by path and by checksum, so nothing needs to be
+#   loaded into memory at startup and lookups stay fast as it grows
+def open_catalog(catalog_name):
+    # the connection is only ever used by one thread at a time,
+    #   but not always the thread that opened it
+    catalog = sqlite3.connect(catalog_name, check_same_thread=False)
+    catalog.execute('PRAGMA synchronous = NORMAL')
+    with catalog:
+        catalog.execute('CREATE TABLE IF NOT EXISTS checksums (path TEXT NOT NULL, checksum_type TEXT NOT NULL, checksum BLOB NOT NULL, size INTEGER, mtime REAL, last_verified REAL, file_id INTEGER, PRIMARY KEY (path, checksum_type))')
+        catalog.execute('CREATE INDEX IF NOT EXISTS checksums_by_checksum ON checksums (checksum_type, checksum)')
+        catalog.execute('CREATE TABLE IF NOT EXISTS mediainfo_cache (checksum_type TEXT NOT NULL, checksum BLOB NOT NULL, mediainfo_version TEXT NOT NULL, fields TEXT NOT NULL, PRIMARY KEY (checksum_type, checksum, mediainfo_version))')
+        # catalogs made before file IDs were recorded
+        catalog_columns = [row[1] for row in catalog.execute('PRAGMA table_info(checksums)')]
+        if 'file_id' not in catalog_columns:
+            catalog.execute('ALTER TABLE checksums ADD COLUMN file_id INTEGER')
+        # and before fingerprints were, for finding moved files by size
+        if 'fingerprint' not in catalog_columns:
+            catalog.execute('ALTER TABLE checksums ADD COLUMN fingerprint BLOB')
+        # moved files are looked up by size and fingerprint
+        catalog.execute('DROP INDEX IF EXISTS checksums_by_size')
+        catalog.execute('CREATE INDEX IF NOT EXISTS checksums_by_size_fingerprint ON checksums (size, fingerprint)')
+    return catalog
+
+# queue a file's checksums for the next catalog save
+#   checksums are stored as bytes, half the size of the hex.
+#   a last_verified (or fingerprint) of None keeps whatever the catalog already has
+def catalog_add(catalog_batch, name_with_path, file_stat, checksum_dict, last_verified, fingerprint=None):
+    size = file_stat.st_size if file_stat is not None else None
+    mtime = file_stat.st_mtime if file_stat is not None else None
+    # stat from a windows directory listing has no file ID (st_ino is 0)
+    file_id = (file_stat.st_ino or None) if file_stat is not None else None
+    for checksum_type, checksum in checksum_dict.items():
+        try:
+            catalog_batch.append((name_with_path, checksum_type, bytes.fromhex(normalize_checksum(checksum)), size, mtime, last_verified, file_id, fingerprint))
+        except ValueError:
+            pass
+
+# save queued checksums in one transaction
+def catalog_save(catalog, catalog_batch):
+    with catalog:
+        catalog.executemany('INSERT INTO checksums (path, checksum_type, checksum, size, mtime, last_verified, file_id, fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (path, checksum_type) DO UPDATE SET checksum = excluded.checksum, size = excluded.size, mtime = excluded.mtime, '
+            'last_verified = COALESCE(excluded.last_verified, checksums.last_verified), file_id = COALESCE(excluded.file_id, checksums.file_id), '
+            'fingerprint = COALESCE(excluded.fingerprint, checksums.fingerprint)', catalog_batch)
+    catalog_batch.clear()
+
+# take the old paths of moved files out of the catalog
+def catalog_forget(catalog, moved_paths):
+    with catalog:
+        catalog.executemany('DELETE FROM checksums WHERE path = ?', ((moved_path,) for moved_path in moved_paths))
+    moved_paths.clear()
+
+# cached MediaInfo fields for this checksum and MediaInfo version, or None
+def mediainfo_cache_lookup(catalog, checksum_type, checksum, mediainfo_version):
+    try:
+        row = catalog.execute('SELECT fields FROM mediainfo_cache WHERE checksum_type = ? AND checksum = ? AND mediainfo_version = ?', (checksum_type, bytes.fromhex(normalize_checksum(checksum)), mediainfo_version)).fetchone()
+    except ValueError:
+        return None
+    return json.loads(row[0]) if row is not None else None
+
+# cache_rows is a list of (checksum, fields)
+def mediainfo_cache_save(catalog, checksum_type, mediainfo_version, cache_rows):
+    rows = []
+    for checksum, mediainfo_dict in cache_rows:
+        try:
+            rows.append((checksum_type, bytes.fromhex(normalize_checksum(checksum)), mediainfo_version, json.dumps(mediainfo_dict)))
+        except ValueError:
+            pass
+    with catalog:
+        catalog.executemany('INSERT OR REPLACE INTO mediainfo_cache (checksum_type, checksum, mediainfo_version, fields) VALUES (?, ?, ?, ?)', rows)
+
+# paths in the catalog with this checksum
+def catalog_lookup_checksum(catalog, checksum_type, checksum):
+    try:
+        checksum_bytes = bytes.fromhex(normalize_checksum(checksum))
+    except ValueError:
+        return []
+    if checksum_bytes == b'':
+        return []
+    return [row[0] for row in catalog.execute('SELECT path FROM checksums WHERE checksum_type = ? AND checksum = ?', (checksum_type, checksum_bytes))]
+
+# checksum type -> (checksum, size, mtime, file_id, last_verified) in the catalog for this path
+def catalog_lookup_path(catalog, name_with_path):
+    return {row[0]: (row[1].hex(), row[2], row[3], row[4], row[5]) for row in catalog.execute('SELECT checksum_type, checksum, size, mtime, file_id, last_verified FROM checksums WHERE path = ?', (name_with_path,))}
+
+# checksum type from the length of a hex checksum, for history that didn't record it
+checksum_types_by_length = {32: 'MD5', 40: 'SHA1', 64: 'SHA256', 128: 'SHA512'}
+
+# one-shot import of previous_checksums.txt into the catalog.
+#   the file is a run of dict literals ({checksum: path}{checksum: path}...)
+#   appended by past checkpoints, so each one is found and parsed separately
+def import_previous_checksums(catalog, previous_checksums_name):
+    with open(previous_checksums_name, 'r', encoding='utf-8') as previous_checksums_file:
+        previous_checksums_text = previous_checksums_file.read()
+    catalog_batch = []
+    imported_count = 0
+    depth = 0
+    quote = ''
+    escaped = False
+    dict_start = 0
+    for position, character in enumerate(previous_checksums_text):
+        if quote != '':
+            if escaped:
+                escaped = False
+            elif character == '\\':
+                escaped = True
+            elif character == quote:
+                quote = ''
+        elif character in ('"', "'"):
+            quote = character
+        elif character == '{':
+            if depth == 0:
+                dict_start = position
+            depth += 1
+        elif character == '}':
+            depth -= 1
+            if depth == 0:
+                for checksum, name_with_path in ast.literal_eval(previous_checksums_text[dict_start:position + 1]).items():
+                    checksum_type = checksum_types_by_length.get(len(normalize_checksum(checksum)), 'MD5')
+                    catalog_add(catalog_batch, name_with_path, None, {checksum_type: checksum}, None)
+                    imported_count += 1
+                if len(catalog_batch) >= 10000:
+                    catalog_save(catalog, catalog_batch)
+    catalog_save(catalog, catalog_batch)
+    return imported_count
+
+# one-shot import of a csv inventory into the catalog.
+#   size and mtime weren't recorded in inventories, so they're left empty
+def import_inventory(catalog, inventory_name):
+    catalog_batch = []
+    imported_count = 0
+    checksum_columns = {}
+    with open(inventory_name, 'r', encoding='utf-8') as old_inventory:
+        for row in csv.reader(old_inventory, delimiter='`'):
+            # the header says which columns hold extra checksum types
+            if len(row) > 1 and row[1] == 'FilePath':
+                checksum_columns = {column: header[:-len('Checksum')] for column, header in enumerate(row) if column > 10 and header.endswith('Checksum')}
+                continue
+            # only rows of files that had their checksum calculated
+            if len(row) <= 6 or row[5].strip() == '':
+                continue
+            try:
+                last_verified = time.mktime(time.strptime(row[0], "%Y-%m-%d_%Hh%Mm%Ss"))
+            except ValueError:
+                last_verified = None
+            checksum_dict = {row[6]: row[5]}
+            for column, checksum_type in checksum_columns.items():
+                if column < len(row) and row[column].strip() != '':
+                    checksum_dict[checksum_type] = row[column]
+            catalog_add(catalog_batch, row[1], None, checksum_dict, last_verified)
+            imported_count += 1
+            if len(catalog_batch) >= 10000:
+                catalog_save(catalog, catalog_batch)
+    catalog_save(catalog, catalog_batch)
+    return imported_count
+
+# fill a new catalog from previous_checksums.txt and every inventory
+#   in inventory_dir, oldest first so the newest checksum for a path wins
+def import_checksum_history(catalog, inventory_dir):
+    previous_checksums_name = os.path.join(inventory_dir, 'previous_checksums.txt')
+    if os.path.exists(previous_checksums_name):
+        imported_count = import_previous_checksums(catalog, previous_checksums_name)
+        print('Imported %s checksums from\n%s' % (imported_count, previous_checksums_name))
+    for inventory_name in sorted(glob.glob(os.path.join(inventory_dir, '__Inventory_*.csv')), key=os.path.getmtime):
+        imported_count = import_inventory(catalog, inventory_name)
+        print('Imported %s checksums from\n%s' % (imported_count, inventory_name))
 
 # if the file is in a previous inventory but no longer in dir
-def file_in_inv_not_dir(inventory_acc, leftover_files):
-    inventory_acc_total = ''
+#   returns the number of rows written
+def file_in_inv_not_dir(inventory_writer, leftover_files):
+    missing_count = 0
     for leftover in leftover_files:
-        if (('`"%s"`"File is missing or cannot be accessed"\n' % (leftover)) in inventory_acc) == False and leftover not in ('FilePath', ""):
+        if leftover not in ('FilePath', ""):
             time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
-            inventory_acc_total += ('"%s"`"%s"`"File is missing or cannot be accessed"\n'% (time_stamp, (leftover)))
+            inventory_write_row(inventory_writer, [time_stamp, leftover, 'File is missing or cannot be accessed'])
+            missing_count += 1
             print('---WARNING, FILE IS MISSING OR CANNOT BE ACCESSED:\n   %s' % (leftover))
-    return inventory_acc_total
+    return missing_count
 
 
-# accumulate all inventory information
-def accumulation(inventory_acc, time_stamp, name_with_path, root, name, processing_error, checksum, checksum_type, new_file, checksum_consistent, file_error, file_error_count, checkpoint):
+# write all inventory information for a file.
+#   returns True when the writer's budget says it's time for a checkpoint
+def accumulation(inventory_writer, time_stamp, name_with_path, root, name, processing_error, checksum, checksum_types, checksum_dict, new_file, checksum_consistent, file_error, file_error_count, checkpoint, hash_status):
     if file_error != []:
         error_grouping = ("%s Error(s): %s" % (file_error_count, (' '.join(file_error))))
     else:
         error_grouping = ''
-    # character ` is used for csv separation as
-    #    an arbitrary char to account for , and . appearing in file names
-    inventory_acc += ('"%s"`"%s"`"%s"`"%s"`"%s"`"%s"`"%s"`"%s"`"%s"`"%s"`"%s"\n' % (time_stamp, name_with_path, root, name, processing_error, checksum, checksum_type, new_file, checksum_consistent, error_grouping, checkpoint))
-    return inventory_acc
+    # ChecksumStatus tells auditors whether the file was hashed in this run
+    #   or its checksums were carried forward from the catalog
+    row = [time_stamp, name_with_path, root, name, processing_error, checksum, checksum_types[0], new_file, checksum_consistent, error_grouping, checkpoint, hash_status]
+    # the last file written is what the journal records at a checkpoint
+    inventory_writer['file_number'] = checkpoint
+    inventory_writer['name_with_path'] = name_with_path
+    # in multi-digest mode every checksum type gets its own column
+    if len(checksum_types) > 1:
+        row.extend(checksum_dict.get(checksum_type, '') for checksum_type in checksum_types)
+    return inventory_write_row(inventory_writer, row)
+
+# header for the csv inventory, with one extra column per checksum type
+#   when more than one is calculated
+def inventory_header(checksum_types):
+    header = 'sep=`\nProcessingTimeStamp`FilePath`RootDirectory`FileName``Checksum`ChecksumType`NewFile?`ChecksumMatchesPast?`FileCorrupt?`FileNumber`ChecksumStatus'
+    if len(checksum_types) > 1:
+        header += ''.join('`%sChecksum' % checksum_type for checksum_type in checksum_types)
+    return header + '\n'
+
+# streaming inventory writer
+#   rows go through csv.writer with the backtick dialect into a buffered
+#   file, which is flushed and fsync'd on a size or time budget
+#   (checkpoint_save), so memory stays the same however big the tree is.
+#   appends to an existing file, the header is only written to a new one.
+#   with a journal_name, every checkpoint is recorded in that journal along
+#   with run_info (what the run was started with) so it can be resumed
+def open_inventory_writer(inventory_name, header, journal_name=None, run_info=None):
+    outfile = open(inventory_name, 'a', encoding='utf-8', newline='', buffering=1024 * 1024)
+    if outfile.tell() == 0:
+        outfile.write(header)
+    return {'name': inventory_name, 'file': outfile, 'csv_writer': csv.writer(outfile, dialect='backtick'), 'unflushed_bytes': 0, 'last_flush': time.monotonic(),
+        'journal_name': journal_name, 'run_info': run_info or {}, 'file_number': 0, 'name_with_path': ''}
+
+# write a row, returns True when the size or time budget is used up
+def inventory_write_row(inventory_writer, row):
+    inventory_writer['csv_writer'].writerow(row)
+    # close enough to the bytes written: fields, quotes and separators
+    inventory_writer['unflushed_bytes'] += sum(len(str(field)) for field in row) + 3 * len(row)
+    return inventory_writer['unflushed_bytes'] >= inventory_flush_bytes or time.monotonic() - inventory_writer['last_flush'] >= inventory_flush_seconds
+
+def inventory_writer_flush(inventory_writer):
+    inventory_writer['file'].flush()
+    os.fsync(inventory_writer['file'].fileno())
+    inventory_writer['unflushed_bytes'] = 0
+    inventory_writer['last_flush'] = time.monotonic()
+
+def close_inventory_writer(inventory_writer):
+    inventory_writer_flush(inventory_writer)
+    inventory_writer['file'].close()
+
+# resume journal
+#   written to a temp file, fsync'd and renamed over the old one,
+#   so there's always a whole journal on disk, never half of one
+def write_journal(journal_name, journal):
+    temp_journal_name = journal_name + '.tmp'
+    with open(temp_journal_name, 'w', encoding='utf-8') as journal_outfile:
+        json.dump(journal, journal_outfile)
+        journal_outfile.flush()
+        os.fsync(journal_outfile.fileno())
+    os.replace(temp_journal_name, journal_name)
+
+# the journal of an interrupted run, if there is one
+#   and it was started with the same run_info
+def read_journal(journal_name, run_info):
+    try:
+        with open(journal_name, 'r', encoding='utf-8') as journal_infile:
+            journal = json.load(journal_infile)
+    except (OSError, ValueError):
+        return None
+    for key, value in run_info.items():
+        if journal.get(key) != value:
+            return None
+    return journal
+
+# get the temp inventory ready for this run. when resuming, anything written
+#   after the last checkpoint (possibly half a row) is cut off, otherwise
+#   a temp inventory left by a run that can't be resumed is emptied
+def resume_inventory(inventory_name, resume_journal):
+    if not os.path.exists(inventory_name):
+        return
+    with open(inventory_name, 'r+b') as inventory_file:
+        if resume_journal is not None:
+            inventory_file.truncate(resume_journal['inventory_size'])
+            print('\n%s\nRESUMING:\nContinuing after file %s\n%s\nsaved at %s\n%s' % (('{:^}'.format('='*80)), resume_journal['file_number'], resume_journal['name_with_path'], resume_journal['saved_at'], ('{:^}'.format('='*80))))
+        else:
+            inventory_file.truncate(0)
+
+# the files an interrupted run finished: the paths in its temp inventory
+def resume_done_files(resume_journal):
+    done_paths = set()
+    with open(resume_journal['inventory_name'], 'r', encoding='utf-8', newline='') as inventory_infile:
+        for row in csv.reader(inventory_infile, dialect='backtick'):
+            # rows of processed files, not the header
+            if len(row) > 10 and row[10] != 'FileNumber':
+                done_paths.add(row[1])
+    return done_paths
 
 '''
 # this was just used for testing. currently saving but will be gone for longterm use
@@ -403,64 +3257,209 @@ def write_file(inventory_dir, modified_path, checkpoint_inventory_name, start_ti
     os.rename(checkpoint_inventory_name, inventory_name)
 '''
 
-# csv accumulator for files that have not been selected for processing
-def not_selected_inventory(not_selected_acc):
-    not_selected_inventory_acc = ''
-    for name_with_path in not_selected_acc:
+# csv rows for files that have not been selected for processing
+#   returns the number of rows written
+def not_selected_inventory(inventory_writer, not_selected_acc):
+    for name_with_path in not_selected_paths(not_selected_acc):
         time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
         root, name = os.path.split(name_with_path)
-        not_selected_inventory_acc += ('"%s"`"%s"`"%s"`"%s"`"Not selected"``\n' % (time_stamp, name_with_path, root, name))
-    return not_selected_inventory_acc
+        inventory_write_row(inventory_writer, [time_stamp, name_with_path, root, name, 'Not selected', '', ''])
+    return not_selected_acc['count']
 
 
 def main():
 # hardcoded inputs for now, otherwise it's just annoying to do every time
     # file_dir, inventory_dir, checksum_type, include_true_exclude_false, file_types, file_type_string = take_inputs()
-    start_time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
     #file_dir = '\\\\?\\S:\\Departments\\Digital Services\\Internal\\DigiPres\\Checksum_Inventory_Generation\\Contained_Test'
     #file_dir = '\\\\?\\R:\\Projects\\Glacier-ReadyForUpload\\FPoC2013'
     file_dir = '\\\\?\\R:\\DigitalServices'
     inventory_dir = '\\\\?\\S:\\Departments\\Digital Services\\Internal\\DigiPres\\Checksum_Inventory_Generation\\Inventories'
+    # several types can be listed (ex 'MD5 SHA256'), all are calculated
+    #   from one read of each file. the first is compared with past inventories
     checksum_type = 'MD5'
     include_true_exclude_false = True
     #file_type_string = ''
     file_type_string = 'jp2 jpg tif png mp3 gif jpe wav mp4 mov hdr svg vob m4v mpg'
+    # the shares are slow to open files on, keep lots of them in flight
+    share_concurrency.update({'R:': 32, 'S:': 8})
+    run_settings = {'worker_count': 32, 'pool_type': 'async', 'hash_io_settings': {'R:\\': ('readinto', 16 * 1024 * 1024)}}
+    run_inventory(file_dir, inventory_dir, checksum_type, include_true_exclude_false, file_type_string, run_settings)
+
+# settings for run_inventory(), any of which can be given in its run_settings
+default_run_settings = {
+    # files hashed at once, in threads or through a 'process' pool,
+    #   or kept in flight by the 'async' pool, at most share_concurrency
+    #   of them on each share
+    'worker_count': 4,
+    'pool_type': 'thread',
+    # only hash files that changed since the catalog saw them,
+    #   and re-verify everything else on a rolling basis every reverify_days.
+    #   off, every file is hashed every run, which is what checks them for
+    #   silent corruption; it's printed at the start and in the run summary
+    'incremental': False,
+    'reverify_days': 90,
+    # continue an interrupted run from its last checkpoint
+    'resume': True,
+    # directories listed at once while looking for files
+    'enumerate_workers': 8,
+    # rules mediainfo() checks files against, file_specs.json if None
+    'file_specs': None,
+    # mediainfo runs at once, and files waiting between pipeline stages
+    'validate_workers': 2,
+    'queue_size': 256,
+    # recognise files that moved instead of hashing them as new ones
+    'detect_moves': True,
+    # how files on each volume are read for hashing (see hash_io_modes),
+    #   and whether to measure file_dir's volume and pick for it instead
+    'hash_io_settings': {},
+    'tune_hash_io_first': False,
+    # time every stage, print progress with an ETA and save a run summary
+    #   next to the inventory. profile_run also saves a cProfile of the run
+    'collect_metrics': True,
+    'profile_run': False,
+    # processes reading new and changed media files through to the end,
+    #   0 to only check their headers
+    'deep_verify_workers': 2,
+    # rename files to name___MD5_<checksum>.ext, and check the names of
+    #   files that already have one against their checksum
+    'embed_checksums': False,
+    'name_audit': True,
+}
+
+# one inventory of file_dir, saved in inventory_dir with its reports.
+#   nothing is asked for, so it can be run from main(), the command line
+#   (inventory_main()) or the benchmarks. returns the names of what was
+#   saved, the run summary (None without metrics) and the change counts
+def run_inventory(file_dir, inventory_dir, checksum_type, include_true_exclude_false, file_type_string, run_settings=None):
+    settings = dict(default_run_settings)
+    settings.update(run_settings or {})
+    start_time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
     file_types = file_type_string.split()
-    
-    # get previous checksums from all previous inventories
-    new_checksums = {}
-    with open("\\\\?\\S:\\Departments\\Digital Services\\Internal\\DigiPres\\Checksum_Inventory_Generation\\Inventories\\previous_checksums.txt", 'r+', encoding='utf-8') as previous_checksums_file:
-        previous_checksums = ast.literal_eval(previous_checksums_file.read())
+    file_specs = settings['file_specs'] if settings['file_specs'] is not None else load_file_specs(file_specs_name)
+    hashing_mode = run_hashing_mode(settings)
+    print('%s\nHASHING:\n%s\n%s' % (line_break, hashing_mode, line_break))
+
+    # catalog of previous checksums from all previous inventories.
+    #   the first time, it's filled from previous_checksums.txt
+    #   and the inventories that are already there
+    catalog_name = os.path.join(inventory_dir, 'checksum_catalog.sqlite')
+    first_catalog = not os.path.exists(catalog_name)
+    catalog = open_catalog(catalog_name)
+    if first_catalog:
+        import_checksum_history(catalog, inventory_dir)
+    # checksums seen during this run, for duplicate detection
+    duplicate_index = new_duplicate_index()
+    hash_io_settings = dict(settings['hash_io_settings'])
+    set_hash_io(hash_io_settings)
+    if settings['tune_hash_io_first']:
+        io_mode, buffer_size, megabytes_per_second = tune_hash_io(file_dir)
+        hash_io_settings[file_dir] = (io_mode, buffer_size)
+        set_hash_io(hash_io_settings)
+        print('%s\nHASH I/O:\n%s with %s KB buffers (%.1f MB/s)\n%s' % (line_break, io_mode, buffer_size // 1024, megabytes_per_second, line_break))
 
     # check for previous inventories of dir, return info
-    modified_path, first_inventory_of_dir, read_inventory, set_first_dir, dict_first_dir, set_first_dir_names, set_matches = check_for_inventories(file_dir, inventory_dir)
+    modified_path, first_inventory_of_dir, previous_inventory = check_for_inventories(file_dir, inventory_dir)
 
     # create inventory names
-    checkpoint_inventory_name = ('%s\\__Inventory_%s___TEMPINVENTORY1.csv' % (inventory_dir, modified_path))
-    inventory_name = (('%s\\__Inventory_%s___%s.csv')% (inventory_dir, modified_path, str(start_time_stamp)))
+    checkpoint_inventory_name = os.path.join(inventory_dir, '__Inventory_%s___TEMPINVENTORY1.csv' % (modified_path))
+    inventory_name = os.path.join(inventory_dir, '__Inventory_%s___%s.csv' % (modified_path, start_time_stamp))
+    duplicate_report_name = os.path.join(inventory_dir, '__Duplicates_%s___%s.csv' % (modified_path, start_time_stamp))
+    run_summary_name = os.path.join(inventory_dir, '__RunSummary_%s___%s.json' % (modified_path, start_time_stamp))
+    profile_name = os.path.join(inventory_dir, '__Profile_%s___%s.prof' % (modified_path, start_time_stamp))
+    run_metrics = new_run_metrics(previous_inventory['count'], settings['profile_run']) if settings['collect_metrics'] else None
+    differences_report_name = os.path.join(inventory_dir, '__Differences_%s___%s.csv' % (modified_path, start_time_stamp))
+
+    # pick up where an interrupted run of the same directory left off
+    journal_name = '%s.journal' % (checkpoint_inventory_name)
+    run_info = {'file_dir': file_dir, 'checksum_type': checksum_type}
+    resume_journal = read_journal(journal_name, run_info) if settings['resume'] else None
+    resume_inventory(checkpoint_inventory_name, resume_journal)
+
+    # the temp inventory is streamed to disk as files are processed
+    inventory_writer = open_inventory_writer(checkpoint_inventory_name, inventory_header(checksum_type.split()), journal_name, run_info)
 
     # create inventory of all file names that will be processed
-    file_name_acc, not_selected_acc, total_to_do, total_not_selected = file_name_inventory(file_dir, include_true_exclude_false, file_type_string, file_types)
+    # files are hashed as they're found
+    not_selected_acc = new_not_selected_acc(previous_inventory)
+    file_items = file_name_inventory(file_dir, include_true_exclude_false, file_type_string, file_types, not_selected_acc, os.path.join(inventory_dir, 'File_Name_Acc.txt'), settings['enumerate_workers'])
 
     # process files, return inventory
-    inventory_acc_recursive, leftover_files, checkpoint = recursive_by_file(file_dir, include_true_exclude_false, file_type_string, file_types, checksum_type, inventory_acc, first_inventory_of_dir, read_inventory, set_first_dir, dict_first_dir, set_first_dir_names, set_matches, file_name_acc, not_selected_acc, total_to_do, total_not_selected, inventory_dir, modified_path, checkpoint_inventory_name, previous_checksums)
+    leftover_files, checkpoint = recursive_by_file(file_dir, include_true_exclude_false, file_type_string, file_types, checksum_type, inventory_writer, first_inventory_of_dir, previous_inventory, file_items, not_selected_acc, inventory_dir, modified_path, checkpoint_inventory_name, duplicate_index, catalog, settings['worker_count'], settings['pool_type'], settings['incremental'], settings['reverify_days'], resume_journal, settings['validate_workers'], settings['queue_size'], file_specs, settings['detect_moves'], run_metrics, settings['deep_verify_workers'], settings['embed_checksums'], settings['name_audit'])
     
     # manage files not included for processing
-    inventory_acc_not_included = file_in_inv_not_dir(inventory_acc_recursive, leftover_files)
-    not_selected_inventory_acc = not_selected_inventory(not_selected_acc)
-    inventory_acc_not_processed = inventory_acc_not_included + not_selected_inventory_acc
-    not_processed_acc_total = inventory_acc_not_processed.count('\n') + checkpoint
-    checkpoint_save(not_processed_acc_total, checkpoint_inventory_name, inventory_acc_total)
+    #   the journal stays at the end of the processed files, so if this is
+    #   interrupted a resumed run writes these rows again from scratch
+    not_processed_acc_total = file_in_inv_not_dir(inventory_writer, leftover_files) + not_selected_inventory(inventory_writer, not_selected_acc) + checkpoint
+    checkpoint_save(not_processed_acc_total, inventory_writer, catalog, [], False)
+    close_not_selected_acc(not_selected_acc)
     
     # finish inventory
+    close_inventory_writer(inventory_writer)
     os.rename(checkpoint_inventory_name, inventory_name)
+    close_previous_inventory(previous_inventory)
+    # what changed since the inventories this one was compared with
+    change_counts = inventory_differences_report(previous_inventory['inventory_names'], [inventory_name], file_dir, differences_report_name)
+    print('\n%s\nDIFFERENCES:\n%s\nsaved as\n%s' % (line_break, ', '.join('%s %s' % (change_counts[change], change) for change in ('New', 'Missing', 'Changed', 'Moved', 'Revalidated')), differences_report_name))
+    # nothing left to resume
+    os.remove(journal_name)
+    catalog.close()
+    duplicate_group_count = duplicate_report(duplicate_index, duplicate_report_name)
+    print('\n%s\nDUPLICATES:\n%s duplicate checksum group(s) saved as\n%s' % (line_break, duplicate_group_count, duplicate_report_name))
+    run_summary = None
+    if run_metrics is not None:
+        run_summary = write_run_summary(run_metrics, run_summary_name, dict(run_info, inventory_name=inventory_name, worker_count=settings['worker_count'], pool_type=settings['pool_type'], incremental=settings['incremental'], reverify_days=settings['reverify_days'], hashing_mode=hashing_mode), profile_name if settings['profile_run'] else None)
+        print('\n%s\nRUN SUMMARY:\n%s\n%s files hashed, %.1f files/s, %.1f MB/s\n%s\nsaved as\n%s' % (line_break, hashing_mode, run_summary['files_hashed'], run_summary['files_per_second'], run_summary['megabytes_per_second'], ', '.join('%s %.1fs' % (stage_name, stage['seconds']) for stage_name, stage in run_summary['stages'].items()), run_summary_name))
     time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
     print('\n%s\nCOMPLETED:\nInventory saved as\n%s\nCOMPLETED AT: %s\n%s' % (('{:^}'.format('='*80)), inventory_name, time_stamp, ('{:^}'.format('='*80))))
+    return {'inventory_name': inventory_name, 'differences_report_name': differences_report_name, 'duplicate_report_name': duplicate_report_name,
+        'run_summary_name': run_summary_name if run_summary is not None else None, 'run_summary': run_summary, 'change_counts': change_counts, 'files_processed': checkpoint}
+
+# whether every file is hashed, in words for the output and run summary
+def run_hashing_mode(settings):
+    if settings['incremental'] and settings['reverify_days'] > 0:
+        return 'incremental: files unchanged since the catalog saw them are not re-hashed, each is re-verified at least every %s days' % (settings['reverify_days'])
+    return 'full: every file is hashed'
+
+# inventory mode: an inventory of any directory without the hardcoded paths
+#   or any questions, run with
+#   `python microservices_batch_processing.py inventory FILE_DIR INVENTORY_DIR ["MD5 SHA256"] ["jpg tif wav"]`
+#   checksum types default to MD5 and file types to every file
+def inventory_main(arguments):
+    if len(arguments) < 2:
+        print('usage: microservices_batch_processing.py inventory FILE_DIR INVENTORY_DIR [CHECKSUM_TYPES] [FILE_TYPES]')
+        sys.exit(2)
+    file_dir, inventory_dir = arguments[0], arguments[1]
+    checksum_type = ' '.join(option for option in (arguments[2] if len(arguments) > 2 else 'MD5').upper().split() if option in hash_algorithms) or 'MD5'
+    file_type_string = arguments[3] if len(arguments) > 3 else ''
+    run_inventory(file_dir, inventory_dir, checksum_type, True, file_type_string)
+
+
+# duplicates mode: only look for duplicate files, without an inventory.
+#   run with `python microservices_batch_processing.py duplicates`
+def duplicates_main():
+    start_time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
+    file_dir = '\\\\?\\R:\\DigitalServices'
+    inventory_dir = '\\\\?\\S:\\Departments\\Digital Services\\Internal\\DigiPres\\Checksum_Inventory_Generation\\Inventories'
+    checksum_type = 'MD5'
+    include_true_exclude_false = True
+    file_type_string = ''
+    file_types = file_type_string.split()
+    enumerate_workers = 8
+    worker_count = 4
+    modified_path = inventory_path_name(file_dir)
+    report_name = os.path.join(inventory_dir, '__DuplicateFiles_%s___%s.csv' % (modified_path, start_time_stamp))
+    duplicate_groups_found, bytes_read = find_duplicates(file_dir, include_true_exclude_false, file_type_string, file_types, checksum_type, os.path.join(inventory_dir, 'File_Name_Acc.txt'), enumerate_workers, worker_count)
+    group_count, reclaimable_total = duplicate_groups_report(duplicate_groups_found, checksum_type, report_name)
+    time_stamp = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
+    print('\n%s\nCOMPLETED:\n%s duplicate group(s), %s bytes reclaimable\n(%s bytes read to find them)\nsaved as\n%s\nCOMPLETED AT: %s\n%s' % (('{:^}'.format('='*80)), group_count, reclaimable_total, bytes_read, report_name, time_stamp, ('{:^}'.format('='*80))))
 
 
 if __name__ == '__main__':
     # subprocess.Popen('cmd /u', shell=True)
-    line_break = ('{:^}'.format('-'*80))
-    inventory_acc = 'sep=`\nProcessingTimeStamp`FilePath`RootDirectory`FileName``Checksum`ChecksumType`NewFile?`ChecksumMatchesPast?`FileCorrupt?`FileNumber\n'
-    main()
+    if sys.argv[1:2] == ['duplicates']:
+        duplicates_main()
+    elif sys.argv[1:2] == ['inventory']:
+        inventory_main(sys.argv[2:])
+    else:
+        main()
 
@@ -0,0 +1,91 @@
+import os, sys, io, csv, time, collections
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import microservices_batch_processing as mbp
+
+# run_inventory() on file_dir, without deep verification processes unless
+#   they're asked for. returns its result and the inventory's rows by path
+def run_inventory(file_dir, inventory_dir, run_settings=None, checksum_type='MD5', include_true_exclude_false=True, file_type_string=''):
+    # inventories are told apart by the second they were started
+    time.sleep(1.01 - time.time() % 1)
+    settings = {'deep_verify_workers': 0}
+    settings.update(run_settings or {})
+    inventory_run = mbp.run_inventory(str(file_dir), str(inventory_dir), checksum_type, include_true_exclude_false, file_type_string, settings)
+    return inventory_run, inventory_rows(inventory_run['inventory_name'])
+
+# path -> {column: value} for every row of an inventory.
+#   the unnamed column after FileName is the processing error
+def inventory_rows(inventory_name):
+    rows = {}
+    with open(inventory_name, 'r', encoding='utf-8', newline='') as inventory_infile:
+        inventory_reader = csv.reader(inventory_infile, dialect='backtick')
+        next(inventory_reader)
+        header = ['ProcessingError' if column == '' else column for column in next(inventory_reader)]
+        for row in inventory_reader:
+            rows[row[1]] = dict(zip(header, row))
+    return rows
+
+# checksum type -> (checksum, size, mtime, file_id, last_verified)
+#   in inventory_dir's catalog for a path
+def catalog_record(inventory_dir, name_with_path):
+    catalog = mbp.open_catalog(os.path.join(str(inventory_dir), 'checksum_catalog.sqlite'))
+    try:
+        return mbp.catalog_lookup_path(catalog, name_with_path)
+    finally:
+        catalog.close()
+
+def write_files(root, files):
+    for name, data in files.items():
+        name_with_path = os.path.join(str(root), name)
+        os.makedirs(os.path.dirname(name_with_path), exist_ok=True)
+        with open(name_with_path, 'wb') as test_outfile:
+            test_outfile.write(data)
+    return [os.path.join(str(root), name) for name in files]
+
+@pytest.fixture
+def file_dir(tmp_path):
+    file_dir = tmp_path / 'files'
+    file_dir.mkdir()
+    return file_dir
+
+@pytest.fixture
+def inventory_dir(tmp_path):
+    inventory_dir = tmp_path / 'inventories'
+    inventory_dir.mkdir()
+    return inventory_dir
+
+# files read through a SlowFile wait read_latency for every read,
+#   like a round trip to the share
+class SlowFile(io.FileIO):
+    read_latency = 0.0
+
+    def read(self, *args):
+        time.sleep(self.read_latency)
+        return super().read(*args)
+
+    def readinto(self, *args):
+        time.sleep(self.read_latency)
+        return super().readinto(*args)
+
+# artificially slowed filesystem, standing in for a high latency share.
+#   files the script opens under share['root'] wait share['open_latency']
+#   seconds to open and SlowFile.read_latency for each read, and a path in
+#   share['errors'] raises the next of its errors instead of opening.
+#   share['opens'] counts the opens of each path
+@pytest.fixture
+def share(monkeypatch):
+    share = {'root': None, 'open_latency': 0.0, 'errors': {}, 'opens': collections.Counter()}
+    monkeypatch.setattr(SlowFile, 'read_latency', 0.0)
+    def share_open(name_with_path, mode='r', buffering=-1, *args, **kwargs):
+        if share['root'] is None or not str(name_with_path).startswith(share['root']):
+            return io.open(name_with_path, mode, buffering, *args, **kwargs)
+        share['opens'][name_with_path] += 1
+        time.sleep(share['open_latency'])
+        if share['errors'].get(name_with_path):
+            raise share['errors'][name_with_path].pop(0)
+        if mode == 'rb' and buffering == 0:
+            return SlowFile(name_with_path, 'rb')
+        return io.open(name_with_path, mode, buffering, *args, **kwargs)
+    monkeypatch.setattr(mbp, 'open', share_open, raising=False)
+    return share
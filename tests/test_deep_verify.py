@@ -0,0 +1,22 @@
+import os
+import pytest
+
+import microservices_batch_processing as mbp
+import benchmarks
+
+# deep verification finds nothing wrong with whole files, and the
+#   truncation in ones that lost their last third
+@pytest.mark.parametrize('extension, expected_error', [('jpg', 'JPEG ends before its EOI marker.'), ('tif', 'runs past the end of the file'), ('wav', 'WAV data chunk is')])
+def test_deep_verify_truncated(tmp_path, extension, expected_error):
+    name_with_path = str(tmp_path / ('media.' + extension))
+    if extension == 'jpg':
+        benchmarks.make_test_jpeg(name_with_path, 64, 48)
+    elif extension == 'tif':
+        benchmarks.make_test_tiff(name_with_path, 64, 48)
+    else:
+        benchmarks.make_test_wav(name_with_path, 48000, 1)
+    assert mbp.deep_verify(name_with_path) == []
+    with open(name_with_path, 'r+b') as media_file:
+        media_file.truncate(os.path.getsize(name_with_path) * 2 // 3)
+    deep_errors = mbp.deep_verify(name_with_path)
+    assert any(expected_error in deep_error for deep_error in deep_errors), deep_errors
@@ -0,0 +1,33 @@
+import time
+
+import microservices_batch_processing as mbp
+
+def test_duplicate_index(tmp_path):
+    duplicate_index = mbp.new_duplicate_index()
+    checksum = 'd41d8cd98f00b204e9800998ecf8427e'
+    assert not mbp.duplicate_index_add(duplicate_index, 'MD5', checksum, '/a/first.tif')
+    # the same file again isn't a duplicate of itself
+    assert not mbp.duplicate_index_add(duplicate_index, 'MD5', checksum, '/a/first.tif')
+    assert mbp.duplicate_index_add(duplicate_index, 'MD5', checksum.upper(), '/b/copy.tif')
+    assert mbp.duplicate_index_add(duplicate_index, 'MD5', checksum, '/a/first.tif')
+    # other checksum types are kept apart, and blank checksums never match
+    assert not mbp.duplicate_index_add(duplicate_index, 'SHA1', checksum, '/c/other.tif')
+    assert not mbp.duplicate_index_add(duplicate_index, 'MD5', '', '/c/blank.tif')
+    assert not mbp.duplicate_index_add(duplicate_index, 'MD5', '', '/c/blank copy.tif')
+    assert list(mbp.duplicate_groups(duplicate_index)) == [('MD5', checksum, ['/a/first.tif', '/b/copy.tif'])]
+    report_name = str(tmp_path / 'duplicates.csv')
+    assert mbp.duplicate_report(duplicate_index, report_name) == 1
+
+# adding to a big group costs the same as adding to a small one
+def test_large_duplicate_group():
+    duplicate_index = mbp.new_duplicate_index()
+    checksum = 'd41d8cd98f00b204e9800998ecf8427e'
+    paths = ['/copies/%s/file_%s.tif' % (file_number % 100, file_number) for file_number in range(50000)]
+    start_time = time.perf_counter()
+    for name_with_path in paths:
+        mbp.duplicate_index_add(duplicate_index, 'MD5', checksum, name_with_path)
+    # and again, like the catalog's paths for the same group
+    for name_with_path in paths:
+        mbp.duplicate_index_add(duplicate_index, 'MD5', checksum, name_with_path)
+    assert time.perf_counter() - start_time < 5
+    assert list(mbp.duplicate_groups(duplicate_index)) == [('MD5', checksum, paths)]
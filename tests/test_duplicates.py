@@ -0,0 +1,25 @@
+import os
+
+import microservices_batch_processing as mbp
+from conftest import write_files
+
+# duplicates are found by size, then fingerprint, then checksum,
+#   without reading all of files whose size or fingerprint is their own
+def test_find_duplicates(tmp_path):
+    big = os.urandom(4 * mbp.move_fingerprint_size)
+    same_ends = bytearray(big)
+    same_ends[2 * mbp.move_fingerprint_size] ^= 0xff
+    files = {'a/big.bin': big, 'b/big copy.bin': big, 'c/same ends.bin': bytes(same_ends),
+        'a/small.txt': b'small', 'b/small copy.txt': b'small', 'c/smell.txt': b'smell',
+        'a/unique.bin': os.urandom(8 * mbp.move_fingerprint_size), 'a/empty.txt': b'', 'b/empty.txt': b''}
+    for file_number in range(20):
+        files['d/other_%s.bin' % file_number] = os.urandom(4 * mbp.move_fingerprint_size)
+    write_files(tmp_path / 'files', files)
+    file_dir = str(tmp_path / 'files')
+    duplicate_groups_found, bytes_read = mbp.find_duplicates(file_dir, True, '', [], 'MD5', str(tmp_path / 'File_Name_Acc.txt'), 2, 4)
+    assert [(size, paths) for checksum, size, paths in duplicate_groups_found] == [
+        (len(big), sorted([os.path.join(file_dir, 'a', 'big.bin'), os.path.join(file_dir, 'b', 'big copy.bin')])),
+        (5, sorted([os.path.join(file_dir, 'a', 'small.txt'), os.path.join(file_dir, 'b', 'small copy.txt')]))]
+    assert duplicate_groups_found[0][0] == mbp.calculate_checksum(os.path.join(file_dir, 'a', 'big.bin'), 'MD5')
+    # ends of the 23 big files that share a size, then the 3 that match in full
+    assert bytes_read == 23 * 2 * mbp.move_fingerprint_size + 3 * len(big) + 5 * 3
@@ -0,0 +1,76 @@
+import os, errno, time
+import pytest
+
+import microservices_batch_processing as mbp
+from conftest import run_inventory, write_files
+
+@pytest.fixture(autouse=True)
+def no_retry_waits(monkeypatch):
+    monkeypatch.setattr(mbp, 'hash_retry_delays', (0, 0, 0))
+
+# a share error that clears up is retried, and the file is hashed
+@pytest.mark.parametrize('pool_type', ['thread', 'async'])
+def test_transient_error_is_retried(file_dir, inventory_dir, share, pool_type):
+    name_with_path, = write_files(file_dir, {'scan.bin': b'scan data'})
+    share['root'] = str(file_dir)
+    share['errors'][name_with_path] = [OSError(errno.EIO, 'I/O error'), TimeoutError(errno.ETIMEDOUT, 'timed out')]
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'pool_type': pool_type})
+    assert share['opens'][name_with_path] == 3
+    assert rows[name_with_path]['ChecksumStatus'] == 'Hashed'
+    assert rows[name_with_path]['ProcessingError'] == ' '
+
+# a file that's gone or can't be opened fails at once, without waiting
+@pytest.mark.parametrize('pool_type', ['thread', 'async'])
+@pytest.mark.parametrize('error', [FileNotFoundError(errno.ENOENT, 'gone'), PermissionError(errno.EACCES, 'denied')])
+def test_permanent_error_is_not_retried(file_dir, inventory_dir, share, monkeypatch, pool_type, error):
+    monkeypatch.setattr(mbp, 'hash_retry_delays', (30,))
+    name_with_path, = write_files(file_dir, {'scan.bin': b'scan data'})
+    share['root'] = str(file_dir)
+    share['errors'][name_with_path] = [error]
+    start_time = time.monotonic()
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'pool_type': pool_type})
+    assert time.monotonic() - start_time < 10
+    assert share['opens'][name_with_path] == 1
+    assert rows[name_with_path]['ProcessingError'] == 'Error in processing while calculating checksum'
+
+# a broken link fails at once too
+def test_broken_link_is_not_retried(file_dir, inventory_dir, monkeypatch):
+    monkeypatch.setattr(mbp, 'hash_retry_delays', (30,))
+    os.symlink(str(file_dir / 'nowhere'), str(file_dir / 'broken.bin'))
+    start_time = time.monotonic()
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    assert time.monotonic() - start_time < 10
+    assert rows[str(file_dir / 'broken.bin')]['ProcessingError'] == 'Error in processing while calculating checksum'
+
+# a share that stays down is tried once and once for each retry delay
+def test_retries_run_out(file_dir, inventory_dir, share):
+    name_with_path, = write_files(file_dir, {'scan.bin': b'scan data'})
+    share['root'] = str(file_dir)
+    share['errors'][name_with_path] = [OSError(errno.EIO, 'I/O error') for attempt in range(10)]
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    assert share['opens'][name_with_path] == 1 + len(mbp.hash_retry_delays)
+    assert rows[name_with_path]['ProcessingError'] == 'Error in processing while calculating checksum'
+
+def test_hash_error_can_retry():
+    assert mbp.hash_error_can_retry(OSError(errno.EIO, 'I/O error'))
+    assert mbp.hash_error_can_retry(OSError(errno.ESTALE, 'stale handle'))
+    assert not mbp.hash_error_can_retry(FileNotFoundError(errno.ENOENT, 'gone'))
+    assert not mbp.hash_error_can_retry(PermissionError(errno.EACCES, 'denied'))
+    assert not mbp.hash_error_can_retry(IsADirectoryError(errno.EISDIR, 'directory'))
+    assert not mbp.hash_error_can_retry(ValueError('not an OSError'))
+
+# on a slow share the async pool keeps opens in flight at once,
+#   where one thread waits for each in turn
+def test_async_pool_overlaps_share_latency(file_dir, inventory_dir, share):
+    paths = write_files(file_dir, {'dir_%s/file_%02d.bin' % (file_number % 4, file_number): os.urandom(4096) for file_number in range(40)})
+    share['root'] = str(file_dir)
+    share['open_latency'] = 0.05
+    seconds = {}
+    rows = {}
+    for pool_type, worker_count in (('thread', 1), ('async', 16)):
+        (inventory_dir / pool_type).mkdir()
+        inventory_run, rows[pool_type] = run_inventory(file_dir, inventory_dir / pool_type, {'pool_type': pool_type, 'worker_count': worker_count})
+        seconds[pool_type] = inventory_run['run_summary']['seconds']
+    assert seconds['async'] < seconds['thread'] / 2
+    for name_with_path in paths:
+        assert rows['async'][name_with_path]['Checksum'] == rows['thread'][name_with_path]['Checksum']
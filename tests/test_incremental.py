@@ -0,0 +1,19 @@
+import os, time, types
+
+import microservices_batch_processing as mbp
+from conftest import run_inventory, write_files
+
+# every file is hashed every run unless incremental is asked for
+def test_incremental_is_opt_in(file_dir, inventory_dir, monkeypatch):
+    paths = write_files(file_dir, {'file_%s.bin' % file_number: os.urandom(256) for file_number in range(5)})
+    run_inventory(file_dir, inventory_dir)
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    assert all(rows[name_with_path]['ChecksumStatus'] == 'Hashed' for name_with_path in paths)
+    assert inventory_run['run_summary']['files_hashed'] == 5
+    assert inventory_run['run_summary']['run_info']['hashing_mode'].startswith('full')
+    # none of them are today's share of the rolling re-verification
+    monkeypatch.setattr(mbp, 'zlib', types.SimpleNamespace(crc32=lambda data: int(time.time() // 86400) + 1))
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'incremental': True})
+    assert all(rows[name_with_path]['ChecksumStatus'] == 'Carried forward' for name_with_path in paths)
+    assert inventory_run['run_summary']['files_hashed'] == 0
+    assert inventory_run['run_summary']['run_info']['hashing_mode'].startswith('incremental')
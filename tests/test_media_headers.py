@@ -0,0 +1,42 @@
+import os
+import pytest
+
+import microservices_batch_processing as mbp
+import benchmarks
+
+# one of each media file read natively, with the fields MediaInfo would give
+@pytest.fixture(scope='module')
+def test_media(tmp_path_factory):
+    return benchmarks.make_test_media(str(tmp_path_factory.mktemp('media')), 1, width=64, height=48)
+
+@pytest.mark.parametrize('extension', ['jpg', 'jp2', 'tif', 'wav', 'mov'])
+def test_header_fields(test_media, extension):
+    name_with_path, expected_fields = [(name_with_path, fields) for name_with_path, fields in test_media.items() if name_with_path.endswith(extension)][0]
+    mediainfo_dict = mbp.read_media_header(name_with_path)
+    assert mediainfo_dict is not None
+    for field, value in expected_fields.items():
+        assert mediainfo_dict[field] == value, field
+    assert mediainfo_dict['FileExtension'] == extension
+
+# header fields pass the file specs they were written to meet
+def test_headers_meet_file_specs(test_media):
+    for name_with_path in test_media:
+        file_error_count, file_error = mbp.mediainfo(os.path.basename(name_with_path), name_with_path, 0, [])
+        assert file_error == [], name_with_path
+
+# a file that isn't what its extension says is left for MediaInfo
+def test_unknown_header_is_left_for_mediainfo(tmp_path):
+    name_with_path = tmp_path / 'not_a.jpg'
+    name_with_path.write_bytes(b'plain text, not a jpeg')
+    assert mbp.read_media_header(str(name_with_path)) is None
+
+def test_lossy_tiff_compression(tmp_path):
+    name_with_path = str(tmp_path / 'lossy.tif')
+    benchmarks.make_test_tiff(name_with_path, 64, 48)
+    with open(name_with_path, 'r+b') as media_file:
+        # the compression entry is the fourth, its value after tag, type and count
+        media_file.seek(8 + 2 + 3 * 12 + 8)
+        media_file.write(b'\x07\x00')
+    mediainfo_dict = mbp.read_media_header(name_with_path)
+    assert mediainfo_dict['Compression'] == 'JPEG'
+    assert mediainfo_dict['Compression_Mode'] == 'Lossy'
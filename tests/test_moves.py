@@ -0,0 +1,57 @@
+import os
+import pytest
+
+import microservices_batch_processing as mbp
+from conftest import run_inventory, write_files, catalog_record
+
+# the fingerprint collected while hashing is the one file_fingerprint() reads
+@pytest.mark.parametrize('size', [mbp.move_min_size, mbp.move_min_size + 7, 3 * mbp.move_fingerprint_size + 1, mbp.hash_chunk_size + 3])
+def test_hash_pass_fingerprint(tmp_path, size):
+    name_with_path, = write_files(tmp_path, {'file.bin': os.urandom(size)})
+    hash_result = mbp.hash_file(name_with_path, ['MD5'], 'hashlib', move_candidates={})
+    assert hash_result[3] == 'Hashed'
+    assert hash_result[4] == mbp.file_fingerprint(name_with_path, size)
+
+def move_file(file_dir, old_name, new_name):
+    old_path, new_path = os.path.join(str(file_dir), old_name), os.path.join(str(file_dir), new_name)
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.rename(old_path, new_path)
+    return old_path, new_path
+
+# a big file that moved keeps its checksums in incremental mode,
+#   and is hashed in full runs, in both it's recorded as moved
+@pytest.mark.parametrize('incremental, hash_status', [(True, 'Carried forward'), (False, 'Hashed')])
+def test_moved_file(file_dir, inventory_dir, incremental, hash_status):
+    write_files(file_dir, {'old/big.bin': os.urandom(3 * mbp.move_fingerprint_size), 'old/other.bin': os.urandom(3 * mbp.move_fingerprint_size)})
+    run_inventory(file_dir, inventory_dir, {'incremental': incremental})
+    old_path, new_path = move_file(file_dir, 'old/big.bin', 'new/big.bin')
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'incremental': incremental})
+    assert rows[new_path]['NewFile?'] == 'Moved from %s' % (old_path)
+    assert rows[new_path]['ChecksumStatus'] == hash_status
+    assert rows[new_path]['Checksum'] == mbp.calculate_checksum(new_path, 'MD5')
+    assert old_path not in rows
+    assert inventory_run['change_counts']['Moved'] == 1
+    assert catalog_record(inventory_dir, old_path) == {}
+
+# a file too small to fingerprint is found by its checksum, not reported
+#   as a duplicate of where it was. a copy, whose original is still there, is
+def test_small_moved_file(file_dir, inventory_dir):
+    write_files(file_dir, {'old/small.bin': b'small file', 'old/kept.bin': b'kept file'})
+    run_inventory(file_dir, inventory_dir)
+    old_path, new_path = move_file(file_dir, 'old/small.bin', 'new/small.bin')
+    copy_path, = write_files(file_dir, {'new/kept copy.bin': b'kept file'})
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    assert rows[new_path]['NewFile?'] == 'Moved from %s' % (old_path)
+    assert 'Duplicate' not in rows[new_path]['ChecksumMatchesPast?']
+    assert rows[copy_path]['NewFile?'] == 'First inventory of this file'
+    assert 'Duplicate checksum.' in rows[copy_path]['ChecksumMatchesPast?']
+    assert inventory_run['change_counts']['Moved'] == 1
+
+# without detect_moves a moved file is new, and its old path missing
+def test_moves_not_detected(file_dir, inventory_dir):
+    write_files(file_dir, {'old/small.bin': b'small file'})
+    run_inventory(file_dir, inventory_dir, {'detect_moves': False})
+    old_path, new_path = move_file(file_dir, 'old/small.bin', 'new/small.bin')
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'detect_moves': False})
+    assert rows[new_path]['NewFile?'] == 'First inventory of this file'
+    assert rows[old_path]['RootDirectory'] == 'File is missing or cannot be accessed'
@@ -0,0 +1,44 @@
+import os, time
+import pytest
+
+import microservices_batch_processing as mbp
+from conftest import run_inventory, write_files
+
+# the pipeline of a run, and files found while the first one
+#   (FileNumber 1, the first the walk finds) was being hashed
+@pytest.fixture
+def held_up_first_file(file_dir, monkeypatch):
+    held_up = {'pipeline': None, 'found': [], 'name_with_path': None}
+    new_pipeline = mbp.new_pipeline
+    def keep_pipeline(*args):
+        held_up['pipeline'] = new_pipeline(*args)
+        return held_up['pipeline']
+    hash_file = mbp.hash_file
+    def slow_first_hash_file(name_with_path, *args, **kwargs):
+        if held_up['name_with_path'] is None:
+            held_up['name_with_path'] = next(mbp.walk_files(str(file_dir)))[0]
+        if name_with_path == held_up['name_with_path']:
+            time.sleep(1)
+            held_up['found'].append(held_up['pipeline']['found'])
+        return hash_file(name_with_path, *args, **kwargs)
+    monkeypatch.setattr(mbp, 'new_pipeline', keep_pipeline)
+    monkeypatch.setattr(mbp, 'hash_file', slow_first_hash_file)
+    return held_up
+
+# every file is written once, in FileNumber order, whatever order
+#   the hash workers finish them in
+def test_files_written_in_order(file_dir, inventory_dir, held_up_first_file):
+    paths = write_files(file_dir, {'file_%03d.bin' % file_number: os.urandom(64) for file_number in range(100)})
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'worker_count': 4, 'queue_size': 4})
+    assert [int(row['FileNumber']) for row in rows.values()] == list(range(1, 101))
+    assert all(rows[name_with_path]['Checksum'] == mbp.calculate_checksum(name_with_path, 'MD5') for name_with_path in paths)
+
+# while the file compare is waiting for is held up, the files behind it
+#   stop at the window instead of piling up in the compare stage
+@pytest.mark.parametrize('pool_type', ['thread', 'async'])
+def test_held_up_file_bounds_files_in_flight(file_dir, inventory_dir, held_up_first_file, pool_type):
+    write_files(file_dir, {'file_%03d.bin' % file_number: os.urandom(64) for file_number in range(200)})
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'worker_count': 4, 'queue_size': 4, 'pool_type': pool_type})
+    # the window, plus the one file found and waiting for room
+    assert held_up_first_file['found'] == [4 * len(mbp.pipeline_stage_names) + 1]
+    assert len(rows) == 200
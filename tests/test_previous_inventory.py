@@ -0,0 +1,111 @@
+import os, csv
+
+import microservices_batch_processing as mbp
+from conftest import run_inventory, write_files
+
+# an inventory file as run_inventory() writes them, with rows of processed,
+#   not selected and missing files. rows are (path, status, checksum)
+def write_inventory(inventory_dir, file_dir, time_stamp, rows):
+    inventory_name = os.path.join(str(inventory_dir), '__Inventory_%s___%s.csv' % (mbp.inventory_path_name(str(file_dir)), time_stamp))
+    with open(inventory_name, 'w', encoding='utf-8', newline='') as inventory_outfile:
+        inventory_outfile.write(mbp.inventory_header(['MD5']))
+        inventory_writer = csv.writer(inventory_outfile, dialect='backtick')
+        for file_number, (name_with_path, status, checksum) in enumerate(rows, 1):
+            root, name = os.path.split(name_with_path)
+            if status == 'Missing':
+                inventory_writer.writerow(['', name_with_path, 'File in inventory, not directory'])
+            else:
+                inventory_writer.writerow([time_stamp, name_with_path, root, name, 'Not selected' if status == 'Not selected' else ' ', checksum, 'MD5', ' ', ' ', '', file_number, 'Hashed'])
+    return inventory_name
+
+def checksum_of(text):
+    return ('%032x' % (abs(hash(text)) % 16 ** 32))
+
+# every row can be looked up in the sidecar, which is made once
+#   and kept for as long as the inventory doesn't change
+def test_sidecar_round_trip(tmp_path):
+    file_dir = os.path.join(str(tmp_path), 'files')
+    rows = [(os.path.join(file_dir, dir_name, 'file_%s.tif' % file_number), 'Processed', checksum_of(dir_name + str(file_number))) for dir_name in ('b', 'a', 'a/c', 'd e') for file_number in range(5)]
+    rows += [(os.path.join(file_dir, 'a', 'skipped.tmp'), 'Not selected', checksum_of('skipped')), (os.path.join(file_dir, 'gone.tif'), 'Missing', '')]
+    inventory_name = write_inventory(tmp_path, file_dir, '2024-01-01_00h00m00s', rows)
+    previous_inventory = mbp.load_previous_inventory(inventory_name)
+    try:
+        assert previous_inventory['count'] == len(rows)
+        for name_with_path, status, checksum in rows:
+            assert mbp.previous_inventory_lookup(previous_inventory, name_with_path) == (checksum, mbp.previous_inventory_statuses.index(status))
+        assert mbp.previous_inventory_lookup(previous_inventory, os.path.join(file_dir, 'a', 'never.tif')) is None
+        assert mbp.previous_inventory_lookup(previous_inventory, os.path.join(file_dir, 'z', 'file_0.tif')) is None
+        assert sorted(mbp.previous_inventory_paths(previous_inventory)) == sorted(name_with_path for name_with_path, status, checksum in rows)
+        # paths found in a run are marked, the rest are left over
+        for name_with_path, status, checksum in rows[1:]:
+            mbp.previous_inventory_match(previous_inventory, name_with_path)
+        mbp.previous_inventory_match(previous_inventory, os.path.join(file_dir, 'a', 'never.tif'))
+        assert list(mbp.previous_inventory_unmatched_paths(previous_inventory)) == [rows[0][0]]
+    finally:
+        mbp.close_previous_inventory(previous_inventory)
+    sidecar_mtime = os.stat(inventory_name + '.idx').st_mtime_ns
+    previous_inventory = mbp.load_previous_inventory(inventory_name)
+    mbp.close_previous_inventory(previous_inventory)
+    assert os.stat(inventory_name + '.idx').st_mtime_ns == sidecar_mtime
+
+# a sidecar that doesn't match its inventory any more is made again
+def test_sidecar_rebuilt_when_stale(tmp_path):
+    file_dir = os.path.join(str(tmp_path), 'files')
+    first_path = os.path.join(file_dir, 'first.tif')
+    inventory_name = write_inventory(tmp_path, file_dir, '2024-01-01_00h00m00s', [(first_path, 'Processed', checksum_of('first'))])
+    mbp.close_previous_inventory(mbp.load_previous_inventory(inventory_name))
+    second_path = os.path.join(file_dir, 'second.tif')
+    write_inventory(tmp_path, file_dir, '2024-01-01_00h00m00s', [(first_path, 'Processed', checksum_of('first')), (second_path, 'Processed', checksum_of('second'))])
+    previous_inventory = mbp.load_previous_inventory(inventory_name)
+    try:
+        assert mbp.previous_inventory_lookup(previous_inventory, second_path) == (checksum_of('second'), 0)
+    finally:
+        mbp.close_previous_inventory(previous_inventory)
+    # and one that was cut short
+    with open(inventory_name + '.idx', 'r+b') as sidecar_file:
+        sidecar_file.truncate(os.path.getsize(inventory_name + '.idx') - 4)
+    previous_inventory = mbp.load_previous_inventory(inventory_name)
+    try:
+        assert mbp.previous_inventory_lookup(previous_inventory, first_path) == (checksum_of('first'), 0)
+    finally:
+        mbp.close_previous_inventory(previous_inventory)
+
+# the latest inventories of a dir and the dirs above and below it are
+#   merged: the newest record of each path wins, only paths under the
+#   dir are kept, and the merged sidecar goes when it's closed
+def test_merge_related_inventories(tmp_path):
+    inventory_dir = tmp_path / 'inventories'
+    inventory_dir.mkdir()
+    parent_dir = os.path.join(str(tmp_path), 'files')
+    file_dir = os.path.join(parent_dir, 'scans')
+    kept_path = os.path.join(file_dir, 'kept.tif')
+    changed_path = os.path.join(file_dir, 'sub', 'changed.tif')
+    outside_path = os.path.join(parent_dir, 'other', 'outside.tif')
+    write_inventory(inventory_dir, parent_dir, '2024-01-01_00h00m00s', [(kept_path, 'Processed', checksum_of('kept')), (changed_path, 'Processed', checksum_of('before')), (outside_path, 'Processed', checksum_of('outside'))])
+    write_inventory(inventory_dir, os.path.join(file_dir, 'sub'), '2024-02-01_00h00m00s', [(changed_path, 'Processed', checksum_of('after'))])
+    # not related, a dir next to it whose name starts the same
+    write_inventory(inventory_dir, file_dir + '_old', '2024-03-01_00h00m00s', [(os.path.join(file_dir + '_old', 'kept.tif'), 'Processed', checksum_of('old'))])
+    modified_path, first_inventory_of_dir, previous_inventory = mbp.check_for_inventories(file_dir, str(inventory_dir))
+    try:
+        assert not first_inventory_of_dir
+        assert len(previous_inventory['inventory_names']) == 2
+        assert mbp.previous_inventory_lookup(previous_inventory, kept_path) == (checksum_of('kept'), 0)
+        assert mbp.previous_inventory_lookup(previous_inventory, changed_path) == (checksum_of('after'), 0)
+        assert mbp.previous_inventory_lookup(previous_inventory, outside_path) is None
+        assert sorted(mbp.previous_inventory_paths(previous_inventory)) == sorted([kept_path, changed_path])
+        merged_sidecar_name = previous_inventory['sidecar_name']
+    finally:
+        mbp.close_previous_inventory(previous_inventory)
+    assert not os.path.exists(merged_sidecar_name)
+
+# files gone since the last run are listed as missing, and files that
+#   aren't selected are listed as not selected, not as missing
+def test_missing_and_not_selected_rows(file_dir, inventory_dir):
+    kept_path, gone_path, skipped_path = write_files(file_dir, {'a/kept.tif': b'kept', 'a/gone.tif': b'gone', 'b/skipped.tmp': b'skipped'})
+    run_inventory(file_dir, inventory_dir, file_type_string='tif')
+    os.remove(gone_path)
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, file_type_string='tif')
+    assert sorted(rows) == sorted([kept_path, gone_path, skipped_path])
+    assert rows[kept_path]['NewFile?'] != 'First inventory of this file'
+    assert list(rows[gone_path].values())[2] == 'File is missing or cannot be accessed'
+    assert rows[skipped_path]['ProcessingError'] == 'Not selected'
@@ -0,0 +1,128 @@
+import os, json, time, types
+
+import microservices_batch_processing as mbp
+import benchmarks
+from conftest import run_inventory, write_files
+
+def rename_item(old_name_with_path, checksum):
+    root, name = os.path.split(old_name_with_path)
+    return {'name_with_path': os.path.join(root, mbp.checksum_file_name(name, 'MD5', checksum)), 'renamed_from': old_name_with_path, 'rename_failed': False}
+
+def test_checksum_file_name_round_trip():
+    checksum = 'D41D8CD98F00B204E9800998ECF8427E'
+    assert mbp.checksum_file_name('scan.final.tif', 'md5', checksum) == 'scan.final___MD5_d41d8cd98f00b204e9800998ecf8427e.tif'
+    assert mbp.checksum_from_file_name('scan.final___MD5_d41d8cd98f00b204e9800998ecf8427e.tif') == ('MD5', checksum.lower())
+    assert mbp.checksum_from_file_name(mbp.checksum_file_name('README', 'MD5', checksum)) == ('MD5', checksum.lower())
+    # too short for an MD5, and an algorithm that isn't known
+    assert mbp.checksum_from_file_name('scan___MD5_d41d8cd9.tif') is None
+    assert mbp.checksum_from_file_name('scan___CRC_d41d8cd98f00b204e9800998ecf8427e.tif') is None
+
+# a journal left by a run that stopped part way through a batch: the
+#   renames that weren't done are done, the ones that were are skipped
+def test_replay_renames_finishes_batch(tmp_path):
+    paths = write_files(tmp_path, {'file_%s.tif' % file_number: str(file_number).encode() for file_number in range(4)})
+    file_items = [rename_item(name_with_path, '%032x' % file_number) for file_number, name_with_path in enumerate(paths)]
+    rename_journal_name = str(tmp_path / ('temp.csv' + mbp.rename_journal_suffix))
+    mbp.write_journal(rename_journal_name, {'renames': [(file_item['renamed_from'], file_item['name_with_path']) for file_item in file_items]})
+    os.rename(file_items[0]['renamed_from'], file_items[0]['name_with_path'])
+    os.rename(file_items[1]['renamed_from'], file_items[1]['name_with_path'])
+    mbp.replay_renames(rename_journal_name)
+    for file_item in file_items:
+        assert os.path.exists(file_item['name_with_path']) and not os.path.exists(file_item['renamed_from'])
+    assert not os.path.exists(rename_journal_name)
+    # with no journal there's nothing to do
+    mbp.replay_renames(rename_journal_name)
+
+# a file whose new name is taken keeps its name, and the rest are renamed
+def test_rename_conflict_keeps_name(tmp_path):
+    paths = write_files(tmp_path, {'first.tif': b'first', 'second.tif': b'second'})
+    file_items = [rename_item(name_with_path, '%032x' % file_number) for file_number, name_with_path in enumerate(paths)]
+    write_files(tmp_path, {os.path.basename(file_items[1]['name_with_path']): b'already there'})
+    rename_journal_name = str(tmp_path / ('temp.csv' + mbp.rename_journal_suffix))
+    mbp.rename_files(rename_journal_name, file_items)
+    assert os.path.exists(file_items[0]['name_with_path']) and not os.path.exists(paths[0])
+    assert file_items[1] == {'name_with_path': paths[1], 'renamed_from': '', 'rename_failed': True}
+    with open(paths[1], 'rb') as second_file:
+        assert second_file.read() == b'second'
+    assert not os.path.exists(rename_journal_name)
+
+# files are renamed with their checksum, the next run leaves them be,
+#   and one changed since it was named is reported
+def test_embed_checksums(file_dir, inventory_dir):
+    paths = write_files(file_dir, {'a/scan_%s.bin' % file_number: os.urandom(512) for file_number in range(5)})
+    checksums = {name_with_path: mbp.calculate_checksum(name_with_path, 'MD5') for name_with_path in paths}
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'embed_checksums': True})
+    renamed_paths = []
+    for name_with_path, checksum in checksums.items():
+        root, name = os.path.split(name_with_path)
+        renamed_path = os.path.join(root, mbp.checksum_file_name(name, 'MD5', checksum))
+        assert not os.path.exists(name_with_path) and os.path.exists(renamed_path)
+        assert rows[renamed_path]['FileName'] == '%s (renamed from %s)' % (os.path.basename(renamed_path), name)
+        renamed_paths.append(renamed_path)
+    with open(renamed_paths[0], 'ab') as changed_file:
+        changed_file.write(b'changed')
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'embed_checksums': True})
+    assert sorted(os.listdir(str(file_dir / 'a'))) == sorted(os.path.basename(renamed_path) for renamed_path in renamed_paths)
+    assert rows[renamed_paths[0]]['ChecksumMatchesPast?'] == 'Checksum does not match file name.'
+    for renamed_path in renamed_paths[1:]:
+        assert rows[renamed_path]['FileName'] == os.path.basename(renamed_path)
+
+# files that carry their checksum are still read in full runs, and only
+#   checked against the catalog without reading them in incremental ones
+def test_name_audit_reads_files_unless_incremental(file_dir, inventory_dir, share, monkeypatch):
+    # none of them are today's share of the rolling re-verification
+    monkeypatch.setattr(mbp, 'zlib', types.SimpleNamespace(crc32=lambda data: int(time.time() // 86400) + 1))
+    paths = write_files(file_dir, {'scan_%s.bin' % file_number: os.urandom(512) for file_number in range(3)})
+    run_inventory(file_dir, inventory_dir, {'embed_checksums': True})
+    share['root'] = str(file_dir)
+    renamed_paths = [os.path.join(str(file_dir), name) for name in os.listdir(str(file_dir))]
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    for renamed_path in renamed_paths:
+        assert share['opens'][renamed_path] == 1
+        assert rows[renamed_path]['ChecksumStatus'] == 'Hashed'
+    share['opens'].clear()
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'incremental': True})
+    for renamed_path in renamed_paths:
+        assert share['opens'][renamed_path] == 0
+        assert rows[renamed_path]['ChecksumStatus'] == 'Carried forward'
+
+# the rename journal of a stopped run is finished before the next run
+#   looks at the files, so they're inventoried under their new names
+def test_rename_journal_replayed_at_start(file_dir, inventory_dir):
+    name_with_path, = write_files(file_dir, {'scan.bin': b'scan data'})
+    file_item = rename_item(name_with_path, mbp.calculate_checksum(name_with_path, 'MD5'))
+    temp_inventory = os.path.join(str(inventory_dir), '__Inventory_%s___TEMPINVENTORY1.csv' % (mbp.inventory_path_name(str(file_dir))))
+    with open(temp_inventory + mbp.rename_journal_suffix, 'w', encoding='utf-8') as journal_outfile:
+        json.dump({'renames': [(file_item['renamed_from'], file_item['name_with_path'])]}, journal_outfile)
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    assert os.path.exists(file_item['name_with_path']) and not os.path.exists(name_with_path)
+    assert file_item['name_with_path'] in rows
+    assert not os.path.exists(temp_inventory + mbp.rename_journal_suffix)
+
+# media files are deep verified where they are, before they're renamed
+def test_deep_verify_before_rename(file_dir, inventory_dir):
+    name_with_path = str(file_dir / 'scan.jpg')
+    benchmarks.make_test_jpeg(name_with_path, 64, 48)
+    checksum = mbp.calculate_checksum(name_with_path, 'MD5')
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'embed_checksums': True, 'deep_verify_workers': 1})
+    renamed_path = str(file_dir / mbp.checksum_file_name('scan.jpg', 'MD5', checksum))
+    assert os.path.exists(renamed_path)
+    assert rows[renamed_path]['FileCorrupt?'] == ''
+
+# a file that already carries its checksum is still new the first time
+#   it's inventoried, and moved when it's moved
+def test_named_file_new_and_moved(file_dir, inventory_dir):
+    name_with_path, = write_files(file_dir, {'old/scan.bin': b'scan data'})
+    named_path = os.path.join(str(file_dir), 'old', mbp.checksum_file_name('scan.bin', 'MD5', mbp.calculate_checksum(name_with_path, 'MD5')))
+    os.rename(name_with_path, named_path)
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    assert rows[named_path]['NewFile?'] == 'First inventory of this file'
+    assert rows[named_path]['ChecksumMatchesPast?'] == ' '
+    assert inventory_run['change_counts']['New'] == 1
+    moved_path = os.path.join(str(file_dir), 'new', os.path.basename(named_path))
+    os.makedirs(os.path.dirname(moved_path))
+    os.rename(named_path, moved_path)
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    assert rows[moved_path]['NewFile?'] == 'Moved from %s' % (named_path)
+    assert rows[moved_path]['ChecksumMatchesPast?'] == ' '
+    assert named_path not in rows
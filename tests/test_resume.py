@@ -0,0 +1,72 @@
+import os
+import pytest
+
+import microservices_batch_processing as mbp
+from conftest import run_inventory, inventory_rows, write_files
+
+class Interrupted(Exception):
+    pass
+
+# a run that stops after stop_after files have been written,
+#   with a checkpoint after every file
+def interrupted_run(file_dir, inventory_dir, monkeypatch, stop_after, checksum_type='MD5'):
+    monkeypatch.setattr(mbp, 'inventory_flush_bytes', 1)
+    accumulation = mbp.accumulation
+    written = []
+    def interrupting_accumulation(inventory_writer, time_stamp, name_with_path, *args):
+        if len(written) == stop_after:
+            raise Interrupted(name_with_path)
+        written.append(name_with_path)
+        return accumulation(inventory_writer, time_stamp, name_with_path, *args)
+    monkeypatch.setattr(mbp, 'accumulation', interrupting_accumulation)
+    with pytest.raises(Interrupted):
+        run_inventory(file_dir, inventory_dir, checksum_type=checksum_type)
+    monkeypatch.setattr(mbp, 'accumulation', accumulation)
+    return written
+
+def temp_inventory_name(file_dir, inventory_dir):
+    return os.path.join(str(inventory_dir), '__Inventory_%s___TEMPINVENTORY1.csv' % (mbp.inventory_path_name(str(file_dir))))
+
+@pytest.fixture
+def twenty_files(file_dir):
+    return write_files(file_dir, {'dir_%s/file_%02d.bin' % (file_number % 3, file_number): os.urandom(1024) for file_number in range(20)})
+
+# the next run carries on after the last checkpoint: files already in the
+#   temp inventory aren't hashed again, and every file has one row
+def test_resume_after_interruption(file_dir, inventory_dir, monkeypatch, share, twenty_files):
+    written = interrupted_run(file_dir, inventory_dir, monkeypatch, 8)
+    temp_inventory = temp_inventory_name(file_dir, inventory_dir)
+    assert sorted(inventory_rows(temp_inventory)) == sorted(written)
+    journal = mbp.read_journal(temp_inventory + '.journal', {'file_dir': str(file_dir), 'checksum_type': 'MD5'})
+    assert journal['file_number'] == 8 and journal['name_with_path'] == written[-1]
+    # half a row written after the checkpoint is cut off
+    with open(temp_inventory, 'a', encoding='utf-8') as temp_inventory_file:
+        temp_inventory_file.write('2024-01-01_00h00m00s`%s`half a row' % (twenty_files[0]))
+    share['root'] = str(file_dir)
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    for name_with_path in twenty_files:
+        assert share['opens'][name_with_path] == (0 if name_with_path in written else 1), name_with_path
+        assert rows[name_with_path]['Checksum'] == mbp.calculate_checksum(name_with_path, 'MD5')
+    with open(inventory_run['inventory_name'], 'r', encoding='utf-8') as inventory_file:
+        assert len(inventory_file.read().splitlines()) == 2 + len(twenty_files)
+    assert sorted(int(row['FileNumber']) for row in rows.values()) == list(range(1, 21))
+    assert inventory_run['files_processed'] == 20
+    assert not os.path.exists(temp_inventory) and not os.path.exists(temp_inventory + '.journal')
+
+# an interrupted run of other checksum types isn't resumed, it starts again
+def test_no_resume_with_other_checksum_type(file_dir, inventory_dir, monkeypatch, share, twenty_files):
+    interrupted_run(file_dir, inventory_dir, monkeypatch, 8, checksum_type='SHA256')
+    share['root'] = str(file_dir)
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    for name_with_path in twenty_files:
+        assert share['opens'][name_with_path] == 1
+        assert rows[name_with_path]['ChecksumType'] == 'MD5'
+    assert len(rows) == len(twenty_files)
+
+# nor is one run with resume off
+def test_resume_off(file_dir, inventory_dir, monkeypatch, share, twenty_files):
+    interrupted_run(file_dir, inventory_dir, monkeypatch, 8)
+    share['root'] = str(file_dir)
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'resume': False})
+    assert all(share['opens'][name_with_path] == 1 for name_with_path in twenty_files)
+    assert len(rows) == len(twenty_files)
@@ -0,0 +1,39 @@
+import os
+import pytest
+
+import microservices_batch_processing as mbp
+from conftest import run_inventory, write_files, catalog_record
+
+# MediaInfo stand-in: fields for every file, except that a batch with
+#   a file named bad_* in it fails. batches records what it was run for
+@pytest.fixture
+def fake_mediainfo(monkeypatch):
+    batches = []
+    def mediainfo_batch(paths):
+        batches.append(list(paths))
+        if any(os.path.basename(name_with_path).startswith('bad_') for name_with_path in paths):
+            raise OSError('MediaInfo failed')
+        return {name_with_path: {'Format/Extensions': 'tif tiff', 'Width': '64', 'Height': '48'} for name_with_path in paths}
+    monkeypatch.setattr(mbp, 'mediainfo_batch', mediainfo_batch)
+    monkeypatch.setattr(mbp, 'mediainfo_version_string', 'MediaInfoLib - test')
+    return batches
+
+# a file MediaInfo fails on keeps its checksum, comparison and catalog entry
+def test_validation_failure_keeps_checksum(file_dir, inventory_dir, fake_mediainfo):
+    name_with_path, = write_files(file_dir, {'bad_scan.tif': b'not really a tiff'})
+    inventory_run, rows = run_inventory(file_dir, inventory_dir)
+    checksum = mbp.calculate_checksum(name_with_path, 'MD5')
+    assert rows[name_with_path]['ProcessingError'] == 'Error in processing while running mediainfo'
+    assert rows[name_with_path]['Checksum'] == checksum
+    assert rows[name_with_path]['NewFile?'] == 'First inventory of this file'
+    assert catalog_record(inventory_dir, name_with_path)['MD5'][0] == checksum
+
+# one file failing a MediaInfo batch only fails that file
+def test_mediainfo_batch_failure_only_fails_that_file(file_dir, inventory_dir, fake_mediainfo):
+    paths = write_files(file_dir, {'scan_%s.tif' % file_number: b'not really a tiff %s' % str(file_number).encode() for file_number in range(4)})
+    bad_path, = write_files(file_dir, {'bad_scan.tif': b'not really a tiff either'})
+    inventory_run, rows = run_inventory(file_dir, inventory_dir, {'validate_workers': 1, 'queue_size': 16})
+    assert rows[bad_path]['ProcessingError'] == 'Error in processing while running mediainfo'
+    for name_with_path in paths:
+        assert rows[name_with_path]['ProcessingError'] == ' '
+    assert any(len(batch) > 1 for batch in fake_mediainfo)
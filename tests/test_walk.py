@@ -0,0 +1,52 @@
+import os, time
+import pytest
+
+import microservices_batch_processing as mbp
+from conftest import write_files
+
+# the same files in the same order as os.walk
+def test_walk_order(tmp_path):
+    write_files(tmp_path, {'%s/%s/file_%s.bin' % (top_dir, sub_dir, file_number): b'' for top_dir in 'cab' for sub_dir in 'yx' for file_number in range(3)})
+    write_files(tmp_path, {'top_%s.bin' % file_number: b'' for file_number in range(3)})
+    walk_paths = [os.path.join(root, name) for root, dirs, names in os.walk(str(tmp_path)) for name in names]
+    assert [name_with_path for name_with_path, file_stat in mbp.walk_files(str(tmp_path), 4)] == walk_paths
+
+# while whatever uses the files waits, the walk stops listing
+#   directories once it's walk_scan_ahead per worker ahead
+def test_walk_read_ahead_is_capped(tmp_path, monkeypatch):
+    write_files(tmp_path, {'dir_%03d/file.bin' % dir_number: b'' for dir_number in range(200)})
+    scan_dir = mbp.scan_dir
+    scanned = []
+    def counting_scan_dir(dir_path):
+        scanned.append(dir_path)
+        return scan_dir(dir_path)
+    monkeypatch.setattr(mbp, 'scan_dir', counting_scan_dir)
+    monkeypatch.setattr(mbp, 'walk_scan_ahead', 2)
+    walk = mbp.walk_files(str(tmp_path), 4)
+    next(walk)
+    time.sleep(0.3)
+    assert len(scanned) <= 1 + 2 * 4
+    assert len(list(walk)) == 199
+
+@pytest.mark.parametrize('name, file_types, include, selected', [
+    ('archive.tar.gz', ['tar.gz'], True, True),
+    ('archive.gz', ['tar.gz'], True, False),
+    ('ARCHIVE.TAR.GZ', ['tar.gz'], True, True),
+    ('archive.tar.gz', ['tar.gz'], False, False),
+    ('scan.tif', ['tar.gz', 'tif'], True, True),
+    ('scan.tif', [], True, True),
+    ('._scan.tif', [], True, False),
+])
+def test_file_is_selected(name, file_types, include, selected):
+    assert mbp.file_is_selected(name, mbp.extension_suffixes(file_types), include, ' '.join(file_types)) == selected
+
+def test_file_name_inventory_selects_multi_dot_types(file_dir, tmp_path):
+    paths = write_files(file_dir, {'a/archive.tar.gz': b'a', 'a/archive.gz': b'b', 'b/scan.tif': b'c'})
+    not_selected_acc = mbp.new_not_selected_acc()
+    file_name_acc_name = str(tmp_path / 'File_Name_Acc.txt')
+    selected = [name_with_path for file_number, name_with_path, file_stat in mbp.file_name_inventory(str(file_dir), True, 'tar.gz', ['tar.gz'], not_selected_acc, file_name_acc_name, 2)]
+    assert selected == [paths[0]]
+    assert sorted(mbp.not_selected_paths(not_selected_acc)) == sorted(paths[1:])
+    assert not_selected_acc['count'] == 2
+    with open(file_name_acc_name, 'r', encoding='utf-8') as file_name_acc_file:
+        assert '1: %s' % (paths[0]) in file_name_acc_file.read()